@@ -4,8 +4,13 @@ from waitress import serve
 
 import constants
 import view
+from avro_decode_pool import AvroDecodePool
+from avro_client import AvroClient
 from config_handler import ConnectionConfig
+from kafka_manager import ConsumerConnectionManager
 from logger import RequestLogger
+from search_jobs import SearchJobs
+from token_index import TokenIndex
 
 # Get constants from constants.py
 configuration_directory = constants.DIRECTORY_CONFIGURATIONS
@@ -31,6 +36,8 @@ app.register_blueprint(view.view)
 if __name__ == '__main__':
     # initialize logger, create directory and log file
     RequestLogger.create_logger()
+    # Start background token indexers of topics listed in main config
+    TokenIndex.start_indexers()
     # app.debug = True Allows for pretty print in response
     app.debug = True
     app.config["JSON_SORT_KEYS"] = False
@@ -40,8 +47,20 @@ if __name__ == '__main__':
         'flask.ext.api.parsers.MultiPartParser'
     ]
     # Production WSGI server "waitress"
-    serve(app, host=ConnectionConfig.connection_details.get('hostname'),
-          port=ConnectionConfig.connection_details.get('port'))
+    try:
+        serve(app, host=ConnectionConfig.connection_details.get('hostname'),
+              port=ConnectionConfig.connection_details.get('port'))
+    finally:
+        # Cancel background search jobs
+        SearchJobs.shutdown()
+        TokenIndex.stop_indexers()
+        AvroDecodePool.shutdown()
+        # Remove decrypted registry pem files
+        AvroClient.invalidate_cache()
+        # Close long-lived pooled kafka consumers
+        ConsumerConnectionManager.close_pools()
+        # Write queued request audit records
+        RequestLogger.shutdown()
 
     # Flask built in server (can use when running locally)
     # app.run()
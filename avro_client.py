@@ -1,3 +1,5 @@
+import threading
+
 from confluent_kafka.serialization import *
 
 from avro_deserializer import Deserializer
@@ -6,19 +8,41 @@ from error_handler import ErrorHandler
 
 
 class AvroClient:
+    """
+    Avro deserializer of a topic. Registry clients (per environment) and deserializers (per environment and topic)
+    are built once and shared by all requests. Deserializers keep the writer schemas they fetch from the registry,
+    cached by schema id, so after warm-up loading a deserializer makes no registry or file system calls.
+    Cached objects are dropped with invalidate_cache().
+    """
+    # (environment, topic name) -> tuple() (schema string, AvroDeserializer())
+    __deserializers = {}
+    __lock = threading.Lock()
+    # Incremented by invalidate_cache(), avro decode pool workers drop their deserializers when it changes
+    cache_generation = 0
 
     def __init__(self, environment):
         try:
+            self.environment = environment
             self.registry_client = RegistryClient(environment).registry_client
             self.msg_field = MessageField()
             self.deserializer = None
             self.serial_context = None
+            self.schema_string = None
         except Exception as e:
             raise ErrorHandler("Unable to initialize AvroClient(): " + str(e))
 
     def load_deserializer(self, topic_name):
         try:
-            self.deserializer = Deserializer(self.registry_client).create_avro_deserializer(topic_name)
+            cached = self.__deserializers.get((self.environment, topic_name))
+            if cached is None:
+                with self.__lock:
+                    cached = self.__deserializers.get((self.environment, topic_name))
+                    if cached is None:
+                        deserializer = Deserializer(self.registry_client)
+                        schema_string = deserializer.load_avro_schema_string(topic_name)
+                        cached = (schema_string, deserializer.create_avro_deserializer(topic_name, schema_string))
+                        self.__deserializers[(self.environment, topic_name)] = cached
+            self.schema_string, self.deserializer = cached
             self.serial_context = SerializationContext(topic_name, self.msg_field)
         except Exception as e:
             raise ErrorHandler(
@@ -30,3 +54,18 @@ class AvroClient:
             return self.deserializer.__call__(msg.value(), self.serial_context)
         except Exception as e:
             raise ErrorHandler("Error deserializing avro message. Check registry settings: " + str(e))
+
+    @classmethod
+    def invalidate_cache(cls, environment=None, topic_name=None):
+        """
+        Drop cached deserializers, schema strings and registry clients, all of them or those of given environment
+        and/or topic. Used after schema files, registry settings or certificates change, and at shutdown.
+        """
+        with cls.__lock:
+            for key in [key for key in cls.__deserializers
+                        if environment in (None, key[0]) and topic_name in (None, key[1])]:
+                del cls.__deserializers[key]
+            AvroClient.cache_generation += 1
+        Deserializer.invalidate(topic_name)
+        if topic_name is None:
+            RegistryClient.invalidate(environment)
@@ -0,0 +1,127 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import util
+
+import constants
+import default_constants
+from avro_client import AvroClient
+from config_handler import ConnectionConfig
+from error_handler import ErrorHandler
+from message_filter import SearchMatcher
+
+
+class AvroDecodePool:
+    """
+    Optional process pool decoding avro messages outside of the request threads (and their GIL), enabled with
+    'avro.decode.workers' in main config. Batches of raw message values are split into chunks decoded in parallel,
+    only matching messages are sent back. Worker processes keep their avro deserializers between chunks, until
+    AvroClient.invalidate_cache() is called in the application process (/avro/invalidate): chunks carry the
+    application's cache generation and workers seeing a new one drop every cached deserializer, schema string and
+    registry client before decoding.
+    """
+    # Main config keys
+    config_workers_key = constants.CONFIG_AVRO_DECODE_WORKERS_KEY
+    config_chunk_size_key = constants.CONFIG_AVRO_DECODE_CHUNK_SIZE_KEY
+    default_workers = default_constants.DEFAULT_AVRO_DECODE_WORKERS
+    default_chunk_size = default_constants.DEFAULT_AVRO_DECODE_CHUNK_SIZE
+
+    # Worker process state: (environment, topic name) -> AvroClient(), loaded in AvroClient cache generation
+    worker_clients = {}
+    worker_generation = None
+
+    __executor = None
+    __lock = threading.Lock()
+
+    @classmethod
+    def enabled(cls):
+        return cls.__configured_workers() > 0
+
+    @classmethod
+    def match_msgs(cls, environment, topic, search_terms, field_filters, msgs):
+        """
+        Decode messages in the pool and keep those containing any of the search terms and passing the field filters.
+        :param search_terms: tuple() of normalized search terms, see message_filter.SearchMatcher()
+        :param field_filters: tuple() of normalized field filters, see message_filter.FieldPredicates()
+        :param msgs: list() of confluent_kafka.Message()
+        :return: list() of tuple() (confluent_kafka.Message(), decoded message, list() of matched terms), in the
+                 order of msgs
+        """
+        chunk_size = int((ConnectionConfig.connection_details or {}).get(cls.config_chunk_size_key,
+                                                                          cls.default_chunk_size))
+        executor = cls.__get_executor()
+        generation = AvroClient.cache_generation
+        futures = [(start, executor.submit(cls.decode_chunk, environment, topic, generation, search_terms,
+                                           field_filters, [msg.value() for msg in msgs[start:start + chunk_size]]))
+                   for start in range(0, len(msgs), chunk_size)]
+        matches = []
+        for start, future in futures:
+            chunk_matches, error = future.result()
+            if error:
+                raise ErrorHandler(error)
+            matches.extend((msgs[start + index], data, matched_terms) for index, data, matched_terms in chunk_matches)
+        return matches
+
+    @classmethod
+    def shutdown(cls):
+        """Stop worker processes, used at application shutdown"""
+        with cls.__lock:
+            executor, cls.__executor = cls.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    @staticmethod
+    def initialize_worker(connection_details, avro_topics):
+        """Runs in every worker process, which does not share the application's loaded configs"""
+        ConnectionConfig.connection_details = connection_details
+        ConnectionConfig.avro_topics = avro_topics
+        # Remove the worker's decrypted registry pem files when it exits
+        util.Finalize(None, AvroClient.invalidate_cache, exitpriority=10)
+
+    @staticmethod
+    def decode_chunk(environment, topic, generation, search_terms, field_filters, values):
+        """
+        Runs in a worker process.
+        :param generation: int, AvroClient.cache_generation of the application process, cached deserializers of
+                           another generation are dropped
+        :param values: list() of raw message values
+        :return: tuple() (list() of tuple() (index in values, decoded message, matched terms) of the messages
+                 matching the search, error)
+        """
+        if AvroDecodePool.worker_generation != generation:
+            if AvroDecodePool.worker_generation is not None:
+                AvroDecodePool.worker_clients.clear()
+                AvroClient.invalidate_cache()
+            AvroDecodePool.worker_generation = generation
+        avro_client = AvroDecodePool.worker_clients.get((environment, topic))
+        if avro_client is None:
+            try:
+                avro_client = AvroClient(environment)
+                avro_client.load_deserializer(topic)
+            except Exception as e:
+                return [], str(e)
+            AvroDecodePool.worker_clients[(environment, topic)] = avro_client
+        matcher = SearchMatcher.for_terms(search_terms, field_filters)
+        matches = []
+        for index, value in enumerate(values):
+            try:
+                data = avro_client.deserializer(value, avro_client.serial_context)
+            except Exception as e:
+                return [], "Error deserializing avro message. Check registry settings: " + str(e)
+            matched_terms = matcher.match_message(data)
+            if matched_terms is not None:
+                matches.append((index, data, matched_terms))
+        return matches, None
+
+    @classmethod
+    def __get_executor(cls):
+        if cls.__executor is None:
+            with cls.__lock:
+                if cls.__executor is None:
+                    cls.__executor = ProcessPoolExecutor(
+                        max_workers=cls.__configured_workers(), initializer=cls.initialize_worker,
+                        initargs=(ConnectionConfig.connection_details, ConnectionConfig.avro_topics))
+        return cls.__executor
+
+    @classmethod
+    def __configured_workers(cls):
+        return int((ConnectionConfig.connection_details or {}).get(cls.config_workers_key, cls.default_workers))
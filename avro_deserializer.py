@@ -1,3 +1,5 @@
+import threading
+
 from confluent_kafka.schema_registry.avro import AvroDeserializer
 
 import constants
@@ -8,20 +10,40 @@ from error_handler import ErrorHandler
 class Deserializer:
     directory_avro_schemas = constants.DIRECTORY_AVRO_SCHEMAS
 
+    # topic name -> reader schema string, schema files are read once
+    __schema_strings = {}
+    __lock = threading.Lock()
+
     def __init__(self, registry_client):
         self.config_avro_location = ConnectionConfig.avro_topics
         self.registry_client = registry_client
 
-    def create_avro_deserializer(self, topic_name):
-        schema_string = self.load_avro_schema_string(topic_name)
+    def create_avro_deserializer(self, topic_name, schema_string=None):
+        if schema_string is None:
+            schema_string = self.load_avro_schema_string(topic_name)
         return AvroDeserializer(schema_string, self.registry_client)
 
     def load_avro_schema_string(self, topic_name):
         if topic_name not in self.config_avro_location:
             raise ErrorHandler("Error. Application does not have avro schema for requested topic")
+        schema_string = self.__schema_strings.get(topic_name)
+        if schema_string is not None:
+            return schema_string
         try:
             with open(self.directory_avro_schemas + "/" + self.config_avro_location.get(topic_name),
                       'r') as schema_file:
-                return schema_file.read().replace('\n', '')
+                schema_string = schema_file.read().replace('\n', '')
         except Exception as e:
             raise ErrorHandler("Error. Unable to load schema: " + str(e))
+        with self.__lock:
+            self.__schema_strings[topic_name] = schema_string
+        return schema_string
+
+    @classmethod
+    def invalidate(cls, topic_name=None):
+        """Drop cached schema string of given topic, or of all topics if none given, schema files are read again"""
+        with cls.__lock:
+            if topic_name is None:
+                cls.__schema_strings.clear()
+            else:
+                cls.__schema_strings.pop(topic_name, None)
@@ -1,3 +1,5 @@
+import threading
+
 from confluent_kafka.schema_registry import SchemaRegistryClient
 
 from config_handler import ConnectionConfig
@@ -5,19 +7,52 @@ from pfx_to_pem_handler import PFXReader
 
 
 class RegistryClient:
+    """
+    Schema registry client of an environment. Clients are created once per environment and shared by all requests,
+    along with the pem file decrypted from the environment's pfx (used by the client for every registry call).
+    """
+    # environment -> tuple() (SchemaRegistryClient(), pem file path)
+    __clients = {}
+    __lock = threading.Lock()
 
     def __init__(self, environment):
-        self.registry_client = self.create_schema_registry_client(environment)
+        self.registry_client = self.get_registry_client(environment)
+
+    @classmethod
+    def get_registry_client(cls, environment):
+        cached = cls.__clients.get(environment)
+        if cached is None:
+            with cls.__lock:
+                cached = cls.__clients.get(environment)
+                if cached is None:
+                    cached = cls.__create_schema_registry_client(environment)
+                    cls.__clients[environment] = cached
+        return cached[0]
 
-    def create_schema_registry_client(self, environment):
-        pfx_reader = PFXReader()
-        with pfx_reader.pfx_to_pem(environment) as certX:
+    @classmethod
+    def invalidate(cls, environment=None):
+        """
+        Drop the cached client of given environment, or of all environments if none given, and remove its pem file.
+        Clients are created again with current config and certificates on next use.
+        """
+        with cls.__lock:
+            environments = list(cls.__clients) if environment is None else [environment]
+            dropped = [cls.__clients.pop(env) for env in environments if env in cls.__clients]
+        for registry_client, pem_file in dropped:
+            PFXReader.remove_pem(pem_file)
+
+    @classmethod
+    def __create_schema_registry_client(cls, environment):
+        pem_file = PFXReader.write_pem(environment)
+        try:
             schema_client_settings = {
                 "url": ConnectionConfig.connection_details['schema_registry_url'][environment],
-                'ssl.key.location': certX,
+                'ssl.key.location': pem_file,
                 'ssl.certificate.location': ConnectionConfig.connection_details['ssl'][environment][
                     'ssl.certificate.location'],
                 'ssl.ca.location': ConnectionConfig.connection_details['ssl.ca.location']
             }
-
-        return SchemaRegistryClient(schema_client_settings)
+            return SchemaRegistryClient(schema_client_settings), pem_file
+        except Exception:
+            PFXReader.remove_pem(pem_file)
+            raise
@@ -0,0 +1,325 @@
+import io
+import json
+import os
+import random
+import struct
+import threading
+import time
+
+import fastavro
+from confluent_kafka import KafkaError, OFFSET_BEGINNING, OFFSET_END, TIMESTAMP_CREATE_TIME, TopicPartition
+from confluent_kafka.schema_registry import Schema
+
+import avro_client
+import avro_deserializer
+import avro_schema_registry_client
+import constants
+import kafka_manager
+
+AVRO_SCHEMA_FILE = 'benchmark.avsc'
+
+
+class FakeTopics:
+    """
+    Synthetic topics served by FakeConsumer(): topic name -> list() of partitions, each a list() of tuple()
+    (key, value, timestamp). Generated in memory, identically in every process given the same settings.
+    """
+    # Token included in matching messages
+    search_token = 'needle7f3a'
+    # Words making up message padding (never match the search token or the field filters of benchmarks)
+    padding_words = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet')
+    statuses = ('NEW', 'PAID', 'SHIPPED', 'CANCELLED')
+    avro_schema = {
+        'type': 'record', 'name': 'BenchmarkMessage', 'fields': [
+            {'name': 'id', 'type': 'string'},
+            {'name': 'customer', 'type': {'type': 'record', 'name': 'Customer', 'fields': [
+                {'name': 'id', 'type': 'string'}, {'name': 'name', 'type': 'string'}]}},
+            {'name': 'status', 'type': 'string'},
+            {'name': 'amount', 'type': 'double'},
+            {'name': 'note', 'type': 'string'}]}
+    # Schema id written in the confluent wire format header of avro messages
+    avro_schema_id = 1
+    base_timestamp_ms = 1600000000000
+
+    topics = {}
+    # Consumer statistics: messages and value bytes returned by consume()/poll()
+    delivered_messages = 0
+    delivered_bytes = 0
+    __lock = threading.Lock()
+
+    @classmethod
+    def generate(cls, topic, message_type, partitions, messages_per_partition, message_bytes, selectivity, seed=0):
+        """
+        :param message_type: string, 'json' or 'avro' (confluent wire format, schema id avro_schema_id)
+        :param message_bytes: int, approximate size of each message value
+        :param selectivity: float, fraction of messages containing search_token (and customer id 'cust-match')
+        """
+        rng = random.Random(seed)
+        parsed_schema = fastavro.parse_schema(cls.avro_schema)
+        cls.topics[topic] = []
+        for partition_id in range(partitions):
+            msgs = []
+            for offset in range(messages_per_partition):
+                match = rng.random() < selectivity
+                body = {'id': 'msg-' + str(partition_id) + '-' + str(offset),
+                        'customer': {'id': 'cust-match' if match else 'cust-' + str(rng.randint(0, 99999)),
+                                     'name': rng.choice(cls.padding_words)},
+                        'status': rng.choice(cls.statuses),
+                        'amount': round(rng.uniform(0, 1000), 2),
+                        'note': ''}
+                words = [cls.search_token] if match else []
+                used = len(json.dumps(body)) + len(cls.search_token if match else '')
+                while used < message_bytes:
+                    words.append(rng.choice(cls.padding_words))
+                    used += len(words[-1]) + 1
+                rng.shuffle(words)
+                body['note'] = ' '.join(words)
+                if message_type == 'avro':
+                    value = io.BytesIO()
+                    value.write(struct.pack('>bI', 0, cls.avro_schema_id))
+                    fastavro.schemaless_writer(value, parsed_schema, body)
+                    value = value.getvalue()
+                else:
+                    value = json.dumps(body).encode()
+                msgs.append((body['id'].encode(), value, cls.base_timestamp_ms + offset * 1000))
+            cls.topics[topic].append(msgs)
+
+    @classmethod
+    def total_messages(cls, topic):
+        return sum(len(msgs) for msgs in cls.topics[topic])
+
+    @classmethod
+    def total_bytes(cls, topic):
+        return sum(len(value) for msgs in cls.topics[topic] for key, value, timestamp in msgs)
+
+    @classmethod
+    def count_delivered(cls, msgs):
+        with cls.__lock:
+            cls.delivered_messages += len(msgs)
+            cls.delivered_bytes += sum(len(msg) for msg in msgs)
+
+    @classmethod
+    def reset_counters(cls):
+        with cls.__lock:
+            cls.delivered_messages = 0
+            cls.delivered_bytes = 0
+
+
+class FakeMessage:
+    """Stand-in of confluent_kafka.Message(), same accessors"""
+
+    def __init__(self, topic, partition, offset, key, value, timestamp, error=None):
+        self.__topic = topic
+        self.__partition = partition
+        self.__offset = offset
+        self.__key = key
+        self.__value = value
+        self.__timestamp = timestamp
+        self.__error = error
+
+    def topic(self):
+        return self.__topic
+
+    def partition(self):
+        return self.__partition
+
+    def offset(self):
+        return self.__offset
+
+    def key(self):
+        return self.__key
+
+    def value(self):
+        return self.__value
+
+    def timestamp(self):
+        return TIMESTAMP_CREATE_TIME, self.__timestamp
+
+    def headers(self):
+        return None
+
+    def error(self):
+        return self.__error
+
+    def __len__(self):
+        return len(self.__value or b'')
+
+
+class FakeMetadata:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeConsumer:
+    """
+    In-process stand-in of confluent_kafka.Consumer() serving FakeTopics. Like librdkafka, messages are fetched
+    ahead of consume() calls, up to 'max.partition.fetch.bytes' per fetch. Every fetch sleeps
+    'fetch_latency_seconds' plus its size over 'fetch_bytes_per_second', standing in for the broker round trip and
+    transfer (releasing the GIL like a real fetch).
+    """
+    fetch_latency_seconds = 0.0
+    fetch_bytes_per_second = None
+    default_max_partition_fetch_bytes = 1048576
+
+    def __init__(self, settings=None):
+        self.settings = settings or {}
+        self.partition_eof = self.settings.get('enable.partition.eof', True)
+        self.max_fetch_bytes = int(self.settings.get('max.partition.fetch.bytes',
+                                                     self.default_max_partition_fetch_bytes))
+        # list() of [topic, partition id, position, fetched up to offset, eof sent]
+        self.assignment = []
+
+    def list_topics(self, topic=None, timeout=None):
+        return FakeMetadata(topics={
+            name: FakeMetadata(topic=name, partitions={partition_id: FakeMetadata(id=partition_id)
+                                                       for partition_id in range(len(partitions))})
+            for name, partitions in FakeTopics.topics.items()})
+
+    def assign(self, topic_partitions):
+        self.assignment = [[topic_partition.topic, topic_partition.partition, self.__start_offset(topic_partition),
+                            self.__start_offset(topic_partition), False] for topic_partition in topic_partitions]
+
+    def unassign(self):
+        self.assignment = []
+
+    def get_watermark_offsets(self, topic_partition, timeout=None, cached=False):
+        return 0, len(FakeTopics.topics[topic_partition.topic][topic_partition.partition])
+
+    def offsets_for_times(self, topic_partitions, timeout=None):
+        results = []
+        for topic_partition in topic_partitions:
+            msgs = FakeTopics.topics[topic_partition.topic][topic_partition.partition]
+            # Timestamps grow with offsets
+            offset = next((offset for offset, (key, value, timestamp) in enumerate(msgs)
+                           if timestamp >= topic_partition.offset), -1)
+            results.append(TopicPartition(topic_partition.topic, topic_partition.partition, offset))
+        return results
+
+    def position(self, topic_partitions):
+        positions = {(topic, partition_id): position for topic, partition_id, position, fetched, eof in self.assignment}
+        return [TopicPartition(topic_partition.topic, topic_partition.partition,
+                               positions.get((topic_partition.topic, topic_partition.partition), -1001))
+                for topic_partition in topic_partitions]
+
+    def consume(self, num_messages=1, timeout=-1):
+        msgs = []
+        for assigned in self.assignment:
+            topic, partition_id, position, fetched, eof = assigned
+            partition = FakeTopics.topics[topic][partition_id]
+            if position >= fetched and position < len(partition):
+                fetched = assigned[3] = self.__fetch(partition, position)
+            batch = partition[position:min(fetched, position + num_messages - len(msgs))]
+            msgs.extend(FakeMessage(topic, partition_id, position + index, key, value, timestamp)
+                        for index, (key, value, timestamp) in enumerate(batch))
+            assigned[2] += len(batch)
+            if assigned[2] >= len(partition) and self.partition_eof and not eof and len(msgs) < num_messages:
+                assigned[4] = True
+                msgs.append(FakeMessage(topic, partition_id, assigned[2], None, None, 0,
+                                        KafkaError(KafkaError._PARTITION_EOF)))
+            if len(msgs) >= num_messages:
+                break
+        if msgs:
+            FakeTopics.count_delivered(msgs)
+        elif timeout and timeout > 0:
+            time.sleep(min(timeout, .01))
+        return msgs
+
+    def __fetch(self, partition, position):
+        """Simulate a fetch starting at position, :return: int, exclusive end offset fetched"""
+        end, fetch_bytes = position, 0
+        while end < len(partition):
+            value_bytes = len(partition[end][1])
+            if fetch_bytes and fetch_bytes + value_bytes > self.max_fetch_bytes:
+                break
+            fetch_bytes += value_bytes
+            end += 1
+        delay = self.fetch_latency_seconds + (fetch_bytes / self.fetch_bytes_per_second
+                                              if self.fetch_bytes_per_second else 0)
+        if delay:
+            time.sleep(delay)
+        return end
+
+    def poll(self, timeout=None):
+        msgs = self.consume(1, timeout)
+        return msgs[0] if msgs else None
+
+    def close(self):
+        self.assignment = []
+
+    @staticmethod
+    def __start_offset(topic_partition):
+        partition = FakeTopics.topics[topic_partition.topic][topic_partition.partition]
+        if topic_partition.offset == OFFSET_END:
+            return len(partition)
+        if topic_partition.offset == OFFSET_BEGINNING or topic_partition.offset < 0:
+            return 0
+        return topic_partition.offset
+
+
+class FakeSchemaRegistryClient:
+    """Stand-in of confluent_kafka.schema_registry.SchemaRegistryClient(), serving FakeTopics.avro_schema"""
+
+    def get_schema(self, schema_id):
+        if schema_id != FakeTopics.avro_schema_id:
+            raise ValueError("Unknown schema id: " + str(schema_id))
+        return Schema(json.dumps(FakeTopics.avro_schema), 'AVRO')
+
+
+class FakeMessageField:
+    """
+    Stand-in of confluent_kafka.serialization.MessageField(). The application instantiates it as confluent_kafka
+    1.5.0 allows, later versions turned it into an enum that cannot be instantiated
+    """
+    NONE = 'none'
+    KEY = 'key'
+    VALUE = 'value'
+
+
+class FakeAvroDeserializer:
+    """
+    Stand-in of confluent_kafka.schema_registry.avro.AvroDeserializer(schema_str, schema_registry_client), the
+    argument order of confluent_kafka 1.5.0 the application is written for (later versions swapped them). Decodes
+    as 1.5.0 does: confluent wire format header, writer schema fetched from the registry once per schema id, payload
+    read with fastavro.schemaless_reader() resolving writer to reader schema. Keeps avro benchmarks independent of
+    the installed confluent_kafka version.
+    """
+
+    def __init__(self, schema_str, schema_registry_client):
+        self.registry_client = schema_registry_client
+        self.reader_schema = fastavro.parse_schema(json.loads(schema_str))
+        # schema id -> parsed writer schema
+        self.writer_schemas = {}
+
+    def __call__(self, value, ctx):
+        if value is None:
+            return None
+        magic, schema_id = struct.unpack('>bI', value[:5])
+        if magic != 0:
+            raise ValueError("Unknown magic byte, message not in the confluent wire format")
+        writer_schema = self.writer_schemas.get(schema_id)
+        if writer_schema is None:
+            writer_schema = fastavro.parse_schema(json.loads(self.registry_client.get_schema(schema_id).schema_str))
+            self.writer_schemas[schema_id] = writer_schema
+        return fastavro.schemaless_reader(io.BytesIO(value[5:]), writer_schema, self.reader_schema)
+
+
+def install():
+    """
+    Swap the kafka consumer, schema registry client and the confluent_kafka avro classes whose API changed after
+    1.5.0 (MessageField, AvroDeserializer) used by the application for the fakes
+    """
+    kafka_manager.Consumer = FakeConsumer
+    avro_schema_registry_client.RegistryClient.get_registry_client = classmethod(
+        lambda cls, environment: FakeSchemaRegistryClient())
+    avro_client.MessageField = FakeMessageField
+    avro_deserializer.AvroDeserializer = FakeAvroDeserializer
+
+
+def write_avro_schema(work_directory):
+    """
+    Write the reader schema of avro benchmark topics, as AVRO_SCHEMA_FILE in work_directory/avro_schemas.
+    Schema files are read relative to the current directory, which must be work_directory while benchmarks run.
+    """
+    os.makedirs(os.path.join(work_directory, constants.DIRECTORY_AVRO_SCHEMAS), exist_ok=True)
+    with open(os.path.join(work_directory, constants.DIRECTORY_AVRO_SCHEMAS, AVRO_SCHEMA_FILE), 'w') as schema_file:
+        json.dump(FakeTopics.avro_schema, schema_file)
@@ -0,0 +1,333 @@
+"""
+Offline benchmarks of /search, end to end (flask view, RequestHandler, KafkaReader), against an in-process fake
+kafka consumer and schema registry serving synthetic json and avro topics. No cluster or certificates needed.
+
+Every scenario runs in its own python process (clean caches, consumer pools and peak RSS) and reports
+messages/s and bytes/s searched, p50/p99 request latency and peak RSS. Results are saved in benchmarks/results
+and compared with the previous results file (or --baseline), flagging regressions above --max-regression percent.
+
+Usage, from the repository root:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --scenarios json_serial json_parallel --partitions 16 --requests 50
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(BENCHMARKS_DIRECTORY)
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+import fake_kafka
+
+# Also runs in avro decode pool workers started with 'spawn' (main module is imported again)
+fake_kafka.install()
+
+RESULTS_DIRECTORY = os.path.join(BENCHMARKS_DIRECTORY, 'results')
+ENVIRONMENT = 'benchmark'
+TOPIC = 'benchmark-topic'
+
+# Main config of every scenario, before scenario overrides: serial scan, batched reads, raw prefilter on,
+# result/segment caches and avro decode pool off
+BASE_CONFIG = {
+    'bootstrap.servers': {ENVIRONMENT: 'fake-broker:9092'},
+    'schema_registry_url': {ENVIRONMENT: 'https://fake-registry'},
+    'ssl': {ENVIRONMENT: {'ssl.key.location': 'fake.key', 'ssl.key.password': 'fake',
+                          'ssl.certificate.location': 'fake.crt', 'pfx_file': 'fake.pfx'}},
+    'ssl.ca.location': 'fake.cer',
+    'group.id': 'benchmark',
+    'client.id': 'benchmark',
+    'enable.auto.commit': 'False',
+    'session.timeout.ms': '6000',
+    'default.topic.config': {'auto.offset.reset': 'smallest'},
+    'security.protocol': 'SSL',
+    'api.version.request': 'True',
+    'enable.partition.eof': 'True',
+    'partition.workers': {ENVIRONMENT: 1},
+    'raw.prefilter.enabled': 'true',
+    'consume.batch.size': 1000,
+    'avro.decode.workers': 0,
+    'result.cache': {'enabled': 'false'},
+    'segment.cache': {'enabled': 'false'},
+}
+
+# name -> (message type, main config overrides, request overrides). Pairs sharing a prefix are compared in the
+# summary: serial vs parallel partition scans, prefilter on vs off, batched vs single message reads, field
+# filters vs search string, avro decoding on request threads vs in the decode pool
+SCENARIOS = OrderedDict([
+    ('json_serial', ('json', {}, {})),
+    ('json_parallel', ('json', {'partition.workers': {ENVIRONMENT: 8}}, {})),
+    ('json_prefilter_off', ('json', {'raw.prefilter.enabled': 'false'}, {})),
+    ('json_unbatched', ('json', {'consume.batch.size': 1}, {})),
+    ('json_field_filter', ('json', {}, {'searchParam': None, 'fieldFilters': [
+        {'field': 'customer.id', 'op': 'equals', 'value': 'cust-match'}]})),
+    ('json_result_cache', ('json', {'result.cache': {'enabled': 'true'}}, {})),
+    ('avro_serial', ('avro', {}, {})),
+    ('avro_decode_pool', ('avro', {'avro.decode.workers': 4}, {})),
+])
+
+# Scenario compared with the baseline scenario in the summary: scenario -> baseline scenario
+COMPARISONS = OrderedDict([
+    ('json_parallel', 'json_serial'),
+    ('json_prefilter_off', 'json_serial'),
+    ('json_unbatched', 'json_serial'),
+    ('json_field_filter', 'json_serial'),
+    ('json_result_cache', 'json_serial'),
+    ('avro_decode_pool', 'avro_serial'),
+])
+
+# Result keys, higher is better for throughput, lower is better for latency and memory
+METRICS_HIGHER_BETTER = ('msgs_per_second', 'bytes_per_second')
+METRICS_LOWER_BETTER = ('p50_ms', 'p99_ms', 'peak_rss_bytes')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline /search benchmarks against a fake kafka cluster")
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+                        help="scenarios to run, all by default")
+    parser.add_argument('--partitions', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=20000, help="messages per partition")
+    parser.add_argument('--message-bytes', type=int, default=512, help="approximate size of each message")
+    parser.add_argument('--selectivity', type=float, default=.01, help="fraction of messages matching the search")
+    parser.add_argument('--requests', type=int, default=10, help="timed requests per scenario")
+    parser.add_argument('--warmup', type=int, default=1, help="untimed requests before timed requests")
+    parser.add_argument('--fetch-latency-ms', type=float, default=2.0,
+                        help="simulated broker round trip of every fetch")
+    parser.add_argument('--fetch-mb-per-second', type=float, default=100.0,
+                        help="simulated transfer rate of each consumer, 0 for unlimited")
+    parser.add_argument('--label', default=None, help="name of this run in results, defaults to the git revision")
+    parser.add_argument('--baseline', default=None, help="results file to compare with, defaults to the latest")
+    parser.add_argument('--max-regression', type=float, default=10.0,
+                        help="percent change of a metric reported as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit with status 1 on regressions")
+    parser.add_argument('--no-save', action='store_true', help="do not write a results file")
+    # Internal, runs a single scenario and prints its result as json
+    parser.add_argument('--run-scenario', default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def settings_of(args):
+    return OrderedDict([('partitions', args.partitions), ('messages_per_partition', args.messages),
+                        ('message_bytes', args.message_bytes), ('selectivity', args.selectivity),
+                        ('requests', args.requests), ('warmup', args.warmup),
+                        ('fetch_latency_ms', args.fetch_latency_ms),
+                        ('fetch_mb_per_second', args.fetch_mb_per_second)])
+
+
+def run_scenario(name, args):
+    """Runs in a child process: generate the topic, send the scenario's requests to /search, measure"""
+    from flask import Flask
+
+    import view
+    from avro_decode_pool import AvroDecodePool
+    from config_handler import ConnectionConfig
+    from kafka_manager import ConsumerConnectionManager
+
+    message_type, config_overrides, request_overrides = SCENARIOS[name]
+    work_directory = tempfile.mkdtemp(prefix='kafka_browser_benchmark_')
+    os.chdir(work_directory)
+    fake_kafka.write_avro_schema(work_directory)
+    ConnectionConfig.connection_details = {**BASE_CONFIG, **config_overrides}
+    ConnectionConfig.avro_topics = {TOPIC: fake_kafka.AVRO_SCHEMA_FILE} if message_type == 'avro' else {}
+    ConnectionConfig.logger_details = {}
+    fake_kafka.FakeConsumer.fetch_latency_seconds = args.fetch_latency_ms / 1000.0
+    fake_kafka.FakeConsumer.fetch_bytes_per_second = args.fetch_mb_per_second * 1048576 or None
+    fake_kafka.FakeTopics.generate(TOPIC, message_type, args.partitions, args.messages, args.message_bytes,
+                                   args.selectivity)
+    topic_messages = fake_kafka.FakeTopics.total_messages(TOPIC)
+    topic_bytes = fake_kafka.FakeTopics.total_bytes(TOPIC)
+
+    app = Flask(__name__)
+    app.register_blueprint(view.view)
+    client = app.test_client()
+    body = {'searchParam': fake_kafka.FakeTopics.search_token, 'environment': ENVIRONMENT,
+            message_type + '_topics': [TOPIC]}
+    body.update(request_overrides)
+    body = {key: value for key, value in body.items() if value is not None}
+
+    def search():
+        response = client.post('/search', json=body).get_json()
+        if 'ERROR' in response:
+            raise RuntimeError(response['ERROR'])
+        # Topics that failed hold an error message instead of their matches
+        errors = [matches for matches in response.values() if isinstance(matches, str)]
+        if errors:
+            raise RuntimeError(errors[0])
+        return sum(len(matches) for matches in response.values())
+
+    try:
+        for _ in range(args.warmup):
+            search()
+        fake_kafka.FakeTopics.reset_counters()
+        latencies = []
+        matches = None
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            request_started = time.perf_counter()
+            matches = search()
+            latencies.append(time.perf_counter() - request_started)
+        elapsed = time.perf_counter() - started
+    finally:
+        AvroDecodePool.shutdown()
+        ConsumerConnectionManager.close_pools()
+
+    latencies.sort()
+    return OrderedDict([
+        ('msgs_per_second', round(topic_messages * args.requests / elapsed, 1)),
+        ('bytes_per_second', round(topic_bytes * args.requests / elapsed, 1)),
+        ('p50_ms', round(percentile(latencies, 50) * 1000, 2)),
+        ('p99_ms', round(percentile(latencies, 99) * 1000, 2)),
+        ('peak_rss_bytes', peak_rss_bytes()),
+        ('matches', matches),
+        ('fetched_messages_per_request', fake_kafka.FakeTopics.delivered_messages // max(args.requests, 1)),
+    ])
+
+
+def percentile(sorted_values, percent):
+    """Nearest rank percentile"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(percent / 100.0 * len(sorted_values) + .5)) - 1))
+    return sorted_values[rank]
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, None where it cannot be measured"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_in_child(name, args):
+    """:return: dict() scenario result, or {'error': message} if the scenario failed"""
+    command = [sys.executable, os.path.abspath(__file__), '--run-scenario', name,
+               '--partitions', str(args.partitions), '--messages', str(args.messages),
+               '--message-bytes', str(args.message_bytes), '--selectivity', str(args.selectivity),
+               '--requests', str(args.requests), '--warmup', str(args.warmup),
+               '--fetch-latency-ms', str(args.fetch_latency_ms),
+               '--fetch-mb-per-second', str(args.fetch_mb_per_second)]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        error_lines = completed.stderr.strip().splitlines()
+        return {'error': error_lines[-1] if error_lines else 'exit status ' + str(completed.returncode)}
+    return json.loads(lines[-1], object_pairs_hook=OrderedDict)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY_DIRECTORY,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def latest_results_file():
+    files = sorted(glob.glob(os.path.join(RESULTS_DIRECTORY, '*.json')))
+    return files[-1] if files else None
+
+
+def find_regressions(results, baseline, max_regression):
+    """:return: list() of strings describing metrics that changed for the worse by more than max_regression %"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous or 'error' in result or 'error' in previous:
+            continue
+        for metric in METRICS_HIGHER_BETTER + METRICS_LOWER_BETTER:
+            if not previous.get(metric) or result.get(metric) is None:
+                continue
+            change = (result[metric] - previous[metric]) * 100.0 / previous[metric]
+            worse = -change if metric in METRICS_HIGHER_BETTER else change
+            if worse > max_regression:
+                regressions.append('{0} {1}: {2} -> {3} ({4:+.1f}%)'.format(
+                    name, metric, previous[metric], result[metric], change))
+    return regressions
+
+
+def print_results(results, baseline_results):
+    header = '{0:<20} {1:>12} {2:>10} {3:>10} {4:>10} {5:>9} {6:>8} {7:>10}'
+    print(header.format('scenario', 'msgs/s', 'MB/s', 'p50 ms', 'p99 ms', 'RSS MB', 'matches', 'vs prev'))
+    for name, result in results.items():
+        if 'error' in result:
+            print('{0:<20} ERROR {1}'.format(name, result['error']))
+            continue
+        previous = (baseline_results or {}).get(name) or {}
+        versus = ''
+        if previous.get('msgs_per_second'):
+            versus = '{0:+.1f}%'.format((result['msgs_per_second'] - previous['msgs_per_second']) * 100.0 /
+                                        previous['msgs_per_second'])
+        rss = result['peak_rss_bytes'] / 1048576.0 if result['peak_rss_bytes'] is not None else float('nan')
+        print(header.format(name, '{0:.0f}'.format(result['msgs_per_second']),
+                            '{0:.1f}'.format(result['bytes_per_second'] / 1048576.0),
+                            result['p50_ms'], result['p99_ms'], '{0:.0f}'.format(rss), result['matches'], versus))
+
+    compared = [(name, baseline_name) for name, baseline_name in COMPARISONS.items()
+                if 'error' not in results.get(name, {'error': None}) and
+                'error' not in results.get(baseline_name, {'error': None})]
+    if compared:
+        print('\nthroughput vs baseline scenario')
+        for name, baseline_name in compared:
+            print('  {0:<20} {1:.2f}x {2}'.format(name, results[name]['msgs_per_second'] /
+                                                  results[baseline_name]['msgs_per_second'], baseline_name))
+
+
+def main():
+    args = parse_args()
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args.run_scenario, args)))
+        return 0
+
+    settings = settings_of(args)
+    results = OrderedDict()
+    for name in args.scenarios:
+        print('running ' + name + ' ...', file=sys.stderr)
+        results[name] = run_in_child(name, args)
+
+    baseline_file = args.baseline or latest_results_file()
+    baseline = None
+    if baseline_file:
+        with open(baseline_file) as file:
+            baseline = json.load(file)
+        if baseline.get('settings') != settings:
+            print('note: ' + baseline_file + ' was run with other settings, comparison is not meaningful',
+                  file=sys.stderr)
+    baseline_results = baseline.get('results') if baseline else None
+
+    print_results(results, baseline_results)
+    regressions = find_regressions(results, baseline_results or {}, args.max_regression)
+    if baseline_file:
+        print('\ncompared with ' + os.path.relpath(baseline_file) + ': ' +
+              (str(len(regressions)) + ' regression(s)' if regressions else 'no regressions'))
+        for regression in regressions:
+            print('  ' + regression)
+
+    if not args.no_save:
+        label = args.label or git_revision()
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        results_file = os.path.join(RESULTS_DIRECTORY, datetime.utcnow().strftime('%Y%m%dT%H%M%SZ') + '_' +
+                                    label + '.json')
+        with open(results_file, 'w') as file:
+            json.dump(OrderedDict([('label', label), ('created', datetime.utcnow().isoformat() + 'Z'),
+                                   ('python', platform.python_version()), ('platform', platform.platform()),
+                                   ('cpus', os.cpu_count()),
+                                   ('settings', settings), ('results', results)]), file, indent=2)
+        print('\nresults saved to ' + os.path.relpath(results_file))
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
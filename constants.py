@@ -21,27 +21,239 @@ REQUEST_OTHER_TOPIC_KEY = 'otherTopic'
 REQUEST_JSON_TOPICS_KEY = 'json_topics'
 REQUEST_AVRO_TOPICS_KEY = 'avro_topics'
 REQUEST_NOT_BEFORE_KEY = 'notBefore'
+REQUEST_NOT_AFTER_KEY = 'notAfter'
 REQUEST_SEARCH_COUNT_KEY = 'search_count'
+REQUEST_PARTITION_WORKERS_KEY = 'partitionWorkers'
+REQUEST_NEWEST_FIRST_KEY = 'newestFirst'
+REQUEST_TOPIC_KEY = 'topic'
+REQUEST_FIELD_FILTERS_KEY = 'fieldFilters'
+REQUEST_INCLUDE_STATS_KEY = 'includeStats'
+REQUEST_DEADLINE_SECONDS_KEY = 'deadlineSeconds'
+REQUEST_PAGE_SIZE_KEY = 'pageSize'
+REQUEST_CURSOR_KEY = 'cursor'
+REQUEST_MESSAGE_KEY_KEY = 'messageKey'
 REQUEST_UI_FORM_JSON_TOPICS_KEY = 'json_topics[]'
 REQUEST_UI_FORM_AVRO_TOPICS_KEY = 'avro_topics[]'
+# Request header identifying the client for fair sharing of searches (admission), remote address if not sent
+REQUEST_CLIENT_ID_HEADER = 'X-Client-Id'
 
 # REQUEST_PARAMS
 PARAM_SEARCH_STRING_KEY = 'search_string'
+PARAM_SEARCH_TERMS_KEY = 'search_terms'
 PARAM_ENVIRONMENT_KEY = 'environment'
+PARAM_MESSAGE_KEY_KEY = 'message_key'
 PARAM_INCLUDE_KAFKA_METADATA_KEY = 'include_kafka_metadata'
 PARAM_INCLUDE_DELIMITER_KEY = 'delimiter'
 PARAM_OTHER_TOPIC_KEY = 'other_topic'
 PARAM_JSON_TOPICS_KEY = 'json_topics'
 PARAM_AVRO_TOPICS_KEY = 'avro_topics'
 PARAM_NOT_BEFORE_KEY = 'not_before'
+PARAM_NOT_AFTER_KEY = 'not_after'
 PARAM_SEARCH_COUNT_KEY = 'search_count'
+PARAM_PARTITION_WORKERS_KEY = 'partition_workers'
+PARAM_NEWEST_FIRST_KEY = 'newest_first'
+PARAM_FIELD_FILTERS_KEY = 'field_filters'
+PARAM_INCLUDE_STATS_KEY = 'include_stats'
+PARAM_DEADLINE_SECONDS_KEY = 'deadline_seconds'
+PARAM_PAGE_SIZE_KEY = 'page_size'
+PARAM_CURSOR_KEY = 'cursor'
+
+# MAIN CONFIG KEYS
+CONFIG_PARTITION_WORKERS_KEY = 'partition.workers'
+CONFIG_TOPIC_WORKERS_KEY = 'topic.workers'
+CONFIG_RAW_PREFILTER_ENABLED_KEY = 'raw.prefilter.enabled'
+CONFIG_CONSUME_BATCH_SIZE_KEY = 'consume.batch.size'
+CONFIG_CONSUME_TIMEOUT_KEY = 'consume.timeout.seconds'
+CONFIG_CONSUMER_TUNING_KEY = 'consumer.tuning'
+CONFIG_METADATA_CACHE_TTL_KEY = 'metadata.cache.ttl.seconds'
+CONFIG_CONSUMER_POOL_KEY = 'consumer.pool'
+CONFIG_CONSUMER_POOL_SIZE_KEY = 'size'
+CONFIG_CONSUMER_POOL_IDLE_TIMEOUT_KEY = 'idle.timeout.seconds'
+CONFIG_CONSUMER_POOL_ACQUIRE_TIMEOUT_KEY = 'acquire.timeout.seconds'
+CONFIG_CONSUMER_POOL_HEALTH_CHECK_INTERVAL_KEY = 'health.check.interval.seconds'
+CONFIG_CONSUMER_POOL_HEALTH_CHECK_TIMEOUT_KEY = 'health.check.timeout.seconds'
+CONFIG_SEGMENT_CACHE_KEY = 'segment.cache'
+CONFIG_SEGMENT_CACHE_ENABLED_KEY = 'enabled'
+CONFIG_SEGMENT_CACHE_DIRECTORY_KEY = 'directory'
+CONFIG_SEGMENT_CACHE_MAX_BYTES_KEY = 'max.bytes'
+CONFIG_SEGMENT_CACHE_TOPICS_KEY = 'topics'
+CONFIG_TOKEN_INDEX_KEY = 'token.index'
+CONFIG_TOKEN_INDEX_TOPICS_KEY = 'topics'
+CONFIG_TOKEN_INDEX_MAX_MESSAGES_KEY = 'max.messages.per.partition'
+CONFIG_TOKEN_INDEX_REBUILD_INTERVAL_KEY = 'rebuild.interval.seconds'
+CONFIG_AVRO_DECODE_WORKERS_KEY = 'avro.decode.workers'
+CONFIG_AVRO_DECODE_CHUNK_SIZE_KEY = 'avro.decode.chunk.size'
+CONFIG_RESULT_CACHE_KEY = 'result.cache'
+CONFIG_RESULT_CACHE_ENABLED_KEY = 'enabled'
+CONFIG_RESULT_CACHE_MAX_ENTRIES_KEY = 'max.entries'
+CONFIG_RESULT_CACHE_MAX_BYTES_KEY = 'max.bytes'
+CONFIG_SEARCH_DEADLINE_KEY = 'search.deadline.seconds'
+CONFIG_SEARCH_JOBS_KEY = 'search.jobs'
+CONFIG_SEARCH_JOBS_MAX_RUNNING_KEY = 'max.running'
+CONFIG_SEARCH_JOBS_MAX_JOBS_KEY = 'max.jobs'
+CONFIG_SEARCH_JOBS_TTL_KEY = 'ttl.seconds'
+CONFIG_SEARCH_COALESCING_ENABLED_KEY = 'search.coalescing.enabled'
+CONFIG_SHARED_SCANS_KEY = 'shared.scans'
+CONFIG_SHARED_SCANS_ENABLED_KEY = 'enabled'
+CONFIG_SHARED_SCANS_CHUNK_SIZE_KEY = 'chunk.size'
+CONFIG_KEY_PARTITIONER_KEY = 'key.partitioner'
+CONFIG_KEY_PARTITIONER_DEFAULT_KEY = 'default'
+CONFIG_KEY_PARTITIONER_TOPICS_KEY = 'topics'
+CONFIG_SEARCH_ESTIMATE_KEY = 'search.estimate'
+CONFIG_SEARCH_ESTIMATE_MESSAGE_BYTES_KEY = 'default.message.bytes'
+CONFIG_SEARCH_ESTIMATE_MESSAGES_PER_SECOND_KEY = 'default.messages.per.second'
+CONFIG_SEARCH_ESTIMATE_WARN_SECONDS_KEY = 'warn.seconds'
+CONFIG_SEARCH_ESTIMATE_MAX_SECONDS_KEY = 'max.seconds'
+CONFIG_SEARCH_ESTIMATE_SELECTIVITY_KEY = 'assumed.selectivity'
+CONFIG_SEARCH_ADMISSION_KEY = 'search.admission'
+CONFIG_SEARCH_ADMISSION_ENABLED_KEY = 'enabled'
+CONFIG_SEARCH_ADMISSION_MAX_RUNNING_KEY = 'max.running'
+CONFIG_SEARCH_ADMISSION_MAX_BYTES_PER_SECOND_KEY = 'max.bytes.per.second'
+CONFIG_SEARCH_ADMISSION_QUEUE_SIZE_KEY = 'queue.size'
+CONFIG_SEARCH_ADMISSION_QUEUE_TIMEOUT_KEY = 'queue.timeout.seconds'
+CONFIG_SEARCH_ADMISSION_PRIORITY_WINDOW_KEY = 'priority.window.seconds'
+CONFIG_SEARCH_ADMISSION_PRIORITY_AGING_KEY = 'priority.aging.seconds'
+
+# SEARCH TERMS
+# Search terms starting with this prefix are regular expressions
+SEARCH_REGEX_PREFIX = 're:'
+# Key added to matching messages of multi-term and regex searches, listing the terms matched
+MESSAGE_MATCHED_TERMS_KEY = 'matched_terms'
+
+# FIELD FILTERS (fieldFilters) KEYS AND OPERATORS
+FIELD_FILTER_FIELD_KEY = 'field'
+FIELD_FILTER_OP_KEY = 'op'
+FIELD_FILTER_VALUE_KEY = 'value'
+FIELD_FILTER_MIN_KEY = 'min'
+FIELD_FILTER_MAX_KEY = 'max'
+FIELD_FILTER_OP_EQUALS = 'equals'
+FIELD_FILTER_OP_CONTAINS = 'contains'
+FIELD_FILTER_OP_RANGE = 'range'
+FIELD_FILTER_OP_EXISTS = 'exists'
+# Separator of nested field names in a field path
+FIELD_PATH_SEPARATOR = '.'
 
 # RESPONSE KEYS
 RESPONSE_JSON_TOPICS_PREFIX = 'JSON_TOPIC_'
 RESPONSE_AVRO_TOPICS_PREFIX = 'AVRO_TOPIC_'
 RESPONSE_ERROR_KEY = 'ERROR'
+RESPONSE_STATS_KEY = 'STATS'
+RESPONSE_PARTIAL_KEY = 'PARTIAL'
+RESPONSE_JOB_KEY = 'JOB'
+RESPONSE_CURSOR_KEY = 'CURSOR'
+RESPONSE_ESTIMATE_KEY = 'ESTIMATE'
+
+# TOKEN INDEX STATUS (/index/status) KEYS
+INDEX_STATUS_STATE_KEY = 'state'
+INDEX_STATUS_PARTITIONS_KEY = 'partitions'
+INDEX_STATUS_INDEXED_FROM_KEY = 'indexed_from'
+INDEX_STATUS_INDEXED_TO_KEY = 'indexed_to'
+INDEX_STATUS_HIGH_WATERMARK_KEY = 'high_watermark'
+INDEX_STATUS_LAG_KEY = 'lag'
+INDEX_STATUS_MESSAGES_KEY = 'messages'
+INDEX_STATUS_POSTINGS_KEY = 'postings'
+INDEX_STATUS_SIZE_BYTES_KEY = 'size_bytes'
+INDEX_STATUS_BUILDS_KEY = 'builds'
+INDEX_STATUS_LAST_BUILD_SECONDS_KEY = 'last_build_seconds'
+INDEX_STATUS_ERROR_KEY = 'error'
+
+# RESULT CACHE STATUS (/cache/status) KEYS
+CACHE_STATUS_HITS_KEY = 'hits'
+CACHE_STATUS_PARTIAL_HITS_KEY = 'partial_hits'
+CACHE_STATUS_MISSES_KEY = 'misses'
+CACHE_STATUS_EVICTIONS_KEY = 'evictions'
+CACHE_STATUS_ENTRIES_KEY = 'entries'
+CACHE_STATUS_SIZE_BYTES_KEY = 'size_bytes'
+
+# TOPIC STATS AND SEARCH ESTIMATE (/search/estimate) KEYS
+ESTIMATE_PARTITION_COUNT_KEY = 'partition_count'
+ESTIMATE_PARTITIONS_KEY = 'partitions'
+ESTIMATE_PARTITION_KEY = 'partition'
+ESTIMATE_LOW_WATERMARK_KEY = 'low_watermark'
+ESTIMATE_HIGH_WATERMARK_KEY = 'high_watermark'
+ESTIMATE_MESSAGES_KEY = 'messages'
+ESTIMATE_BYTES_KEY = 'bytes'
+ESTIMATE_MESSAGE_BYTES_KEY = 'message_bytes'
+ESTIMATE_WINDOW_MESSAGES_KEY = 'window_messages'
+ESTIMATE_WINDOW_COVERAGE_KEY = 'window_coverage'
+ESTIMATE_RETENTION_TRUNCATED_KEY = 'retention_truncated'
+ESTIMATE_SEARCH_KEY = 'search'
+ESTIMATE_SECONDS_KEY = 'seconds'
+ESTIMATE_MESSAGES_PER_SECOND_KEY = 'messages_per_second'
+ESTIMATE_MEASURED_KEY = 'measured'
+ESTIMATE_WARNING_KEY = 'warning'
+ESTIMATE_REJECTED_KEY = 'rejected'
+ESTIMATE_LIMITED_KEY = 'limited'
+
+# SEARCH ADMISSION STATUS (/admission/status) KEYS
+ADMISSION_STATUS_RUNNING_KEY = 'running'
+ADMISSION_STATUS_QUEUED_KEY = 'queued'
+ADMISSION_STATUS_MAX_RUNNING_KEY = 'max_running'
+ADMISSION_STATUS_MAX_BYTES_PER_SECOND_KEY = 'max_bytes_per_second'
+ADMISSION_STATUS_CLIENTS_KEY = 'clients'
+
+# SEARCH JOB (/search/jobs) STATUS KEYS AND STATES
+JOB_ID_KEY = 'job_id'
+JOB_STATE_KEY = 'state'
+JOB_SUBMITTED_KEY = 'submitted'
+JOB_SECONDS_KEY = 'seconds'
+JOB_DEADLINE_SECONDS_KEY = 'deadline_seconds'
+JOB_TOPICS_KEY = 'topics'
+JOB_ERROR_KEY = 'error'
+JOB_STATE_QUEUED = 'queued'
+JOB_STATE_RUNNING = 'running'
+JOB_STATE_COMPLETED = 'completed'
+JOB_STATE_PARTIAL = 'partial'
+JOB_STATE_CANCELLED = 'cancelled'
+JOB_STATE_FAILED = 'failed'
+
+# STREAMING RESPONSE (/search/stream) RECORD KEYS AND TYPES
+STREAM_TYPE_KEY = 'type'
+STREAM_TOPIC_KEY = 'topic'
+STREAM_OFFSET_KEY = 'offset'
+STREAM_MESSAGE_KEY = 'message'
+STREAM_ERROR_KEY = 'error'
+STREAM_TYPE_MATCH = 'match'
+STREAM_TYPE_TOPIC_START = 'topic_start'
+STREAM_TYPE_PARTITION_SUMMARY = 'partition_summary'
+STREAM_TYPE_TOPIC_SUMMARY = 'topic_summary'
+STREAM_TYPE_ERROR = 'error'
+STREAM_TYPE_END = 'end'
+STREAM_MIMETYPE = 'application/x-ndjson'
+
+# SCAN SUMMARY KEYS
+SUMMARY_PARTITION_KEY = 'partition'
+SUMMARY_PARTITIONS_KEY = 'partitions'
+SUMMARY_SCANNED_KEY = 'scanned'
+SUMMARY_MATCHES_KEY = 'matches'
+SUMMARY_COMPLETE_KEY = 'complete'
+
+# SCAN STATS (includeStats response block) KEYS AND PHASES
+STATS_TOPICS_KEY = 'topics'
+STATS_BYTES_KEY = 'bytes'
+STATS_PREFILTERED_KEY = 'prefiltered'
+STATS_DECODE_ERRORS_KEY = 'decode_errors'
+STATS_SECONDS_KEY = 'seconds'
+STATS_PHASES_KEY = 'phases'
+STATS_PARTITIONS_DONE_KEY = 'partitions_done'
+STATS_OFFSETS_KEY = 'offsets'
+STATS_COALESCED_KEY = 'coalesced'
+STATS_QUEUED_KEY = 'queued'
+STATS_PHASE_METADATA = 'metadata'
+STATS_PHASE_CONNECT = 'connect'
+STATS_PHASE_OFFSETS = 'offsets'
+STATS_PHASE_THROTTLE = 'throttle'
+STATS_PHASE_FETCH = 'fetch'
+STATS_PHASE_IDLE = 'idle'
+STATS_PHASE_DECODE = 'decode'
+
+# METRICS (/metrics)
+METRICS_PREFIX = 'kafka_browser_'
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
 
 # LOGGER
 LOGGER_NAME = "browser_request_logger"
 LOGGER_DISABLE_KEY = 'logger.enable'
 LOGGER_PATH_KEY = 'logger.requests.path'
+LOGGER_QUEUE_SIZE_KEY = 'logger.queue.size'
+LOGGER_BATCH_SIZE_KEY = 'logger.batch.size'
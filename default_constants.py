@@ -6,7 +6,123 @@ DEFAULT_ENVIRONMENT = 'test'
 # request_handler.py
 DEFAULT_REQUEST_HANDLER_INCLUDE_KAFKA_METADATA = 'false'
 DEFAULT_REQUEST_HANDLER_INCLUDE_DELIMITER = 'false'
+DEFAULT_REQUEST_HANDLER_NEWEST_FIRST = 'false'
+DEFAULT_REQUEST_HANDLER_INCLUDE_STATS = 'false'
+DEFAULT_TOPIC_WORKERS = 4
+DEFAULT_STREAM_QUEUE_SIZE = 500
+
+# search_flights.py
+# Identical /search requests arriving while the search runs wait for it instead of scanning again
+DEFAULT_SEARCH_COALESCING_ENABLED = 'false'
+
+# shared_scans.py
+DEFAULT_SHARED_SCANS_ENABLED = 'false'
+# Offsets read per chunk, searches joining a shared scan are attached from the next chunk on
+DEFAULT_SHARED_SCANS_CHUNK_SIZE = 50000
+
+# key_partitioner.py
+# Partitioner of message keys for key lookups (messageKey), as used by the Java client's default partitioner
+DEFAULT_KEY_PARTITIONER = 'murmur2'
+
+# search_estimate.py
+# Average message size and scan rate of topics not scanned yet by this process
+DEFAULT_SEARCH_ESTIMATE_MESSAGE_BYTES = 1024
+DEFAULT_SEARCH_ESTIMATE_MESSAGES_PER_SECOND = 20000
+# Measured rates are used once a topic's scans read at least this many messages
+DEFAULT_SEARCH_ESTIMATE_MIN_MEASURED_MESSAGES = 10000
+# Searches estimated to take longer are flagged with a warning, 0 never warns
+DEFAULT_SEARCH_ESTIMATE_WARN_SECONDS = 30
+# /search and /search/stream reject searches estimated to take longer, 0 does not reject
+DEFAULT_SEARCH_ESTIMATE_MAX_SECONDS = 0
+# Share of messages assumed to match, searches with a match limit (search_count, pageSize) are estimated to stop after
+# reading limit / selectivity messages
+DEFAULT_SEARCH_ESTIMATE_SELECTIVITY = 0.001
+
+# search_admission.py
+DEFAULT_SEARCH_ADMISSION_ENABLED = 'false'
+# Searches scanning an environment at once, later searches are queued. Also limited to consumer pool size divided by
+# topic workers x partition workers (16 // (4 x 1) with the defaults)
+DEFAULT_SEARCH_ADMISSION_MAX_RUNNING = 4
+# Bytes read from the brokers of an environment per second, summed over searches. 0 does not limit
+DEFAULT_SEARCH_ADMISSION_MAX_BYTES_PER_SECOND = 0
+# Searches queued per environment, later searches are rejected
+DEFAULT_SEARCH_ADMISSION_QUEUE_SIZE = 100
+# Queued searches are rejected after waiting this long (background jobs wait until cancelled or their deadline)
+DEFAULT_SEARCH_ADMISSION_QUEUE_TIMEOUT_SECONDS = 60
+# Searches with a time window no longer than this are admitted before full retention scans
+DEFAULT_SEARCH_ADMISSION_PRIORITY_WINDOW_SECONDS = 3600
+# Queued searches move up one priority class per this many seconds waited, so large scans are not starved
+DEFAULT_SEARCH_ADMISSION_PRIORITY_AGING_SECONDS = 30
+
+# search_jobs.py
+# Jobs searching at once, later jobs are queued
+DEFAULT_SEARCH_JOBS_MAX_RUNNING = 4
+# Jobs kept (queued, running and finished), finished jobs are dropped oldest first when reached
+DEFAULT_SEARCH_JOBS_MAX_JOBS = 100
+# Finished jobs and their results are kept this long
+DEFAULT_SEARCH_JOBS_TTL_SECONDS = 900
+
+# kafka_client.py
+DEFAULT_PARTITION_WORKERS = 1
+DEFAULT_MAX_PARTITION_WORKERS = 16
+DEFAULT_OFFSETS_LOOKUP_TIMEOUT_SECONDS = 10
+DEFAULT_NEWEST_FIRST_CHUNK_SIZE = 500
+DEFAULT_NEWEST_FIRST_MAX_CHUNK_SIZE = 20000
+DEFAULT_RAW_PREFILTER_ENABLED = 'true'
+DEFAULT_CONSUME_BATCH_SIZE = 1000
+DEFAULT_CONSUME_TIMEOUT_SECONDS = .5
+# A partition that stops returning messages before reaching its stop offset is abandoned after this long
+DEFAULT_MAX_IDLE_SECONDS = 30
+
+# kafka_manager.py
+# Consumer fetch settings tuned for bulk scanning, may be overridden with 'consumer.tuning' in main config
+DEFAULT_CONSUMER_TUNING = {
+    'fetch.max.bytes': 52428800,
+    'max.partition.fetch.bytes': 10485760,
+    'fetch.wait.max.ms': 100,
+    'queued.min.messages': 100000,
+    'queued.max.messages.kbytes': 262144
+}
+DEFAULT_METADATA_CACHE_TTL_SECONDS = 60
+DEFAULT_LIST_TOPICS_TIMEOUT_SECONDS = 10
+DEFAULT_CONSUMER_POOL_SIZE = 16
+DEFAULT_CONSUMER_POOL_IDLE_TIMEOUT_SECONDS = 300
+DEFAULT_CONSUMER_POOL_ACQUIRE_TIMEOUT_SECONDS = 60
+DEFAULT_CONSUMER_POOL_HEALTH_CHECK_INTERVAL_SECONDS = 60
+DEFAULT_CONSUMER_POOL_HEALTH_CHECK_TIMEOUT_SECONDS = 5
+
+# segment_cache.py
+DEFAULT_SEGMENT_CACHE_ENABLED = 'false'
+DEFAULT_SEGMENT_CACHE_DIRECTORY = 'segment_cache'
+DEFAULT_SEGMENT_CACHE_MAX_BYTES = 10737418240
+
+# token_index.py
+DEFAULT_TOKEN_INDEX_MAX_MESSAGES = 1000000
+DEFAULT_TOKEN_INDEX_REBUILD_INTERVAL_SECONDS = 21600
+# Watermarks (index lag) and rebuild conditions are checked this often
+DEFAULT_TOKEN_INDEX_REFRESH_SECONDS = 10
+DEFAULT_TOKEN_INDEX_RETRY_SECONDS = 30
+# Candidate offsets this close together are read as a single range
+DEFAULT_TOKEN_INDEX_MERGE_GAP = 50
+
+# avro_decode_pool.py
+# Worker processes decoding avro messages, 0 decodes on the request threads
+DEFAULT_AVRO_DECODE_WORKERS = 0
+DEFAULT_AVRO_DECODE_CHUNK_SIZE = 250
+
+# result_cache.py
+DEFAULT_RESULT_CACHE_ENABLED = 'false'
+DEFAULT_RESULT_CACHE_MAX_ENTRIES = 256
+DEFAULT_RESULT_CACHE_MAX_BYTES = 268435456
+
+# search_metrics.py
+# Upper bounds of the duration histograms, in seconds
+DEFAULT_METRICS_DURATION_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
 
 # logger.py
 DEFAULT_LOGGER_PATH = "enter_default_logger_path_here"
 DEFAULT_LOGGER_ENABLED = 'false'
+# Audit records queued for the writer thread, records logged while the queue is full are dropped
+DEFAULT_LOGGER_QUEUE_SIZE = 10000
+# Audit records written to the log file per write
+DEFAULT_LOGGER_BATCH_SIZE = 500
@@ -1,3 +1,13 @@
 # Main application error class
 class ErrorHandler(Exception):
     pass
+
+
+# Raised to stop an in-progress scan, e.g. client of a streaming search disconnected
+class SearchCancelled(ErrorHandler):
+    pass
+
+
+# Raised when a segment cache file is damaged (truncated, or records running past its end)
+class CorruptSegment(ErrorHandler):
+    pass
@@ -1,51 +1,128 @@
 import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-from confluent_kafka import KafkaError, TopicPartition
+from confluent_kafka import KafkaError, TIMESTAMP_NOT_AVAILABLE, TopicPartition
 
 import constants
-from error_handler import ErrorHandler
+import default_constants
+from avro_decode_pool import AvroDecodePool
+from config_handler import ConnectionConfig
+from error_handler import CorruptSegment, ErrorHandler
 from kafka_manager import ConsumerConnectionManager
-
-
-# Used if using timestamp filtering functionality (see commented section below)
-# from dateutil.parser import parse
+from key_partitioner import KeyPartitioner
+from message_filter import RawPrefilter, SearchMatcher
+from result_cache import ResultCache
+from search_admission import SearchAdmission
+from search_metrics import ScanStats, SearchMetrics
+from segment_cache import SegmentCache
+from shared_scans import SharedScans
+from token_index import TokenIndex
 
 
 class KafkaReader:
     """ Handles connection to topic and polling """
 
     param_search_string_key = constants.PARAM_SEARCH_STRING_KEY
+    param_search_terms_key = constants.PARAM_SEARCH_TERMS_KEY
     param_include_delimiter_key = constants.PARAM_INCLUDE_DELIMITER_KEY
     param_include_kafka_meta_key = constants.PARAM_INCLUDE_KAFKA_METADATA_KEY
+    param_partition_workers_key = constants.PARAM_PARTITION_WORKERS_KEY
+    param_not_before_key = constants.PARAM_NOT_BEFORE_KEY
+    param_not_after_key = constants.PARAM_NOT_AFTER_KEY
+    param_search_count_key = constants.PARAM_SEARCH_COUNT_KEY
+    param_newest_first_key = constants.PARAM_NEWEST_FIRST_KEY
+    param_page_size_key = constants.PARAM_PAGE_SIZE_KEY
+    config_partition_workers_key = constants.CONFIG_PARTITION_WORKERS_KEY
+    config_raw_prefilter_enabled_key = constants.CONFIG_RAW_PREFILTER_ENABLED_KEY
+    config_consume_batch_size_key = constants.CONFIG_CONSUME_BATCH_SIZE_KEY
+    config_consume_timeout_key = constants.CONFIG_CONSUME_TIMEOUT_KEY
+    default_partition_workers = default_constants.DEFAULT_PARTITION_WORKERS
+    default_max_partition_workers = default_constants.DEFAULT_MAX_PARTITION_WORKERS
+    default_offsets_lookup_timeout = default_constants.DEFAULT_OFFSETS_LOOKUP_TIMEOUT_SECONDS
+    default_newest_first_chunk_size = default_constants.DEFAULT_NEWEST_FIRST_CHUNK_SIZE
+    default_newest_first_max_chunk_size = default_constants.DEFAULT_NEWEST_FIRST_MAX_CHUNK_SIZE
+    default_raw_prefilter_enabled = default_constants.DEFAULT_RAW_PREFILTER_ENABLED
+    default_consume_batch_size = default_constants.DEFAULT_CONSUME_BATCH_SIZE
+    default_consume_timeout = default_constants.DEFAULT_CONSUME_TIMEOUT_SECONDS
+    default_max_idle_seconds = default_constants.DEFAULT_MAX_IDLE_SECONDS
+    default_index_merge_gap = default_constants.DEFAULT_TOKEN_INDEX_MERGE_GAP
+
+    message_matched_terms_key = constants.MESSAGE_MATCHED_TERMS_KEY
+
+    # Partition summary keys
+    summary_partition_key = constants.SUMMARY_PARTITION_KEY
+    summary_scanned_key = constants.SUMMARY_SCANNED_KEY
+    summary_matches_key = constants.SUMMARY_MATCHES_KEY
+
+    message_delimiter = ["##############################################################",
+                         "####################  MESSAGE SEPARATOR  #####################",
+                         "##############################################################"]
 
     def __init__(self, environment):
+        self.environment = environment
         self.avro_deserializer = None
+        # Pooled consumer, borrowed on first serial scan and returned to the pool by close()
+        self.consumer = None
+        # ScanStats() of the last topic scan, None before the first scan
+        self.scan_stats = None
+        # Scans end early once stop_event is set or deadline has passed, see set_interrupt()
+        self.stop_event = None
+        self.deadline = None
+        # Paged searches, see set_resume_offsets(). next_offsets is set once a paged scan ends, partition id ->
+        # tuple() (next offset, exclusive stop offset) of every partition not scanned completely yet
+        self.resume_offsets = None
+        self.next_offsets = None
+        started = time.perf_counter()
         try:
-            self.consumer = ConsumerConnectionManager.initialize_kafka_consumer(environment)
-            try:
-                # Retrieve list of topics from KafkaConsumer(). timeout is set as float(10).
-                # Timeout errors typically signify a connection error to kafka-broker.
-                self.consumer_topic_list = self.consumer.list_topics(timeout=float(10)).topics
-            except Exception as e:
-                raise ErrorHandler(
-                    "Error retrieving list of available topics. Check Kafka connection settings. Error: " + str(
-                        e))
+            # Retrieve list of topics, cached per environment by ConsumerConnectionManager().
+            # Timeout errors typically signify a connection error to kafka-broker.
+            self.consumer_topic_list = ConsumerConnectionManager.get_topic_metadata(environment)
         except Exception as e:
-            raise ErrorHandler("Error initializing KafkaReader(): " + str(e))
+            raise ErrorHandler(
+                "Error retrieving list of available topics. Check Kafka connection settings. Error: " + str(e))
+        # Added to the stats of the first scan
+        self.metadata_seconds = time.perf_counter() - started
 
     def close(self):
-        """Close connection to kafka broker"""
-        self.consumer.close()
+        """Return consumer to the environment's connection pool"""
+        if self.consumer is not None:
+            consumer, self.consumer = self.consumer, None
+            ConsumerConnectionManager.release_consumer(self.environment, consumer)
 
     def set_avro_deserializer(self, avro_client):
         self.avro_deserializer = avro_client
 
+    def set_interrupt(self, stop_event=None, deadline=None):
+        """
+        End scans early, keeping the matches found so far, once stop_event is set or deadline has passed.
+        Interrupted scans are marked incomplete in their ScanStats() and never added to the result cache.
+        :param stop_event: optional threading.Event()
+        :param deadline: optional float, time.monotonic() value
+        """
+        self.stop_event = stop_event
+        self.deadline = deadline
+
+    def set_resume_offsets(self, resume_offsets):
+        """
+        Continue a paged search from the offsets reached by its previous page, instead of the offset bounds
+        resolved from the watermarks and time window. Partitions left out are not scanned.
+        :param resume_offsets: dict() partition id -> tuple() (next offset, exclusive stop offset)
+        """
+        self.resume_offsets = resume_offsets
+
     def __retrieve_partition_data(self, topic):
         """
         Returns patition data for given topic.
         :param topic: string, name of topic being searched
         :return: confluent_kafka.TopicPartition()
         """
+        if topic not in self.consumer_topic_list:
+            # Topic may have been created since metadata was cached, refresh once before giving up
+            ConsumerConnectionManager.invalidate_metadata(self.environment)
+            self.consumer_topic_list = ConsumerConnectionManager.get_topic_metadata(self.environment)
         if topic not in self.consumer_topic_list:
             raise ErrorHandler("Application does not have access to requested topic: " + topic)
         try:
@@ -62,97 +139,907 @@ class KafkaReader:
         :param message_type: string, type of messages being polled and parses
         :return: list() of all messages in given topic that include request search_string
         """
-        messages = []
-        partitions = self.__retrieve_partition_data(topic)
-        for k, partition in partitions.items():
-            self.consumer.assign([TopicPartition(topic, partition.id)])
-            while True:
-                try:
-                    msg = self.consumer.poll(.5)
-                    if msg is None:
+        # partition id -> list() of tuple() (message timestamp, parsed message), in scan order
+        found_msgs = defaultdict(list)
+        self.scan_topic(request_params, topic, message_type,
+                        lambda msg, parsed_msg: found_msgs[msg.partition()].append((msg.timestamp()[1], parsed_msg)),
+                        shareable=True)
+        return self.build_results(request_params, found_msgs)
+
+    def build_results(self, request_params, found_msgs):
+        """
+        Order the matches of a topic scan for the response, also used for the partial results of running scans
+        :param found_msgs: dict() partition id -> list() of tuple() (message timestamp, parsed message), in scan order
+        :return: list() of parsed messages, with delimiters if requested
+        """
+        if request_params.get(self.param_newest_first_key) == 'true':
+            # Every partition returned up to search_count of its newest matches, keep the newest overall
+            ordered_msgs = sorted((found_msg for msgs in found_msgs.values() for found_msg in msgs),
+                                  key=lambda found_msg: found_msg[0], reverse=True)
+            ordered_msgs = ordered_msgs[:request_params.get(self.param_search_count_key)]
+        else:
+            # Newest message first, last partition first
+            ordered_msgs = [found_msg for partition_id in sorted(found_msgs, reverse=True)
+                            for found_msg in reversed(found_msgs[partition_id])]
+        return self.__build_message_list(request_params, [parsed_msg for timestamp, parsed_msg in ordered_msgs])
+
+    def scan_topic(self, request_params, topic, message_type, on_match, on_partition_done=None, shareable=False):
+        """
+        Scan all partitions of topic, passing every matching message to on_match as soon as it is found.
+        Partitions are scanned one at a time on this reader's consumer, or, if more than one partition worker is
+        configured, several at once on dedicated consumers. Callbacks may be invoked from worker threads, an
+        exception raised by a callback stops the scan. Counters and timers of the scan are kept in self.scan_stats
+        and added to SearchMetrics() once the scan ends.
+        :param request_params: dict()
+        :param topic: string, name of topic being searched
+        :param message_type: string, type of messages being polled and parsed
+        :param on_match: callable(confluent_kafka.Message(), parsed message)
+        :param on_partition_done: optional callable(partition summary dict())
+        :param shareable: bool, partitions may be read by shared scans (shared_scans.py) together with concurrent
+                          searches of the topic. Matches are then delivered once each partition has been read
+        :return: list() of partition summary dict(), in partition order
+        """
+        stats = ScanStats()
+        with stats.timer(ScanStats.phase_metadata):
+            partitions = self.__retrieve_partition_data(topic)
+        stats.add_time(ScanStats.phase_metadata, self.metadata_seconds)
+        self.metadata_seconds = 0.0
+        self.scan_stats = stats
+        try:
+            summaries = self.__scan_topic(request_params, topic, message_type, on_match, on_partition_done, stats,
+                                          partitions, shareable)
+        except BaseException:
+            stats.finish()
+            SearchMetrics.record_scan(self.environment, topic, stats, error=True)
+            raise
+        stats.finish()
+        SearchMetrics.record_scan(self.environment, topic, stats)
+        return summaries
+
+    def __scan_topic(self, request_params, topic, message_type, on_match, on_partition_done, stats, partitions,
+                     shareable):
+        """See scan_topic(), :param partitions: dict() partition id -> partition metadata of topic"""
+        scan = TopicScan(request_params, topic, message_type, on_match, on_partition_done, stats)
+        partition_ids = self.__partitions_to_scan(scan, [partition.id for partition in partitions.values()])
+        workers = self.__resolve_partition_workers(request_params, len(partition_ids))
+        scan.stop_event = self.stop_event
+        scan.deadline = self.deadline
+        scan.prefilter = self.__build_prefilter(scan)
+        scan.segment_cache = SegmentCache.enabled_for(self.environment, topic)
+        scan.token_index = TokenIndex.get(self.environment, topic, message_type)
+        scan.decode_pool = message_type == 'avro' and AvroDecodePool.enabled()
+        scan.result_cache_key = ResultCache.key_for(self.environment, topic, message_type, request_params,
+                                                    scan.time_window)
+        scan.shared = shareable and SharedScans.enabled_for(scan)
+
+        if workers <= 1:
+            if self.consumer is None:
+                with stats.timer(ScanStats.phase_connect):
+                    self.consumer = ConsumerConnectionManager.acquire_consumer(self.environment)
+            with stats.timer(ScanStats.phase_offsets):
+                scan.offset_bounds = self.__resolve_offset_bounds(self.consumer, scan, partition_ids)
+            stats.set_offset_bounds(scan.offset_bounds)
+            self.__trim_segment_cache(scan)
+            summaries = {partition_id: self.__scan_partition(self.consumer, scan, partition_id)
+                         for partition_id in partition_ids}
+        else:
+            started = time.perf_counter()
+            with ConsumerConnectionManager.pooled_consumer(self.environment) as consumer:
+                stats.add_time(ScanStats.phase_connect, time.perf_counter() - started)
+                with stats.timer(ScanStats.phase_offsets):
+                    scan.offset_bounds = self.__resolve_offset_bounds(consumer, scan, partition_ids)
+            stats.set_offset_bounds(scan.offset_bounds)
+            self.__trim_segment_cache(scan)
+            summaries = self.__scan_partitions_parallel(scan, partition_ids, workers)
+
+        stats.complete = not scan.incomplete
+        if request_params.get(self.param_page_size_key) is not None:
+            self.next_offsets = scan.next_offsets()
+        return [summaries[partition_id] for partition_id in partition_ids]
+
+    def describe_topic(self, request_params, topic, message_type):
+        """
+        Offsets of every partition of topic and the offsets a search with request_params would scan, without reading
+        any message: cached topic metadata, one watermark lookup per partition and one offsets_for_times() call per
+        time bound, as resolved at the start of a scan.
+        :return: dict() partition id -> tuple() (low watermark, high watermark, start offset (None if no message is
+                 in the time window), exclusive stop offset, True if the search would scan the partition), in
+                 partition order
+        """
+        scan = TopicScan(request_params, topic, message_type, None, None)
+        partition_ids = sorted(partition.id for partition in self.__retrieve_partition_data(topic).values())
+        if self.consumer is None:
+            self.consumer = ConsumerConnectionManager.acquire_consumer(self.environment)
+        offset_bounds = self.__resolve_offset_bounds(self.consumer, scan, partition_ids)
+        scanned_ids = set(self.__partitions_to_scan(scan, partition_ids))
+        partition_offsets = {}
+        for partition_id in partition_ids:
+            low_offset, high_offset = scan.watermarks[partition_id]
+            start_offset, stop_offset = offset_bounds[partition_id]
+            partition_offsets[partition_id] = (low_offset, high_offset, start_offset, stop_offset,
+                                               partition_id in scanned_ids)
+        return partition_offsets
+
+    @staticmethod
+    def __partitions_to_scan(scan, partition_ids):
+        """
+        Key lookups only scan the partition the key was produced to, unless the topic's partitioner is unknown
+        :return: list() of partition ids
+        """
+        if scan.message_key is not None:
+            key_partition = KeyPartitioner.partition_for(scan.topic, scan.message_key, len(partition_ids))
+            if key_partition is not None:
+                return [key_partition]
+        return partition_ids
+
+    def __resolve_partition_workers(self, request_params, partition_count):
+        """
+        Number of partitions scanned at once. Request value takes precedence over the environment's
+        'partition.workers' config value, which takes precedence over the default.
+        :param request_params: dict()
+        :param partition_count: int, number of partitions in topic
+        :return: int
+        """
+        workers = request_params.get(self.param_partition_workers_key)
+        if workers is None:
+            configured = (ConnectionConfig.connection_details or {}).get(self.config_partition_workers_key) or {}
+            workers = configured.get(self.environment, self.default_partition_workers)
+        return max(1, min(int(workers), self.default_max_partition_workers, partition_count))
+
+    def __build_prefilter(self, scan):
+        """
+        Raw bytes prefilter for the scan's message type, None if disabled in main config ('raw.prefilter.enabled')
+        or not sound for the requested search terms and field filters. Regular expressions are never prefiltered,
+        field filters only when they require a string value (equals, contains).
+        :return: RawPrefilter()
+        """
+        enabled = str((ConnectionConfig.connection_details or {}).get(self.config_raw_prefilter_enabled_key,
+                                                                     self.default_raw_prefilter_enabled)).lower()
+        if enabled != 'true':
+            return None
+        if scan.message_type == 'json':
+            build = RawPrefilter.for_json
+        elif scan.message_type == 'avro' and self.avro_deserializer is not None:
+            build = lambda text: RawPrefilter.for_avro(text, self.avro_deserializer.schema_string)
+        else:
+            return None
+        matcher = scan.matcher
+        prefilters = []
+        if matcher.terms and not matcher.regexes:
+            prefilters.append(RawPrefilter.any_of([build(term) for term in matcher.literals]))
+        if matcher.predicates is not None:
+            prefilters.extend(build(text) for text in matcher.predicates.raw_texts())
+        return RawPrefilter.all_of(prefilters)
+
+    def __resolve_offset_bounds(self, consumer, scan, partition_ids):
+        """
+        Start and stop offset of each partition, captured once at search start. Partitions are read between their
+        low and high watermark, narrowed to the requested time window with a single offsets_for_times() call per
+        bound. Messages produced after the search started are not read, so every scan ends deterministically.
+        Pages after the first of a paged search resume from the offsets reached by the previous page instead.
+        :return: dict() partition id -> tuple() (start offset, exclusive stop offset). Start offset is None if the
+                 partition holds no messages to scan.
+        """
+        offset_bounds = {}
+        for partition_id in partition_ids:
+            try:
+                offset_bounds[partition_id] = consumer.get_watermark_offsets(
+                    TopicPartition(scan.topic, partition_id), timeout=float(self.default_offsets_lookup_timeout))
+            except Exception as e:
+                raise ErrorHandler("Error retrieving watermark offsets: " + str(e))
+            scan.watermarks[partition_id] = offset_bounds[partition_id]
+
+        not_before, not_after = scan.time_window
+        if self.resume_offsets is not None:
+            # Next page of a paged search, offsets deleted by retention since the previous page are skipped
+            for partition_id, (low_offset, high_offset) in offset_bounds.items():
+                next_offset, stop_offset = self.resume_offsets.get(partition_id, (None, high_offset))
+                offset_bounds[partition_id] = (max(next_offset, low_offset) if next_offset is not None else None,
+                                               stop_offset)
+        elif not_before is not None:
+            # Earliest offset with timestamp >= not_before, none if every message is older
+            for topic_partition in self.__offsets_for_time(consumer, scan.topic, partition_ids, not_before):
+                low_offset, high_offset = offset_bounds[topic_partition.partition]
+                offset_bounds[topic_partition.partition] = (
+                    max(low_offset, topic_partition.offset) if topic_partition.offset >= 0 else None, high_offset)
+        if not_after is not None and self.resume_offsets is None:
+            # Earliest offset with timestamp > not_after, none if no message is newer
+            for topic_partition in self.__offsets_for_time(consumer, scan.topic, partition_ids, not_after + 1):
+                start_offset, high_offset = offset_bounds[topic_partition.partition]
+                if topic_partition.offset >= 0:
+                    offset_bounds[topic_partition.partition] = (start_offset, min(high_offset, topic_partition.offset))
+
+        return {partition_id: (start_offset if start_offset is not None and start_offset < stop_offset else None,
+                               stop_offset)
+                for partition_id, (start_offset, stop_offset) in offset_bounds.items()}
+
+    def __trim_segment_cache(self, scan):
+        """Drop cached segments of offsets deleted by retention since they were cached"""
+        if scan.segment_cache:
+            for partition_id, (low_offset, high_offset) in scan.watermarks.items():
+                SegmentCache.trim(self.environment, scan.topic, partition_id, low_offset, high_offset)
+
+    def __offsets_for_time(self, consumer, topic, partition_ids, timestamp_ms):
+        try:
+            topic_partitions = consumer.offsets_for_times(
+                [TopicPartition(topic, partition_id, timestamp_ms) for partition_id in partition_ids],
+                timeout=float(self.default_offsets_lookup_timeout))
+        except Exception as e:
+            raise ErrorHandler("Error looking up offsets for requested time window: " + str(e))
+        for topic_partition in topic_partitions:
+            if topic_partition.error:
+                raise ErrorHandler("Error looking up offsets for requested time window: " + str(topic_partition.error))
+        return topic_partitions
+
+    def __scan_partitions_parallel(self, scan, partition_ids, workers):
+        """
+        Scan partitions concurrently. Partitions are split round robin between workers, each worker borrowing
+        its own pooled consumer, as confluent_kafka.Consumer() may not be shared between threads.
+        :return: dict() partition id -> partition summary dict()
+        """
+        partition_groups = [partition_ids[i::workers] for i in range(workers)]
+        summaries = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.__scan_partition_group, scan, group) for group in partition_groups]
+            for future in futures:
+                summaries.update(future.result())
+        return summaries
+
+    def __scan_partition_group(self, scan, partition_ids):
+        started = time.perf_counter()
+        with ConsumerConnectionManager.pooled_consumer(self.environment) as consumer:
+            scan.stats.add_time(ScanStats.phase_connect, time.perf_counter() - started)
+            return {partition_id: self.__scan_partition(consumer, scan, partition_id) for partition_id in partition_ids}
+
+    def __scan_partition(self, consumer, scan, partition_id):
+        """
+        Scan a single partition within its offset bounds, oldest message first or, in newest first mode, walking
+        back from the end of the partition.
+        :param consumer: confluent_kafka.Consumer()
+        :param scan: TopicScan()
+        :return: dict() partition summary, number of messages scanned and matched
+        """
+        start_offset, stop_offset = scan.offset_bounds[partition_id]
+        if start_offset is None:
+            # Empty partition, or no messages in requested time window
+            return self.__partition_done(scan, partition_id, 0, 0)
+
+        if scan.newest_first:
+            scanned, matches = self.__scan_partition_newest_first(consumer, scan, partition_id, start_offset,
+                                                                  stop_offset)
+        elif scan.result_cache_key is not None:
+            scanned, matches = self.__scan_partition_cached(consumer, scan, partition_id, start_offset, stop_offset)
+        else:
+            matches = 0
+
+            def deliver(msg, parsed_msg):
+                nonlocal matches
+                if scan.claim_match(matches):
+                    matches += 1
+                    scan.on_match(msg, parsed_msg)
+                else:
+                    # Limit reached by a match of this or another partition, the next page starts here
+                    scan.unclaimed.setdefault(partition_id, msg.offset())
+
+            scanned = self.__read_range(consumer, scan, partition_id, start_offset, stop_offset, deliver,
+                                        lambda: scan.limit_reached(matches))
+        return self.__partition_done(scan, partition_id, scanned, matches)
+
+    def __scan_partition_cached(self, consumer, scan, partition_id, start_offset, stop_offset):
+        """
+        Replay the partition's matches cached by an identical search, then scan only the offsets added since.
+        The scanned range is cached for later searches once the partition has been read completely (and the scan
+        was not interrupted).
+        (Searches without search_count limit only, see ResultCache())
+        :return: tuple() (messages scanned, matches delivered)
+        """
+        found_msgs = []
+        scan_from = start_offset
+        cached = ResultCache.get_partition(scan.result_cache_key, partition_id, start_offset, stop_offset)
+        if cached is not None:
+            scan_from, cached_msgs = cached
+            for msg, parsed_msg in cached_msgs:
+                found_msgs.append((msg, parsed_msg))
+                scan.on_match(msg, parsed_msg)
+
+        def deliver(msg, parsed_msg):
+            found_msgs.append((msg, parsed_msg))
+            scan.on_match(msg, parsed_msg)
+
+        scanned = self.__read_range(consumer, scan, partition_id, scan_from, stop_offset, deliver) \
+            if scan_from < stop_offset else 0
+        if not scan.incomplete:
+            ResultCache.put_partition(scan.result_cache_key, partition_id, start_offset, stop_offset, found_msgs)
+        return scanned, len(found_msgs)
+
+    def __scan_partition_newest_first(self, consumer, scan, partition_id, start_offset, stop_offset):
+        """
+        Walk back from the partition's stop offset (high watermark at search start) in chunks, delivering each
+        chunk's matches newest first. Chunks double in size, up to the max chunk size, while the limit has not been
+        reached.
+        :return: tuple() (messages scanned, matches delivered)
+        """
+        chunk_end = stop_offset
+        chunk_size = self.default_newest_first_chunk_size
+        scanned = 0
+        matches = 0
+        while chunk_end > start_offset and not scan.limit_reached(matches) and not scan.interrupted():
+            chunk_start = max(start_offset, chunk_end - chunk_size)
+            chunk_msgs = []
+            scanned += self.__read_range(consumer, scan, partition_id, chunk_start, chunk_end,
+                                         lambda msg, parsed_msg: chunk_msgs.append((msg, parsed_msg)))
+            for msg, parsed_msg in reversed(chunk_msgs):
+                if not scan.claim_match(matches):
+                    break
+                matches += 1
+                scan.on_match(msg, parsed_msg)
+            chunk_end = chunk_start
+            chunk_size = min(chunk_size * 2, self.default_newest_first_max_chunk_size)
+        return scanned, matches
+
+    def __read_range(self, consumer, scan, partition_id, start_offset, stop_offset, on_match, should_stop=None):
+        """
+        Read a single partition from start offset until stop offset is reached. On indexed topics only the
+        candidate offsets returned by the token index are read within the indexed range. Reads end early once the
+        scan is interrupted, checked before every range and every batch.
+        :param start_offset: int, first offset to read
+        :param stop_offset: int, exclusive stop offset
+        :param on_match: callable(confluent_kafka.Message(), parsed message)
+        :param should_stop: optional callable(), checked before every message
+        :return: int, number of messages scanned
+        """
+        if scan.shared:
+            # Shared scans are never limited, should_stop does not apply
+            scanned, scanned_bytes = SharedScans.read(
+                self.environment, scan, partition_id, start_offset, stop_offset, on_match,
+                lambda chunk_start, chunk_stop, requests: self.__read_shared_chunk(
+                    consumer, scan, partition_id, chunk_start, chunk_stop, requests))
+            stats = scan.stats.partition(partition_id)
+            stats.scanned += scanned
+            stats.bytes += scanned_bytes
+            return scanned
+        scanned = 0
+        for range_start, range_stop, cacheable in self.__ranges_to_read(scan, partition_id, start_offset,
+                                                                        stop_offset):
+            if (should_stop and should_stop()) or scan.interrupted():
+                break
+            scanned += self.__read_stored_range(consumer, scan, partition_id, range_start, range_stop, on_match,
+                                                should_stop, cacheable)
+        return scanned
+
+    def __read_shared_chunk(self, consumer, scan, partition_id, chunk_start, chunk_stop, requests):
+        """
+        Read a chunk of a shared partition scan on this reader's consumer, evaluating every message against the
+        searches attached to the chunk. The chunk ends early once scan (the driving search) is interrupted.
+        :param requests: list() of shared_scans.SharedRequest()
+        :return: int, offset the chunk was read up to (exclusive)
+        """
+        chunk_scan = TopicScan(scan.request_params, scan.topic, scan.message_type, None, None)
+        # Time windows are checked per search, in __match_shared_msg()
+        chunk_scan.time_window = (None, None)
+        chunk_scan.shared_requests = requests
+        chunk_scan.segment_cache = scan.segment_cache
+        chunk_scan.stop_event = scan.stop_event
+        chunk_scan.deadline = scan.deadline
+        self.__read_stored_range(consumer, chunk_scan, partition_id, chunk_start, chunk_stop, None, None)
+        scan.stats.partition(partition_id).add_work(chunk_scan.stats.partition(partition_id))
+        return chunk_scan.positions.get(partition_id, chunk_start)
+
+    def __ranges_to_read(self, scan, partition_id, start_offset, stop_offset):
+        """
+        :return: list() of tuple() (start offset, exclusive stop offset, cacheable), ascending. The whole range
+                 unless part of it is covered by the topic's token index, candidate offsets close together are read
+                 as one range. Ranges made of candidate offsets only are not written to the segment cache, which
+                 would otherwise fill up with single message segments.
+        """
+        lookup = None
+        if scan.token_index is not None and not scan.matcher.regexes:
+            lookup = scan.token_index.lookup(partition_id, scan.matcher.literals, start_offset, stop_offset)
+        if lookup is None:
+            return [(start_offset, stop_offset, True)]
+
+        indexed_start, indexed_stop, candidate_offsets = lookup
+        ranges = [(start_offset, indexed_start, True)] if start_offset < indexed_start else []
+        for range_start, range_stop, cacheable in [(offset, offset + 1, False) for offset in candidate_offsets] + [
+                (indexed_stop, stop_offset, True)]:
+            if range_start >= range_stop:
+                continue
+            if ranges and range_start - ranges[-1][1] <= self.default_index_merge_gap:
+                ranges[-1] = (ranges[-1][0], range_stop, ranges[-1][2] or cacheable)
+            else:
+                ranges.append((range_start, range_stop, cacheable))
+        return ranges
+
+    def __read_stored_range(self, consumer, scan, partition_id, start_offset, stop_offset, on_match, should_stop,
+                            cacheable=True):
+        """
+        Read a contiguous offset range. With the segment cache enabled, cached offsets are read from disk and only
+        the remaining offsets are fetched from kafka (and cached, if cacheable).
+        :return: int, number of messages scanned
+        """
+        if not scan.segment_cache:
+            return self.__read_kafka_range(consumer, scan, partition_id, start_offset, stop_offset, on_match,
+                                           should_stop)
+        scanned = 0
+        stats = scan.stats.partition(partition_id)
+        for piece_start, piece_stop, segment in SegmentCache.plan(self.environment, scan.topic, partition_id,
+                                                                  start_offset, stop_offset):
+            if (should_stop and should_stop()) or scan.interrupted():
+                break
+            if segment is None:
+                segment_writer = SegmentCache.open_writer(self.environment, scan.topic, partition_id,
+                                                          piece_start) if cacheable else None
+                scanned += self.__read_kafka_range(consumer, scan, partition_id, piece_start, piece_stop, on_match,
+                                                   should_stop, segment_writer)
+                continue
+            pooled_msgs = []
+            read_to = piece_start
+            corrupt = False
+            try:
+                for msg in segment.read(scan.topic, partition_id, piece_start, piece_stop):
+                    if should_stop and should_stop():
+                        break
+                    read_to = msg.offset() + 1
+                    scanned += 1
+                    stats.scanned += 1
+                    stats.bytes += len(msg)
+                    if scan.decode_pool:
+                        pooled_msgs.append(msg)
+                        if len(pooled_msgs) >= self.__resolve_batch_settings()[0]:
+                            self.__match_pooled_msgs(scan, pooled_msgs, on_match, stats)
+                            pooled_msgs = []
                         continue
-                    elif not msg.error():
-                        parsed_msg = None
-                        # Add more message types here if desired. out of box only provided json and avro types
-                        if message_type == 'json':
-                            parsed_msg = self.__parse_json_msg(request_params, msg)
-                        elif message_type == 'avro':
-                            parsed_msg = self.__parse_avro_msg(request_params, msg)
-                        if parsed_msg:
-                            messages.insert(0, parsed_msg)
-                            if request_params.get(self.param_include_delimiter_key) == 'true':
-                                messages.insert(1,
-                                                "##############################################################")
-                                messages.insert(2,
-                                                "####################  MESSAGE SEPARATOR  #####################")
-                                messages.insert(3,
-                                                "##############################################################")
-
-                    elif msg.error():
-                        # If Kafka end of partition error received,
-                        # unassign consumer from partition and continue iteration.
+                    parsed_msg = self.__match_msg(scan, msg, stats)
+                    if parsed_msg:
+                        on_match(msg, parsed_msg)
+                else:
+                    read_to = piece_stop
+            except CorruptSegment:
+                # Damaged cache file, the offsets not read from it are fetched from kafka (and cached again)
+                SegmentCache.drop(segment)
+                corrupt = True
+            self.__match_pooled_msgs(scan, pooled_msgs, on_match, stats)
+            scan.read_to(partition_id, read_to)
+            if corrupt:
+                segment_writer = SegmentCache.open_writer(self.environment, scan.topic, partition_id,
+                                                          read_to) if cacheable else None
+                scanned += self.__read_kafka_range(consumer, scan, partition_id, read_to, piece_stop, on_match,
+                                                   should_stop, segment_writer)
+        return scanned
+
+    def __read_kafka_range(self, consumer, scan, partition_id, start_offset, stop_offset, on_match, should_stop,
+                           segment_writer=None):
+        """
+        Read a single partition from kafka in batches from start offset until stop offset is reached.
+        Completion does not depend on 'enable.partition.eof': when a batch comes back empty the consumer's position
+        is checked against the stop offset, as the remaining offsets may be transaction markers or compacted away.
+        Time spent in consume() is added to the partition's stats, as idle time when the batch came back empty.
+        :param segment_writer: optional SegmentWriter(), every message read is written to it and the range read is
+                               added to the segment cache, also when the read is stopped early
+        :return: int, number of messages scanned
+        """
+        scanned = 0
+        position = start_offset
+        idle_since = None
+        stats = scan.stats.partition(partition_id)
+        topic_partition = TopicPartition(scan.topic, partition_id, start_offset)
+        batch_size, batch_timeout = self.__resolve_batch_settings()
+        # Pooled consumers are reused between searches, always assign an explicit start offset
+        consumer.assign([topic_partition])
+        try:
+            while position < stop_offset:
+                if (should_stop and should_stop()) or scan.interrupted():
+                    break
+                started = time.perf_counter()
+                msgs = consumer.consume(batch_size, batch_timeout)
+                if not msgs:
+                    stats.idle_seconds += time.perf_counter() - started
+                    position = max(position, self.__consumer_position(consumer, topic_partition))
+                    idle_since = idle_since or time.monotonic()
+                    if position < stop_offset and time.monotonic() - idle_since > self.default_max_idle_seconds:
+                        raise ErrorHandler("Timed out reading partition " + str(partition_id) + " at offset " + str(
+                            position) + ", expected messages up to offset " + str(stop_offset))
+                    continue
+                idle_since = None
+                stats.fetch_seconds += time.perf_counter() - started
+                # Environment's bytes per second budget, shared by every search reading from its brokers
+                throttle_seconds = SearchAdmission.throttle(self.environment, msgs, scan.interrupted)
+                if throttle_seconds:
+                    scan.stats.add_time(ScanStats.phase_throttle, throttle_seconds)
+
+                pooled_msgs = []
+                for msg in msgs:
+                    if should_stop and should_stop():
+                        break
+                    if msg.error():
+                        # If Kafka end of partition error received, partition has been read completely
                         if msg.error().code() == KafkaError._PARTITION_EOF:
-                            self.consumer.unassign()
+                            position = stop_offset
                             break
                         else:
                             # currently not processing message errors, other than KafkaError.PARTITION_EOF.
                             # If desired, add this logic here.
                             error_msg_received = msg.error()
                             continue
-                except ErrorHandler as e:
-                    raise ErrorHandler("Error parsing message. " + str(e))
 
-                # Ignore generic exceptions, as there may be malformed messages in topic.
-                # If you would like an exception thrown please add here.
-                except Exception as e:
+                    position = msg.offset() + 1
+                    if msg.offset() >= stop_offset:
+                        break
+                    if segment_writer is not None:
+                        try:
+                            segment_writer.append(msg)
+                        except OSError:
+                            # Cache directory not writable (disk full), keep scanning without caching
+                            segment_writer.discard()
+                            segment_writer = None
+
+                    scanned += 1
+                    stats.scanned += 1
+                    stats.bytes += len(msg)
+                    if scan.decode_pool:
+                        pooled_msgs.append(msg)
+                        continue
+                    parsed_msg = self.__match_msg(scan, msg, stats)
+                    # Outside of __match_msg(), so errors raised by the callback stop the scan
+                    if parsed_msg:
+                        on_match(msg, parsed_msg)
+                self.__match_pooled_msgs(scan, pooled_msgs, on_match, stats)
+        finally:
+            consumer.unassign()
+            scan.read_to(partition_id, min(position, stop_offset))
+            if segment_writer is not None:
+                SegmentCache.seal(segment_writer, min(position, stop_offset))
+
+        return scanned
+
+    def __match_msg(self, scan, msg, stats):
+        """
+        :param scan: TopicScan()
+        :param msg: confluent_kafka.Message() or segment_cache.CachedMessage()
+        :param stats: PartitionStats() of the message's partition
+        :return: parsed message if it is in the scan's time window and matches the search, else None
+        """
+        started = None
+        try:
+            # Time index lookups are approximate when producer timestamps are out of order, check each message
+            if not self.__in_time_window(msg, scan.time_window):
+                return None
+            # Key lookups skip messages with another key without decoding them
+            if scan.message_key is not None and msg.key() != scan.message_key:
+                stats.prefiltered += 1
+                return None
+            # Skip decoding messages whose raw bytes cannot contain the search string
+            if scan.prefilter is not None and not scan.prefilter.is_candidate(msg.value()):
+                stats.prefiltered += 1
+                return None
+            started = time.perf_counter()
+            if scan.shared_requests is not None:
+                return self.__match_shared_msg(scan, msg, stats)
+            # Add more message types here if desired. out of box only provided json and avro types
+            if scan.message_type == 'json':
+                return self.__parse_json_msg(scan.request_params, scan.matcher, msg)
+            elif scan.message_type == 'avro':
+                return self.__parse_avro_msg(scan.request_params, scan.matcher, msg)
+        except ErrorHandler as e:
+            raise ErrorHandler("Error parsing message. " + str(e))
+
+        # Ignore generic exceptions, as there may be malformed messages in topic, counted in the partition's stats.
+        # If you would like an exception thrown please add here.
+        except Exception as e:
+            stats.decode_errors += 1
+            return None
+        finally:
+            if started is not None:
+                stats.decode_seconds += time.perf_counter() - started
+        return None
+
+    def __match_shared_msg(self, scan, msg, stats):
+        """
+        Evaluate a message of a shared scan chunk against every search it remains to be read by, decoding it once.
+        Matches are added to each search's SharedRequest(), with the search's own matched terms and metadata.
+        :param scan: TopicScan() of the chunk
+        :param stats: PartitionStats() of the chunk's partition
+        :return: None
+        """
+        candidates = []
+        for request in scan.shared_requests:
+            if not request.wants(msg.offset()):
+                continue
+            request.scanned += 1
+            request.bytes += len(msg)
+            request_scan = request.scan
+            if self.__in_time_window(msg, request_scan.time_window) and (
+                    request_scan.prefilter is None or request_scan.prefilter.is_candidate(msg.value())):
+                candidates.append(request)
+        if not candidates:
+            return None
+        if scan.message_type == 'json':
+            data = json.loads(msg.value())
+        elif scan.message_type == 'avro':
+            data = self.avro_deserializer.convert_avro_msg(msg)
+        else:
+            return None
+        for request in candidates:
+            try:
+                matched_terms = request.scan.matcher.match_message(data)
+                if matched_terms is None:
                     continue
+                # Matched terms and metadata are added per search, copy messages matched by several searches
+                request_data = dict(data) if len(candidates) > 1 and isinstance(data, dict) else data
+                request_data = self.__tag_matched_terms(request.scan.matcher, request_data, matched_terms)
+                if scan.message_type == 'json':
+                    parsed_msg = self.__add_json_metadata(request.scan.request_params, msg, request_data)
+                else:
+                    parsed_msg = self.__add_avro_metadata(request.scan.request_params, msg, request_data)
+            except ErrorHandler:
+                raise
+            except Exception:
+                # As in __match_msg(), the message is skipped, only for this search. The others still get it
+                stats.decode_errors += 1
+                continue
+            if parsed_msg:
+                request.add_match(msg, parsed_msg)
+        return None
+
+    def __match_pooled_msgs(self, scan, msgs, on_match, stats):
+        """
+        Decode a batch of avro messages in the AvroDecodePool() worker processes, passing matches to on_match in
+        offset order. Time window and prefilter are checked here, before messages are sent to the workers.
+        """
+        in_window_msgs = [msg for msg in msgs if self.__in_time_window(msg, scan.time_window)]
+        candidate_msgs = [msg for msg in in_window_msgs
+                          if (scan.message_key is None or msg.key() == scan.message_key) and
+                          (scan.prefilter is None or scan.prefilter.is_candidate(msg.value()))]
+        stats.prefiltered += len(in_window_msgs) - len(candidate_msgs)
+        if not candidate_msgs:
+            return
+        started = time.perf_counter()
+        try:
+            matches = AvroDecodePool.match_msgs(self.environment, scan.topic, scan.matcher.terms,
+                                                scan.matcher.field_filters, candidate_msgs)
+        except ErrorHandler as e:
+            raise ErrorHandler("Error parsing message. " + str(e))
+        finally:
+            stats.decode_seconds += time.perf_counter() - started
+        for msg, data, matched_terms in matches:
+            parsed_msg = self.__add_avro_metadata(scan.request_params, msg,
+                                                  self.__tag_matched_terms(scan.matcher, data, matched_terms))
+            if parsed_msg:
+                on_match(msg, parsed_msg)
+
+    @staticmethod
+    def __consumer_position(consumer, topic_partition):
+        """Next offset the consumer will fetch, -1 if not known yet"""
+        try:
+            return consumer.position([topic_partition])[0].offset
+        except Exception:
+            return -1
+
+    def __resolve_batch_settings(self):
+        """
+        :return: tuple() (max messages per consume() call, consume() timeout in seconds), from main config
+                 'consume.batch.size' and 'consume.timeout.seconds' or defaults
+        """
+        config = ConnectionConfig.connection_details or {}
+        return (int(config.get(self.config_consume_batch_size_key, self.default_consume_batch_size)),
+                float(config.get(self.config_consume_timeout_key, self.default_consume_timeout)))
+
+    def __partition_done(self, scan, partition_id, scanned, matches):
+        stats = scan.stats.partition(partition_id)
+        stats.matches = matches
+        stats.done = True
+        summary = {self.summary_partition_key: partition_id,
+                   self.summary_scanned_key: scanned,
+                   self.summary_matches_key: matches}
+        if scan.on_partition_done:
+            scan.on_partition_done(summary)
+        return summary
 
+    @staticmethod
+    def __in_time_window(msg, time_window):
+        not_before, not_after = time_window
+        if not_before is None and not_after is None:
+            return True
+        timestamp_type, timestamp = msg.timestamp()
+        if timestamp_type == TIMESTAMP_NOT_AVAILABLE:
+            return True
+        return (not_before is None or timestamp >= not_before) and (not_after is None or timestamp <= not_after)
+
+    def __build_message_list(self, request_params, parsed_msgs):
+        """
+        Build response list, adding the delimiter after every message if requested.
+        :param parsed_msgs: list() of parsed messages, in response order
+        :return: list()
+        """
+        if request_params.get(self.param_include_delimiter_key) != 'true':
+            return parsed_msgs
+        messages = []
+        for parsed_msg in parsed_msgs:
+            messages.append(parsed_msg)
+            messages.extend(self.message_delimiter)
         return messages
 
-    def __parse_json_msg(self, request_params, msg):
+    def __tag_matched_terms(self, matcher, data, matched_terms):
+        """Add the terms a message matched to it, for multi-term and regex searches"""
+        if matcher.tag_matches and isinstance(data, dict):
+            data[self.message_matched_terms_key] = matched_terms
+        return data
+
+    def __parse_json_msg(self, request_params, matcher, msg):
         """
         Generic json message parser provided below.  You must add your customer logic here
         Parses polled json message.  Add metadata if enabled.
         :param request_params:
+        :param matcher: message_filter.SearchMatcher() of requested search terms and field filters
         :param msg: confluent_kafka.Message()
-        :return: dict() data, if contains requested search_string.  Else returns None
+        :return: dict() data, if contains requested search_string and passes field filters.  Else returns None
         """
         data = json.loads(msg.value())
-        if request_params.get(self.param_search_string_key) in str(data).lower():
-            if request_params.get(self.param_include_kafka_meta_key) == 'true':
-                data['additional_added_metadata'] = dict()
-                try:
-                    key_data = msg.key().decode()
-                    if key_data.startswith("{"):
-                        data['additional_added_metadata']['key'] = json.loads(msg.key())
-                    else:
-                        data['additional_added_metadata']['key'] = key_data
-
-                    data['additional_added_metadata']['another_example'] = msg.another_example()
-                except Exception as e:
-                    msg['additional_added_metadata']['key'] = "Error retrieving key: " + str(e)
-            return data
+        matched_terms = matcher.match_message(data)
+        if matched_terms is not None:
+            return self.__add_json_metadata(request_params, msg, self.__tag_matched_terms(matcher, data, matched_terms))
         else:
             return None
 
-    def __parse_avro_msg(self, request_params, msg):
+    def __add_json_metadata(self, request_params, msg, data):
+        """
+        Add metadata to a decoded json message matching the search, if enabled.
+        :param msg: confluent_kafka.Message()
+        :param data: dict() decoded message
+        :return: dict() data
+        """
+        if request_params.get(self.param_include_kafka_meta_key) == 'true':
+            data['additional_added_metadata'] = dict()
+            try:
+                key_data = msg.key().decode()
+                if key_data.startswith("{"):
+                    data['additional_added_metadata']['key'] = json.loads(msg.key())
+                else:
+                    data['additional_added_metadata']['key'] = key_data
+
+                data['additional_added_metadata']['another_example'] = msg.another_example()
+            except Exception as e:
+                msg['additional_added_metadata']['key'] = "Error retrieving key: " + str(e)
+        return data
+
+    def __parse_avro_msg(self, request_params, matcher, msg):
         """
         Generic avro message parser provided below.  You must add your customer logic here
         Parses polled avro message.  Add metadata if enabled.
         :param request_params: dict()
+        :param matcher: message_filter.SearchMatcher() of requested search terms and field filters
         :param msg: confluent_kafka.Message()
-        :return: dict() data, if contains requested search_string.  Else returns None
+        :return: dict() data, if contains requested search_string and passes field filters.  Else returns None
         """
         data = self.avro_deserializer.convert_avro_msg(msg)
-        if request_params.get(self.param_search_string_key) in str(data).lower():
-            if request_params.get(self.param_include_kafka_meta_key) == 'true':
-                data['additional_added_metadata'] = dict()
-                try:
-                    data['additional_added_metadata']['key'] = msg.key().decode()
-                    data['additional_added_metadata']['another_example'] = msg.another_example()
-                except Exception as e:
-                    data['additional_added_metadata'][
-                        'error'] = "Error extracting metadata: " + str(e)
-            return data
+        matched_terms = matcher.match_message(data)
+        if matched_terms is not None:
+            return self.__add_avro_metadata(request_params, msg, self.__tag_matched_terms(matcher, data, matched_terms))
         else:
             return None
+
+    def __add_avro_metadata(self, request_params, msg, data):
+        """
+        Add metadata to a decoded avro message matching the search, if enabled.
+        :param msg: confluent_kafka.Message()
+        :param data: dict() decoded message
+        :return: dict() data
+        """
+        if request_params.get(self.param_include_kafka_meta_key) == 'true':
+            data['additional_added_metadata'] = dict()
+            try:
+                data['additional_added_metadata']['key'] = msg.key().decode()
+                data['additional_added_metadata']['another_example'] = msg.another_example()
+            except Exception as e:
+                data['additional_added_metadata'][
+                    'error'] = "Error extracting metadata: " + str(e)
+        return data
+
+
+class TopicScan:
+    """
+    State shared by the partition scans of a single topic search: request params, callbacks, time window,
+    per partition offset bounds and the search_count match limit.
+    With newest first scanning the limit applies to every partition, otherwise to the topic as a whole.
+    A scan interrupted by its stop event or deadline ends early and is marked incomplete.
+    Paged searches use their page size as limit, and resume from the offsets each partition was read up to.
+    """
+
+    def __init__(self, request_params, topic, message_type, on_match, on_partition_done, stats=None):
+        self.request_params = request_params
+        self.topic = topic
+        self.message_type = message_type
+        self.on_match = on_match
+        self.on_partition_done = on_partition_done
+        # SearchMatcher() of the search terms and field filters, compiled once per distinct search
+        search_terms = request_params.get(constants.PARAM_SEARCH_TERMS_KEY) or SearchMatcher.normalize_terms(
+            [request_params.get(constants.PARAM_SEARCH_STRING_KEY) or ''])
+        self.matcher = SearchMatcher.for_terms(search_terms,
+                                               request_params.get(constants.PARAM_FIELD_FILTERS_KEY) or ())
+        self.newest_first = request_params.get(constants.PARAM_NEWEST_FIRST_KEY) == 'true'
+        # Key of a key lookup (bytes), only messages with this key match. None searches every message
+        message_key = request_params.get(constants.PARAM_MESSAGE_KEY_KEY)
+        self.message_key = message_key.encode() if message_key is not None else None
+        # search_count, or the page size of a paged search (never both, see RequestHandler)
+        self.limit = request_params.get(constants.PARAM_SEARCH_COUNT_KEY) or request_params.get(
+            constants.PARAM_PAGE_SIZE_KEY)
+        # (not before, not after) in epoch milliseconds, None where no bound was requested
+        self.time_window = tuple(int(request_params[key].timestamp() * 1000) if request_params.get(key) else None
+                                 for key in (constants.PARAM_NOT_BEFORE_KEY, constants.PARAM_NOT_AFTER_KEY))
+        # partition id -> (start offset, exclusive stop offset), set by KafkaReader before partitions are scanned
+        self.offset_bounds = {}
+        # partition id -> (low, high) watermark at search start
+        self.watermarks = {}
+        # Read through the local segment cache (segment_cache.py)
+        self.segment_cache = False
+        # TopicIndex() of the topic (token_index.py), None if not indexed
+        self.token_index = None
+        # ResultCache() key of the search, None if results are not cached
+        self.result_cache_key = None
+        # Decode avro messages in AvroDecodePool() worker processes
+        self.decode_pool = False
+        # Partitions are read by shared scans (shared_scans.py). Chunks of a shared scan are read with a scan of
+        # their own, whose messages are evaluated against the SharedRequest() list of the searches attached
+        self.shared = False
+        self.shared_requests = None
+        # RawPrefilter(), None if every message has to be decoded
+        self.prefilter = None
+        # ScanStats() counters and timers of the scan
+        self.stats = stats or ScanStats()
+        # threading.Event() and time.monotonic() deadline ending the scan early, see KafkaReader.set_interrupt()
+        self.stop_event = None
+        self.deadline = None
+        self.incomplete = False
+        # partition id -> offset every message before has been read (and its match delivered), and offset of the
+        # first match left out once the limit was reached
+        self.positions = {}
+        self.unclaimed = {}
+        self.matches = 0
+        self.lock = threading.Lock()
+
+    def claim_match(self, partition_matches):
+        """
+        Reserve a slot for one more match, False if the limit has been reached
+        :param partition_matches: int, matches delivered so far by the calling partition scan
+        """
+        if self.limit is None:
+            return True
+        if self.newest_first:
+            return partition_matches < self.limit
+        with self.lock:
+            if self.matches >= self.limit:
+                return False
+            self.matches += 1
+            return True
+
+    def interrupted(self):
+        """True once the stop event is set or the deadline has passed, the scan is then marked incomplete"""
+        if not self.incomplete and ((self.stop_event is not None and self.stop_event.is_set()) or
+                                    (self.deadline is not None and time.monotonic() >= self.deadline)):
+            self.incomplete = True
+        return self.incomplete
+
+    def read_to(self, partition_id, offset):
+        """Record that partition has been read up to offset (exclusive), ranges are read in ascending order"""
+        self.positions[partition_id] = max(self.positions.get(partition_id, offset), offset)
+
+    def next_offsets(self):
+        """
+        Where the next page of a paged search starts, oldest first scans only
+        :return: dict() partition id -> tuple() (next offset, exclusive stop offset) of every partition not read
+                 completely
+        """
+        next_offsets = {}
+        for partition_id, (start_offset, stop_offset) in self.offset_bounds.items():
+            if start_offset is None:
+                continue
+            next_offset = min(self.positions.get(partition_id, start_offset),
+                              self.unclaimed.get(partition_id, stop_offset))
+            if next_offset < stop_offset:
+                next_offsets[partition_id] = (max(next_offset, start_offset), stop_offset)
+        return next_offsets
+
+    def limit_reached(self, partition_matches):
+        if self.limit is None:
+            return False
+        return (partition_matches if self.newest_first else self.matches) >= self.limit
@@ -1,11 +1,31 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 from confluent_kafka import Consumer
 
+import constants
+import default_constants
 from config_handler import ConnectionConfig
 from error_handler import ErrorHandler
 
 
 class ConsumerConnectionManager:
     """ Initializes KafkaConsumer with connection details from main config file"""
+    # Main config keys
+    config_pool_key = constants.CONFIG_CONSUMER_POOL_KEY
+    config_metadata_ttl_key = constants.CONFIG_METADATA_CACHE_TTL_KEY
+    config_consumer_tuning_key = constants.CONFIG_CONSUMER_TUNING_KEY
+    default_consumer_tuning = default_constants.DEFAULT_CONSUMER_TUNING
+    default_metadata_ttl = default_constants.DEFAULT_METADATA_CACHE_TTL_SECONDS
+    default_list_topics_timeout = default_constants.DEFAULT_LIST_TOPICS_TIMEOUT_SECONDS
+
+    # Long-lived state shared by all requests: environment -> ConsumerPool() / (expiry, topic metadata)
+    __pools = {}
+    __metadata_cache = {}
+    __lock = threading.Lock()
+    __metadata_locks = {}
 
     @classmethod
     def initialize_kafka_consumer(cls, environment):
@@ -15,6 +35,94 @@ class ConsumerConnectionManager:
         except Exception as e:
             raise ErrorHandler("Error initializing Kafka Consumer: " + str(e))
 
+    @classmethod
+    def acquire_consumer(cls, environment):
+        """
+        Borrow a connected consumer from the environment's pool. Must be returned with release_consumer().
+        :param environment: string
+        :return: confluent_kafka.Consumer()
+        """
+        return cls.__get_pool(environment).acquire()
+
+    @classmethod
+    def release_consumer(cls, environment, consumer, discard=False):
+        """
+        Return a borrowed consumer to the environment's pool.
+        :param discard: bool, close the consumer instead of keeping it for later requests
+        """
+        cls.__get_pool(environment).release(consumer, discard)
+
+    @classmethod
+    @contextmanager
+    def pooled_consumer(cls, environment):
+        """Borrow a consumer from the environment's pool for the duration of the with block"""
+        consumer = cls.acquire_consumer(environment)
+        try:
+            yield consumer
+        finally:
+            cls.release_consumer(environment, consumer)
+
+    @classmethod
+    def get_topic_metadata(cls, environment):
+        """
+        Topic metadata of the environment's cluster, cached for 'metadata.cache.ttl.seconds'.
+        :param environment: string
+        :return: dict() topic name -> confluent_kafka.admin.TopicMetadata()
+        """
+        cached = cls.__metadata_cache.get(environment)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        with cls.__get_metadata_lock(environment):
+            # Another request may have refreshed the cache while waiting on the lock
+            cached = cls.__metadata_cache.get(environment)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            with cls.pooled_consumer(environment) as consumer:
+                # Timeout errors typically signify a connection error to kafka-broker.
+                topics = consumer.list_topics(timeout=float(cls.default_list_topics_timeout)).topics
+            cls.__metadata_cache[environment] = (time.monotonic() + cls.__metadata_ttl(), topics)
+            return topics
+
+    @classmethod
+    def invalidate_metadata(cls, environment=None):
+        """Drop cached topic metadata for given environment, or all environments if none given"""
+        if environment is None:
+            cls.__metadata_cache.clear()
+        else:
+            cls.__metadata_cache.pop(environment, None)
+
+    @classmethod
+    def close_pools(cls):
+        """Close all idle pooled consumers, used at application shutdown"""
+        with cls.__lock:
+            pools = list(cls.__pools.values())
+            cls.__pools.clear()
+        for pool in pools:
+            pool.close()
+
+    @classmethod
+    def __get_pool(cls, environment):
+        pool = cls.__pools.get(environment)
+        if pool is None:
+            with cls.__lock:
+                pool = cls.__pools.get(environment)
+                if pool is None:
+                    pool_config = (ConnectionConfig.connection_details or {}).get(cls.config_pool_key) or {}
+                    pool = ConsumerPool(environment, pool_config)
+                    cls.__pools[environment] = pool
+        return pool
+
+    @classmethod
+    def __get_metadata_lock(cls, environment):
+        with cls.__lock:
+            return cls.__metadata_locks.setdefault(environment, threading.Lock())
+
+    @classmethod
+    def __metadata_ttl(cls):
+        return float((ConnectionConfig.connection_details or {}).get(cls.config_metadata_ttl_key,
+                                                                     cls.default_metadata_ttl))
+
     @classmethod
     def __build_consumer_dict(cls, environment):
         try:
@@ -33,7 +141,108 @@ class ConsumerConnectionManager:
                 'ssl.certificate.location': config['ssl'][environment]['ssl.certificate.location'],
                 'ssl.ca.location': config['ssl.ca.location'],
                 'enable.partition.eof': False if config.get('enable.partition.eof').lower() == 'false' else True,
-                'api.version.request': False if config.get('api.version.request').lower() == 'false' else True
+                'api.version.request': False if config.get('api.version.request').lower() == 'false' else True,
+                # Fetch sizing tuned for bulk scanning, overridable in main config
+                **{**cls.default_consumer_tuning, **(config.get(cls.config_consumer_tuning_key) or {})}
             }
         except KeyError as e:
             raise ErrorHandler("Missing required key from main config file. Missing key: " + str(e))
+
+
+class ConsumerPool:
+    """
+    Bounded pool of long-lived consumers for a single environment.
+    Consumers are created on demand up to 'size', idle consumers are closed after 'idle.timeout.seconds'
+    and consumers idle for longer than 'health.check.interval.seconds' are checked before being handed out.
+    """
+    # Main config keys ('consumer.pool' section)
+    config_size_key = constants.CONFIG_CONSUMER_POOL_SIZE_KEY
+    config_idle_timeout_key = constants.CONFIG_CONSUMER_POOL_IDLE_TIMEOUT_KEY
+    config_acquire_timeout_key = constants.CONFIG_CONSUMER_POOL_ACQUIRE_TIMEOUT_KEY
+    config_health_check_interval_key = constants.CONFIG_CONSUMER_POOL_HEALTH_CHECK_INTERVAL_KEY
+    config_health_check_timeout_key = constants.CONFIG_CONSUMER_POOL_HEALTH_CHECK_TIMEOUT_KEY
+
+    def __init__(self, environment, pool_config):
+        self.environment = environment
+        self.size = int(pool_config.get(self.config_size_key, default_constants.DEFAULT_CONSUMER_POOL_SIZE))
+        self.idle_timeout = float(
+            pool_config.get(self.config_idle_timeout_key, default_constants.DEFAULT_CONSUMER_POOL_IDLE_TIMEOUT_SECONDS))
+        self.acquire_timeout = float(pool_config.get(self.config_acquire_timeout_key,
+                                                     default_constants.DEFAULT_CONSUMER_POOL_ACQUIRE_TIMEOUT_SECONDS))
+        self.health_check_interval = float(pool_config.get(
+            self.config_health_check_interval_key, default_constants.DEFAULT_CONSUMER_POOL_HEALTH_CHECK_INTERVAL_SECONDS))
+        self.health_check_timeout = float(pool_config.get(
+            self.config_health_check_timeout_key, default_constants.DEFAULT_CONSUMER_POOL_HEALTH_CHECK_TIMEOUT_SECONDS))
+        self.slots = threading.BoundedSemaphore(self.size)
+        # (consumer, last used time), most recently used on the right
+        self.idle = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.slots.acquire(timeout=self.acquire_timeout):
+            raise ErrorHandler(
+                "Timed out waiting for an available Kafka consumer in environment: " + self.environment +
+                ". Consider increasing consumer.pool size in main config file")
+        try:
+            consumer = self.__take_idle()
+            return consumer if consumer else ConsumerConnectionManager.initialize_kafka_consumer(self.environment)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, consumer, discard=False):
+        try:
+            if not discard:
+                try:
+                    consumer.unassign()
+                except Exception:
+                    discard = True
+            if discard:
+                self.__close_consumer(consumer)
+            else:
+                with self.lock:
+                    self.idle.append((consumer, time.monotonic()))
+            self.__evict_expired()
+        finally:
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            idle = list(self.idle)
+            self.idle.clear()
+        for consumer, last_used in idle:
+            self.__close_consumer(consumer)
+
+    def __take_idle(self):
+        self.__evict_expired()
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                consumer, last_used = self.idle.pop()
+            if time.monotonic() - last_used < self.health_check_interval or self.__is_healthy(consumer):
+                return consumer
+            self.__close_consumer(consumer)
+
+    def __evict_expired(self):
+        """Close consumers that have been idle for longer than idle timeout (oldest are on the left)"""
+        expired = []
+        with self.lock:
+            while self.idle and time.monotonic() - self.idle[0][1] > self.idle_timeout:
+                expired.append(self.idle.popleft()[0])
+        for consumer in expired:
+            self.__close_consumer(consumer)
+
+    def __is_healthy(self, consumer):
+        try:
+            consumer.list_topics(timeout=self.health_check_timeout)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def __close_consumer(consumer):
+        try:
+            consumer.close()
+        except Exception:
+            pass
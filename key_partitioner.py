@@ -0,0 +1,81 @@
+import zlib
+
+import constants
+import default_constants
+from config_handler import ConnectionConfig
+from error_handler import ErrorHandler
+
+
+class KeyPartitioner:
+    """
+    Partition a message key was produced to, computed with the producer's partitioner so key lookups only scan that
+    partition. The partitioner is configured per topic ('key.partitioner' section):
+        - murmur2: default partitioner of the Java client (and librdkafka's 'murmur2' / 'murmur2_random')
+        - consistent: CRC32 of the key, librdkafka's 'consistent' / 'consistent_random'
+        - none: keys are not partitioned by a known partitioner, every partition is scanned
+    Only valid while the topic's partition count is the one the messages were produced with, messages produced
+    before partitions were added may be in another partition.
+    """
+    # Main config keys ('key.partitioner' section)
+    config_key_partitioner_key = constants.CONFIG_KEY_PARTITIONER_KEY
+    config_default_key = constants.CONFIG_KEY_PARTITIONER_DEFAULT_KEY
+    config_topics_key = constants.CONFIG_KEY_PARTITIONER_TOPICS_KEY
+    default_partitioner = default_constants.DEFAULT_KEY_PARTITIONER
+
+    partitioner_murmur2 = 'murmur2'
+    partitioner_consistent = 'consistent'
+    partitioner_none = 'none'
+
+    @classmethod
+    def partition_for(cls, topic, key, partition_count):
+        """
+        :param key: bytes, message key
+        :param partition_count: int, partitions of topic
+        :return: int, partition id of key, None if every partition has to be scanned
+        """
+        partitioner = cls.__partitioner_of(topic)
+        if partitioner == cls.partitioner_none or partition_count < 1:
+            return None
+        if partitioner == cls.partitioner_murmur2:
+            return (cls.murmur2(key) & 0x7fffffff) % partition_count
+        if partitioner == cls.partitioner_consistent:
+            return zlib.crc32(key) % partition_count
+        raise ErrorHandler("Unknown key partitioner '" + partitioner + "' configured for topic: " + topic +
+                           ". Use " + cls.partitioner_murmur2 + ", " + cls.partitioner_consistent + " or " +
+                           cls.partitioner_none)
+
+    @staticmethod
+    def murmur2(data):
+        """
+        32 bit murmur2 hash of data as computed by the Java client (org.apache.kafka.common.utils.Utils.murmur2)
+        :param data: bytes
+        :return: int, signed 32 bit hash
+        """
+        length = len(data)
+        m = 0x5bd1e995
+        h = (0x9747b28c ^ length) & 0xffffffff
+        length4 = length - length % 4
+        for i in range(0, length4, 4):
+            k = data[i] | (data[i + 1] << 8) | (data[i + 2] << 16) | (data[i + 3] << 24)
+            k = (k * m) & 0xffffffff
+            k ^= k >> 24
+            k = (k * m) & 0xffffffff
+            h = ((h * m) & 0xffffffff) ^ k
+        remaining = length % 4
+        if remaining == 3:
+            h ^= data[length4 + 2] << 16
+        if remaining >= 2:
+            h ^= data[length4 + 1] << 8
+        if remaining >= 1:
+            h ^= data[length4]
+            h = (h * m) & 0xffffffff
+        h ^= h >> 13
+        h = (h * m) & 0xffffffff
+        h ^= h >> 15
+        return h - 0x100000000 if h & 0x80000000 else h
+
+    @classmethod
+    def __partitioner_of(cls, topic):
+        config = (ConnectionConfig.connection_details or {}).get(cls.config_key_partitioner_key) or {}
+        topics = config.get(cls.config_topics_key) or {}
+        return str(topics.get(topic) or config.get(cls.config_default_key) or cls.default_partitioner).strip().lower()
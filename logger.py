@@ -1,63 +1,139 @@
 import csv
 import io
 import json
-import logging
 import os
-from copy import deepcopy
+import queue
+import threading
+import time
 
 import constants
 import default_constants
 from config_handler import ConnectionConfig
+from search_metrics import SearchMetrics
 
 
 class RequestLogger:
-    """Implements logger, create directories and log file, and triggers logs"""
+    """
+    Implements the request audit log. log_request() only takes a snapshot of the params and queues it, a background
+    AuditLogWriter() formats queued records and appends them to the log file in batches. When the queue is full
+    records are dropped, and counted in SearchMetrics(), rather than holding up requests.
+    """
     # Default logger config value from default_contants.py
     default_logger_path = default_constants.DEFAULT_LOGGER_PATH
     default_logger_disablement = default_constants.DEFAULT_LOGGER_ENABLED
+    default_queue_size = default_constants.DEFAULT_LOGGER_QUEUE_SIZE
+    default_batch_size = default_constants.DEFAULT_LOGGER_BATCH_SIZE
     # Logger configs from constants.py
-    logger_name = constants.LOGGER_NAME
     logger_disable_key = constants.LOGGER_DISABLE_KEY
     logger_path_key = constants.LOGGER_PATH_KEY
+    logger_queue_size_key = constants.LOGGER_QUEUE_SIZE_KEY
+    logger_batch_size_key = constants.LOGGER_BATCH_SIZE_KEY
     # Param dict() keys
     json_topics = constants.PARAM_JSON_TOPICS_KEY
     avro_topics = constants.PARAM_AVRO_TOPICS_KEY
     search_string = constants.PARAM_SEARCH_STRING_KEY
 
+    # AuditLogWriter(), None while the logger is disabled
+    __writer = None
+
     @classmethod
     def log_request(cls, params):
         """
         Log parsed incoming request
         :param params: dict()
         """
-        # convert all sets into lists, from params, and log message
-        params_copy = deepcopy(params)
-        params_copy[cls.json_topics] = list(params_copy[cls.json_topics])
-        params_copy[cls.avro_topics] = list(params_copy[cls.avro_topics])
-        logger = logging.getLogger(cls.logger_name)
-        logger.debug(json.dumps(params_copy))
+        writer = cls.__writer
+        if writer is None:
+            return
+        # Shallow snapshot, params are not modified once built. Topic sets are copied, as lists for the json record
+        writer.put((time.time(), {**params, cls.json_topics: list(params[cls.json_topics]),
+                                  cls.avro_topics: list(params[cls.avro_topics])}))
 
     @classmethod
     def create_logger(cls):
         """Create logger, if enabled, at application boot time"""
-        logger = logging.getLogger(cls.logger_name)
         # Check if logger has been enabled, if false disable logger.
         if ConnectionConfig.logger_details.get(cls.logger_disable_key,
-                                               cls.default_logger_disablement).lower() == 'true':
-            # Creates log file at location specified in logger_config.yml ('logger.requests.path)
-            # or uses default value provided above (default_logger_path)
-            try:
-                log_filepath = ConnectionConfig.logger_details.get(cls.logger_path_key, cls.default_logger_path)
-                os.makedirs(os.path.dirname(log_filepath), exist_ok=True)
-            except Exception as e:
-                raise Exception("Error creating log file. Check log path provided: " + log_filepath)
-            fh = logging.FileHandler(log_filepath)
-            logger.addHandler(fh)
-            logger.handlers[0].setFormatter(CsvFormatter())
-            logger.setLevel(logging.DEBUG)
-            logger.propagate = False
-        else:
-            logger.disable = True
+                                               cls.default_logger_disablement).lower() != 'true':
+            return
+        # Creates log file at location specified in logger_config.yml ('logger.requests.path)
+        # or uses default value provided above (default_logger_path)
+        try:
+            log_filepath = ConnectionConfig.logger_details.get(cls.logger_path_key, cls.default_logger_path)
+            os.makedirs(os.path.dirname(log_filepath), exist_ok=True)
+        except Exception as e:
+            raise Exception("Error creating log file. Check log path provided: " + log_filepath)
+        cls.shutdown()
+        cls.__writer = AuditLogWriter(
+            log_filepath,
+            int(ConnectionConfig.logger_details.get(cls.logger_queue_size_key, cls.default_queue_size)),
+            int(ConnectionConfig.logger_details.get(cls.logger_batch_size_key, cls.default_batch_size)))
+
+    @classmethod
+    def shutdown(cls):
+        """Write the records still queued and stop the writer thread, used at application shutdown"""
+        writer, cls.__writer = cls.__writer, None
+        if writer is not None:
+            writer.stop()
+
+
+class AuditLogWriter:
+    """
+    Background thread appending queued audit records to the log file. Every wake up writes all records queued
+    since (up to batch size) with a single write and flush, so under load records are written in batches.
+    """
+    __stop = object()
+
+    def __init__(self, log_filepath, queue_size, batch_size):
+        """
+        :param queue_size: int, records queued at most, later records are dropped until the writer catches up
+        :param batch_size: int, records written per write
+        """
+        self.log_filepath = log_filepath
+        self.batch_size = max(1, batch_size)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        # Only used on the writer thread
+        self.formatter = CsvFormatter()
+        self.thread = threading.Thread(target=self.__run, name='request-audit-log', daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        """:param record: tuple() (epoch seconds, params dict())"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            SearchMetrics.record_audit_log_dropped(1)
+
+    def stop(self, timeout=5.0):
+        try:
+            self.queue.put(self.__stop, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+    def __run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = any(record is self.__stop for record in batch)
+            records = [record for record in batch if record is not self.__stop]
+            if records:
+                self.__write(records)
+            if stopping:
+                return
+
+    def __write(self, records):
+        try:
+            data = ''.join(self.formatter.format_record(timestamp, params) + '\n' for timestamp, params in records)
+            with open(self.log_filepath, 'a', encoding='utf-8') as log_file:
+                log_file.write(data)
+        except Exception:
+            # Log file not writable (disk full, path removed), keep serving requests without audit records
+            SearchMetrics.record_audit_log_dropped(len(records))
 
 
 class RequestLoggerDialect(csv.Dialect):
@@ -65,12 +141,13 @@ class RequestLoggerDialect(csv.Dialect):
     doublequote = False
     escapechar = ' '
     lineterminator = "\n"
-    quotechar = ""
+    # None, an empty quotechar is rejected by newer csv modules (QUOTE_NONE never quotes)
+    quotechar = None
     quoting = csv.QUOTE_NONE
 
 
-class CsvFormatter(logging.Formatter):
-    """Log formatter.  You will have access to Param dict()"""
+class CsvFormatter:
+    """Log formatter.  You will have access to Param dict(). Not thread safe, used by the writer thread only"""
     # Param keys
     search_string = constants.PARAM_SEARCH_STRING_KEY
     environment = constants.PARAM_ENVIRONMENT_KEY
@@ -78,19 +155,22 @@ class CsvFormatter(logging.Formatter):
     avro_topics = constants.PARAM_AVRO_TOPICS_KEY
 
     def __init__(self):
-        super().__init__()
         self.output = io.StringIO()
         self.writer = csv.writer(self.output, dialect=RequestLoggerDialect)
 
-    def format(self, record):
-        timestamp = self.formatTime(record).replace(",", "+")
-        dict_record = json.loads(record.msg)
-        self.writer.writerow(["timestamp: " + timestamp,
-                              "search_param: " + dict_record[self.search_string],
-                              "environment: " + dict_record[self.environment],
-                              "topics_searched: " + str(
-                                  dict_record[self.json_topics] + dict_record[self.avro_topics]),
-                              "full_request: " + record.msg,
+    def format_record(self, timestamp, params):
+        """
+        :param timestamp: float, epoch seconds the request was logged at
+        :param params: dict() snapshot of the request's params
+        :return: string
+        """
+        # default=str, params may include datetime values (not_before/not_after)
+        full_request = json.dumps(params, default=str)
+        self.writer.writerow(["timestamp: " + self.__format_time(timestamp),
+                              "search_param: " + str(params[self.search_string]),
+                              "environment: " + params[self.environment],
+                              "topics_searched: " + str(params[self.json_topics] + params[self.avro_topics]),
+                              "full_request: " + full_request,
                               "---------------------------------------------",
                               "---------------------------------------------"
                               ])
@@ -98,3 +178,9 @@ class CsvFormatter(logging.Formatter):
         self.output.truncate(0)
         self.output.seek(0)
         return data.strip()
+
+    @staticmethod
+    def __format_time(timestamp):
+        """Local time, formatted as by logging.Formatter.formatTime() with '+' before the milliseconds"""
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) + "+%03d" % int(
+            (timestamp - int(timestamp)) * 1000)
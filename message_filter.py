@@ -0,0 +1,443 @@
+import json
+import re
+from functools import lru_cache
+
+import constants
+from error_handler import ErrorHandler
+
+
+class RawPrefilter:
+    """
+    Cheap test of a message's raw value bytes for the search string, run before the message is decoded.
+    Only candidate messages are decoded and verified by the parsers in kafka_client.py, so the prefilter must never
+    reject a message that the full search (search string in str(decoded message).lower()) would match.
+    A prefilter is only built where that holds, otherwise None is returned and every message is decoded.
+    """
+    # Search strings containing these characters may match the python repr of the decoded message
+    # (quotes, key/value and item separators, brackets) without matching the raw bytes
+    unsafe_search_chars = set('\'"\\:,{}[]()')
+    # Raw json that may render differently once decoded: escape sequences, non ascii text (unicode lower casing),
+    # floats whose python repr differs from the raw digits (exponents, long mantissas, small fractions).
+    # Number shapes are found on a translated copy (digits -> '0', 'e'/'E' -> 'e', '.' kept, other bytes -> ' '),
+    # a regular expression over every message costs more than decoding it
+    json_number_shapes = bytes(48 if 48 <= byte <= 57 else 46 if byte == 46 else 101 if byte in (69, 101) else 32
+                               for byte in range(256))
+    # Text that python repr adds for decoded avro values which is not present in the binary encoding
+    avro_repr_vocabulary = ('none', 'true', 'false', '-inf', 'nan', 'e-', 'e+', '.')
+    # Avro types decoded into objects whose repr is not present in the binary encoding
+    avro_unsafe_types = ('bytes', 'fixed')
+    # Non ascii characters whose lower case is ascii (KELVIN SIGN, LATIN CAPITAL LETTER I WITH DOT ABOVE)
+    ascii_lowercase_pattern = re.compile(b'\xe2\x84\xaa|\xc4\xb0')
+
+    def __init__(self, search_terms, may_differ, null_bytes=None):
+        # tuple() of lower case search terms as bytes, a message is a candidate if it holds any of them
+        self.search_terms = search_terms
+        # function, raw value -> truthy if the decoded message may hold text that is not in the raw value
+        self.may_differ = may_differ
+        # Raw bytes decoded to None, when the search string could match 'none'
+        self.null_bytes = null_bytes
+
+    @classmethod
+    def for_json(cls, search_string):
+        """
+        :param search_string: string, lower case search string
+        :return: RawPrefilter() for json messages, None if prefiltering would not be sound
+        """
+        if not cls.__is_safe_search_string(search_string):
+            return None
+        null_bytes = b'null' if search_string in 'none' else None
+        return cls((search_string.encode(),), cls.json_decode_may_differ, null_bytes)
+
+    @classmethod
+    def for_avro(cls, search_string, schema_string):
+        """
+        Avro binary encoding stores strings as raw utf-8 bytes, while numbers, booleans, enums and field names
+        are not present as text. Prefiltering is therefore limited to search strings that can only match string
+        values: no digits, and not part of any field name, enum symbol, default value or repr text.
+        Text that only exists inside python escape sequences of non printable characters is not covered.
+        :param search_string: string, lower case search string
+        :param schema_string: string, reader schema of topic
+        :return: RawPrefilter() for avro messages, None if prefiltering would not be sound
+        """
+        if not cls.__is_safe_search_string(search_string) or any(char.isdigit() for char in search_string):
+            return None
+        try:
+            vocabulary = cls.__avro_schema_vocabulary(json.loads(schema_string))
+        except (TypeError, ValueError):
+            return None
+        if vocabulary is None or any(search_string in text for text in vocabulary + list(cls.avro_repr_vocabulary)):
+            return None
+        return cls((search_string.encode(),), cls.ascii_lowercase_pattern.search)
+
+    @classmethod
+    def any_of(cls, prefilters):
+        """
+        Prefilter of a multi-term search, candidates hold any of the terms.
+        :param prefilters: list() of RawPrefilter() of the same message type, one per search term
+        :return: RawPrefilter(), None if any of the terms cannot be prefiltered
+        """
+        if not prefilters or any(prefilter is None for prefilter in prefilters):
+            return None
+        null_bytes = next((prefilter.null_bytes for prefilter in prefilters if prefilter.null_bytes), None)
+        return cls(tuple(term for prefilter in prefilters for term in prefilter.search_terms),
+                   prefilters[0].may_differ, null_bytes)
+
+    @classmethod
+    def all_of(cls, prefilters):
+        """
+        Prefilter of a search with several conditions that must all hold (search terms, field filters).
+        :param prefilters: list() of RawPrefilter() or None, None for conditions that cannot be prefiltered
+        :return: RawPrefilter() or RawPrefilterGroup(), None if no condition can be prefiltered
+        """
+        prefilters = [prefilter for prefilter in prefilters if prefilter is not None]
+        if len(prefilters) < 2:
+            return prefilters[0] if prefilters else None
+        return RawPrefilterGroup(prefilters)
+
+    def is_candidate(self, raw_value):
+        """
+        :param raw_value: bytes, confluent_kafka.Message().value()
+        :return: bool, False only if the decoded message cannot contain the search string
+        """
+        if raw_value is None:
+            # Tombstones fail to decode, nothing to match
+            return False
+        return self.is_lower_candidate(raw_value, raw_value.lower())
+
+    def is_lower_candidate(self, raw_value, lower_value):
+        """is_candidate() of a raw value already lower cased by the caller"""
+        if any(term in lower_value for term in self.search_terms):
+            return True
+        if self.null_bytes is not None and self.null_bytes in raw_value:
+            return True
+        return bool(self.may_differ(raw_value))
+
+    @classmethod
+    def json_decode_may_differ(cls, raw_value):
+        """:return: bool, True if raw json may render differently once decoded"""
+        if b'\\' in raw_value or not raw_value.isascii() or b'.0000' in raw_value:
+            return True
+        number_shapes = raw_value.translate(cls.json_number_shapes)
+        return b'0e' in number_shapes or b'0' * 17 in number_shapes.replace(b'.', b'0')
+
+    @classmethod
+    def __is_safe_search_string(cls, search_string):
+        return bool(search_string) and search_string.isascii() and not any(
+            char in cls.unsafe_search_chars for char in search_string)
+
+    @classmethod
+    def __avro_schema_vocabulary(cls, schema):
+        """
+        Lower case field names, enum symbols and string defaults of an avro schema.
+        :return: list() of strings, None if the schema uses types the prefilter does not support
+        """
+        vocabulary = []
+        pending = [schema]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, list):
+                pending.extend(node)
+            elif isinstance(node, str):
+                if node in cls.avro_unsafe_types:
+                    return None
+            elif isinstance(node, dict):
+                if node.get('type') in cls.avro_unsafe_types or 'logicalType' in node:
+                    return None
+                vocabulary.extend(symbol.lower() for symbol in node.get('symbols', []))
+                for field in node.get('fields', []):
+                    vocabulary.append(field['name'].lower())
+                    if 'default' in field:
+                        vocabulary.append(json.dumps(field['default']).lower())
+                    pending.append(field['type'])
+                if 'default' in node:
+                    vocabulary.append(json.dumps(node['default']).lower())
+                pending.extend(node[key] for key in ('items', 'values') if key in node)
+                if isinstance(node.get('type'), (dict, list)):
+                    pending.append(node['type'])
+        return vocabulary
+
+
+class RawPrefilterGroup:
+    """Raw prefilters that must all accept a message, the raw value is lower cased once for all of them"""
+
+    def __init__(self, prefilters):
+        self.prefilters = prefilters
+
+    def is_candidate(self, raw_value):
+        if raw_value is None:
+            return False
+        lower_value = raw_value.lower()
+        return all(prefilter.is_lower_candidate(raw_value, lower_value) for prefilter in self.prefilters)
+
+
+class SearchMatcher:
+    """
+    Matches the search terms of a request against the text of a decoded message (str(message).lower()).
+    Terms are lower case substrings, or regular expressions (case insensitive) when prefixed with 're:'.
+    All terms are tested in a single pass with one combined pattern, literal terms merged into a prefix tree so
+    the pattern does not try every term at every position. Only messages that hit the combined pattern are tested
+    term by term, to tag them with the terms they matched.
+    Field filters (FieldPredicates()) of the request are tested first, against the decoded message itself.
+    """
+    regex_prefix = constants.SEARCH_REGEX_PREFIX
+
+    def __init__(self, terms, field_filters=()):
+        """
+        :param terms: tuple() of normalized search terms, see normalize_terms()
+        :param field_filters: tuple() of normalized field filters, see FieldPredicates.normalize_filters()
+        """
+        self.terms = terms
+        self.field_filters = field_filters
+        self.predicates = FieldPredicates(field_filters) if field_filters else None
+        self.literals = [term for term in terms if not term.startswith(self.regex_prefix)]
+        self.regexes = []
+        for term in terms:
+            if term.startswith(self.regex_prefix):
+                try:
+                    self.regexes.append((term, re.compile(term[len(self.regex_prefix):], re.IGNORECASE)))
+                except re.error as e:
+                    raise ErrorHandler("Invalid request. Invalid regular expression '" + term + "': " + str(e))
+        # Matches are tagged with their terms unless a single substring was searched
+        self.tag_matches = len(terms) > 1 or bool(self.regexes)
+        alternatives = [self.__literal_pattern(self.literals)] if self.literals else []
+        alternatives += ['(?i:' + regex.pattern + ')' for term, regex in self.regexes]
+        self.combined_pattern = re.compile('|'.join(alternatives))
+
+    @classmethod
+    @lru_cache(maxsize=256)
+    def for_terms(cls, terms, field_filters=()):
+        """:return: SearchMatcher(), compiled once per distinct tuple() of terms and field filters"""
+        return cls(terms, field_filters)
+
+    @classmethod
+    def normalize_terms(cls, terms):
+        """
+        Strip terms, lower case literal terms and drop empty and duplicate terms
+        :param terms: list() of strings
+        :return: tuple() of strings
+        """
+        normalized = []
+        for term in terms:
+            term = str(term).strip()
+            if not term.startswith(cls.regex_prefix):
+                term = term.lower()
+            if term and term != cls.regex_prefix and term not in normalized:
+                normalized.append(term)
+        return tuple(normalized)
+
+    def match(self, text):
+        """
+        :param text: string, lower case text of decoded message
+        :return: list() of the terms found in text, empty if none
+        """
+        if len(self.terms) == 1 and self.literals:
+            return self.literals if self.literals[0] in text else []
+        if not self.combined_pattern.search(text):
+            return []
+        return [term for term in self.literals if term in text] + [
+            term for term, regex in self.regexes if regex.search(text)]
+
+    def match_message(self, data):
+        """
+        :param data: decoded message
+        :return: list() of the terms found in the message (empty if only field filters were given), None if the
+                 message does not match. The message is only turned into text when search terms were given
+        """
+        if self.predicates is not None and not self.predicates.matches(data):
+            return None
+        if not self.terms:
+            return []
+        return self.match(str(data).lower()) or None
+
+    @staticmethod
+    def __literal_pattern(literals):
+        """Pattern matching any of the literals, as a prefix tree. Literals starting with another literal are dropped"""
+        tree = {}
+        for literal in sorted(literals, key=len):
+            node = tree
+            for char in literal:
+                if '' in node:
+                    break
+                node = node.setdefault(char, {})
+            else:
+                node.clear()
+                node[''] = True
+
+        def build(node):
+            if '' in node:
+                return ''
+            branches = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+            return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+
+        return build(tree)
+
+
+class FieldPredicates:
+    """
+    Field filters of a request, all of which must hold. Each filter targets a field path (nested field names
+    separated by '.', list items by index, other names applied to every item of a list) and tests only the
+    values found there:
+    - equals: value equal to the filter value (numbers compared as numbers, otherwise by text)
+    - contains: value text includes the filter value, case insensitive
+    - range: value between 'min' and/or 'max' (inclusive), as numbers when bounds are numbers, else as text
+      (e.g. ISO timestamps)
+    - exists: field present and not null ('value': false for the opposite)
+    A filter holds if any value found at its path passes. Filters are compiled once per distinct request.
+    """
+    field_key = constants.FIELD_FILTER_FIELD_KEY
+    op_key = constants.FIELD_FILTER_OP_KEY
+    value_key = constants.FIELD_FILTER_VALUE_KEY
+    min_key = constants.FIELD_FILTER_MIN_KEY
+    max_key = constants.FIELD_FILTER_MAX_KEY
+    op_equals = constants.FIELD_FILTER_OP_EQUALS
+    op_contains = constants.FIELD_FILTER_OP_CONTAINS
+    op_range = constants.FIELD_FILTER_OP_RANGE
+    op_exists = constants.FIELD_FILTER_OP_EXISTS
+    path_separator = constants.FIELD_PATH_SEPARATOR
+    scalar_types = (str, int, float, bool, type(None))
+
+    def __init__(self, field_filters):
+        """:param field_filters: tuple() of normalized field filters, see normalize_filters()"""
+        self.field_filters = field_filters
+        self.predicates = [(tuple(field.split(self.path_separator)), self.__compile(op, value, minimum, maximum))
+                           for field, op, value, minimum, maximum in field_filters]
+
+    @classmethod
+    def normalize_filters(cls, field_filters):
+        """
+        Validate field filters of a request.
+        :param field_filters: list() of dict() (field, op, value, min, max), a single dict(), or their json string
+        :return: tuple() of tuple() (field, op, value, min, max)
+        """
+        if not field_filters:
+            return ()
+        if isinstance(field_filters, str):
+            try:
+                field_filters = json.loads(field_filters)
+            except ValueError as e:
+                raise ErrorHandler("Invalid request. Unable to parse field filters: " + str(e))
+        if isinstance(field_filters, dict):
+            field_filters = [field_filters]
+        if not isinstance(field_filters, list):
+            raise ErrorHandler("Invalid request. Field filters must be a list of filters")
+        normalized = []
+        for field_filter in field_filters:
+            if not isinstance(field_filter, dict) or not str(field_filter.get(cls.field_key) or '').strip():
+                raise ErrorHandler("Invalid request. Every field filter needs a '" + cls.field_key + "'")
+            op = str(field_filter.get(cls.op_key, cls.op_equals)).strip().lower()
+            values = [field_filter.get(key) for key in (cls.value_key, cls.min_key, cls.max_key)]
+            if not all(isinstance(value, cls.scalar_types) for value in values):
+                raise ErrorHandler("Invalid request. Field filter values must be strings, numbers or booleans")
+            value, minimum, maximum = values
+            if op == cls.op_contains and value is None:
+                raise ErrorHandler("Invalid request. Field filter '" + op + "' needs a '" + cls.value_key + "'")
+            elif op == cls.op_range and minimum is None and maximum is None:
+                raise ErrorHandler("Invalid request. Field filter '" + op + "' needs a '" + cls.min_key + "' and/or '"
+                                   + cls.max_key + "'")
+            elif op == cls.op_exists:
+                value = str(value).strip().lower() != 'false' if value is not None else True
+            elif op not in (cls.op_equals, cls.op_contains, cls.op_range):
+                raise ErrorHandler("Invalid request. Unknown field filter operator: " + op)
+            normalized.append((str(field_filter[cls.field_key]).strip(), op, value, minimum, maximum))
+        return tuple(normalized)
+
+    def matches(self, data):
+        """:return: bool, True if every filter holds for decoded message data"""
+        return all(predicate(self.__resolve(data, path)) for path, predicate in self.predicates)
+
+    def raw_texts(self):
+        """
+        Lower case text that the raw value of a matching message must hold, one per filter that requires a
+        string value (equals, contains). Used to build raw prefilters
+        :return: list() of strings
+        """
+        texts = []
+        for field, op, value, minimum, maximum in self.field_filters:
+            if op == self.op_contains or (op == self.op_equals and isinstance(value, (str, int)) and
+                                          not isinstance(value, bool)):
+                texts.append(self.__text(value).lower())
+        return [text for text in texts if text]
+
+    @classmethod
+    def __compile(cls, op, value, minimum, maximum):
+        """:return: function, list() of values found at the field path -> bool"""
+        if op == cls.op_exists:
+            return lambda found: any(item is not None for item in found) == value
+        if op == cls.op_equals:
+            value_text = cls.__text(value)
+            value_number = value if cls.__is_number(value) else None
+            return lambda found: any(
+                item == value_number if value_number is not None and cls.__is_number(item)
+                else cls.__text(item) == value_text for item in cls.__scalars(found))
+        if op == cls.op_contains:
+            value_text = cls.__text(value).lower()
+            return lambda found: any(value_text in cls.__text(item).lower() for item in cls.__scalars(found))
+        bounds = [bound for bound in (minimum, maximum) if bound is not None]
+        if all(cls.__to_number(bound) is not None for bound in bounds):
+            minimum, maximum = [cls.__to_number(bound) if bound is not None else None for bound in (minimum, maximum)]
+            convert = cls.__to_number
+        else:
+            minimum, maximum = [cls.__text(bound) if bound is not None else None for bound in (minimum, maximum)]
+            convert = cls.__text
+
+        def in_range(item):
+            item = convert(item)
+            return item is not None and (minimum is None or item >= minimum) and (maximum is None or item <= maximum)
+
+        return lambda found: any(in_range(item) for item in cls.__scalars(found))
+
+    @staticmethod
+    def __resolve(data, path):
+        """:return: list() of the values found at field path, only the fields on the path are visited"""
+        found = [data]
+        for name in path:
+            values = []
+            for value in found:
+                if isinstance(value, dict):
+                    if name in value:
+                        values.append(value[name])
+                elif isinstance(value, list):
+                    if name.isdigit():
+                        if int(name) < len(value):
+                            values.append(value[int(name)])
+                    else:
+                        values.extend(item[name] for item in value if isinstance(item, dict) and name in item)
+            if not values:
+                return values
+            found = values
+        return found
+
+    @staticmethod
+    def __scalars(found):
+        """Values found, items of lists expanded, nested records skipped"""
+        for value in found:
+            if isinstance(value, list):
+                yield from (item for item in value if not isinstance(item, (dict, list)))
+            elif not isinstance(value, dict):
+                yield value
+
+    @staticmethod
+    def __is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    @classmethod
+    def __to_number(cls, value):
+        if cls.__is_number(value):
+            return value
+        if isinstance(value, str):
+            try:
+                return float(value)
+            except ValueError:
+                return None
+        return None
+
+    @staticmethod
+    def __text(value):
+        """Text of a value as written in json (true, false, null), ISO format for dates and times"""
+        if isinstance(value, str):
+            return value
+        if value is None or isinstance(value, bool):
+            return json.dumps(value)
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
@@ -1,4 +1,5 @@
 import contextlib
+import os
 import tempfile
 
 import OpenSSL.crypto
@@ -13,12 +14,24 @@ class PFXReader:
         """
         Converts pfx to pem, as some kafka-registry's do not accept pem files
         :param environment: string of request topic
-        :return: pem formatted file
+        :return: pem formatted file, removed when the with block exits
+        """
+        pem_file = self.write_pem(environment)
+        try:
+            yield pem_file
+        finally:
+            self.remove_pem(pem_file)
+
+    @staticmethod
+    def write_pem(environment):
+        """
+        Decrypts the environment's .pfx file into a temporary pem file. The caller must remove it with remove_pem()
+        :param environment: string
+        :return: string, path of pem file
         """
         config = ConnectionConfig.connection_details
         ''' Decrypts the .pfx file to be used with requests. '''
-        with tempfile.NamedTemporaryFile(suffix='.pem', delete=False) as t_pem:
-            f_pem = open(t_pem.name, 'wb')
+        with tempfile.NamedTemporaryFile(suffix='.pem', delete=False) as f_pem:
             pfx = open(config['ssl'][environment]['pfx_file'], 'rb').read()
             p12 = OpenSSL.crypto.load_pkcs12(pfx, config['ssl'][environment]['ssl.key.password'])
             f_pem.write(OpenSSL.crypto.dump_privatekey(OpenSSL.crypto.FILETYPE_PEM, p12.get_privatekey()))
@@ -27,5 +40,11 @@ class PFXReader:
             if ca is not None:
                 for cert in ca:
                     f_pem.write(OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM, cert))
-            f_pem.close()
-            yield t_pem.name
+            return f_pem.name
+
+    @staticmethod
+    def remove_pem(pem_file):
+        try:
+            os.remove(pem_file)
+        except OSError:
+            pass
@@ -1,15 +1,25 @@
 import datetime
 import json
 import pytz
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import *
+from time import monotonic, perf_counter
 
 import constants
 import default_constants
 from avro_client import AvroClient
 from config_handler import ConnectionConfig
-from error_handler import ErrorHandler
+from error_handler import ErrorHandler, SearchCancelled
 from kafka_client import KafkaReader
 from logger import RequestLogger
+from message_filter import FieldPredicates, SearchMatcher
+from search_admission import SearchAdmission
+from search_cursor import SearchCursor
+from search_estimate import SearchEstimate
+from search_flights import SearchFlights
+from search_jobs import SearchJobs
 
 
 class RequestHandler:
@@ -17,8 +27,17 @@ class RequestHandler:
     default_environment = default_constants.DEFAULT_ENVIRONMENT
     default_include_kafka_meta_value = default_constants.DEFAULT_REQUEST_HANDLER_INCLUDE_KAFKA_METADATA
     default_include_delimiter_value = default_constants.DEFAULT_REQUEST_HANDLER_INCLUDE_DELIMITER
+    default_newest_first_value = default_constants.DEFAULT_REQUEST_HANDLER_NEWEST_FIRST
+    default_include_stats_value = default_constants.DEFAULT_REQUEST_HANDLER_INCLUDE_STATS
+    default_topic_workers = default_constants.DEFAULT_TOPIC_WORKERS
+    default_stream_queue_size = default_constants.DEFAULT_STREAM_QUEUE_SIZE
+    # Main config keys
+    config_topic_workers_key = constants.CONFIG_TOPIC_WORKERS_KEY
+    config_search_deadline_key = constants.CONFIG_SEARCH_DEADLINE_KEY
     # Final Param Keys
     param_search_string_key = constants.PARAM_SEARCH_STRING_KEY
+    param_search_terms_key = constants.PARAM_SEARCH_TERMS_KEY
+    param_field_filters_key = constants.PARAM_FIELD_FILTERS_KEY
     param_environment_key = constants.PARAM_ENVIRONMENT_KEY
     param_json_topics_key = constants.PARAM_JSON_TOPICS_KEY
     param_avro_topics_key = constants.PARAM_AVRO_TOPICS_KEY
@@ -26,7 +45,15 @@ class RequestHandler:
     param_include_delimiter_key = constants.PARAM_INCLUDE_DELIMITER_KEY
     param_other_topic_key = constants.PARAM_OTHER_TOPIC_KEY
     param_not_before_key = constants.PARAM_NOT_BEFORE_KEY
+    param_not_after_key = constants.PARAM_NOT_AFTER_KEY
     param_search_count_key = constants.PARAM_SEARCH_COUNT_KEY
+    param_partition_workers_key = constants.PARAM_PARTITION_WORKERS_KEY
+    param_newest_first_key = constants.PARAM_NEWEST_FIRST_KEY
+    param_include_stats_key = constants.PARAM_INCLUDE_STATS_KEY
+    param_deadline_seconds_key = constants.PARAM_DEADLINE_SECONDS_KEY
+    param_page_size_key = constants.PARAM_PAGE_SIZE_KEY
+    param_cursor_key = constants.PARAM_CURSOR_KEY
+    param_message_key_key = constants.PARAM_MESSAGE_KEY_KEY
 
     # Incoming Request Keys
     request_search_string_key = constants.REQUEST_SEARCH_STRING_KEY
@@ -37,13 +64,48 @@ class RequestHandler:
     request_include_delimiter_key = constants.REQUEST_INCLUDE_DELIMITER_KEY
     request_other_topic_key = constants.REQUEST_OTHER_TOPIC_KEY
     request_not_before_key = constants.REQUEST_NOT_BEFORE_KEY
+    request_not_after_key = constants.REQUEST_NOT_AFTER_KEY
     request_search_count_key = constants.REQUEST_SEARCH_COUNT_KEY
+    request_partition_workers_key = constants.REQUEST_PARTITION_WORKERS_KEY
+    request_newest_first_key = constants.REQUEST_NEWEST_FIRST_KEY
+    request_field_filters_key = constants.REQUEST_FIELD_FILTERS_KEY
+    request_include_stats_key = constants.REQUEST_INCLUDE_STATS_KEY
+    request_deadline_seconds_key = constants.REQUEST_DEADLINE_SECONDS_KEY
+    request_page_size_key = constants.REQUEST_PAGE_SIZE_KEY
+    request_cursor_key = constants.REQUEST_CURSOR_KEY
+    request_message_key_key = constants.REQUEST_MESSAGE_KEY_KEY
+    request_client_id_header = constants.REQUEST_CLIENT_ID_HEADER
 
     # Response keys
     response_error_key = constants.RESPONSE_ERROR_KEY
+    response_stats_key = constants.RESPONSE_STATS_KEY
+    response_partial_key = constants.RESPONSE_PARTIAL_KEY
+    response_cursor_key = constants.RESPONSE_CURSOR_KEY
     response_avro_topics_prefix = constants.RESPONSE_AVRO_TOPICS_PREFIX
     response_json_topics_prefix = constants.RESPONSE_JSON_TOPICS_PREFIX
 
+    # Streaming response record keys and types
+    stream_type_key = constants.STREAM_TYPE_KEY
+    stream_topic_key = constants.STREAM_TOPIC_KEY
+    stream_offset_key = constants.STREAM_OFFSET_KEY
+    stream_message_key = constants.STREAM_MESSAGE_KEY
+    stream_error_key = constants.STREAM_ERROR_KEY
+    stream_type_match = constants.STREAM_TYPE_MATCH
+    stream_type_topic_start = constants.STREAM_TYPE_TOPIC_START
+    stream_type_partition_summary = constants.STREAM_TYPE_PARTITION_SUMMARY
+    stream_type_topic_summary = constants.STREAM_TYPE_TOPIC_SUMMARY
+    stream_type_error = constants.STREAM_TYPE_ERROR
+    stream_type_end = constants.STREAM_TYPE_END
+    summary_partition_key = constants.SUMMARY_PARTITION_KEY
+    summary_partitions_key = constants.SUMMARY_PARTITIONS_KEY
+    summary_scanned_key = constants.SUMMARY_SCANNED_KEY
+    summary_matches_key = constants.SUMMARY_MATCHES_KEY
+    summary_complete_key = constants.SUMMARY_COMPLETE_KEY
+    # Scan stats keys
+    stats_topics_key = constants.STATS_TOPICS_KEY
+    stats_seconds_key = constants.STATS_SECONDS_KEY
+    stats_queued_key = constants.STATS_QUEUED_KEY
+
     @classmethod
     def process_request(cls, request):
         """
@@ -51,6 +113,72 @@ class RequestHandler:
         :param request: flask.request()
         :return: list(), json messages that match requested search_string
         """
+        params = cls.__prepare_params(request)
+        client = cls.__client_of(request)
+
+        # Begin searching transaction once admitted, or wait for the identical search already running
+        return SearchFlights.run(params, lambda: cls.__admitted_search(params, client))
+
+    @classmethod
+    def estimate_request(cls, request):
+        """
+        Topic statistics and the estimated cost of a search, without running it (SearchEstimate()). Search terms are
+        optional, the request is not logged.
+        :param request: flask.request()
+        :return: dict() topic stats per response key, and the search estimate under the response estimate key
+        """
+        params = cls.__build_params(cls.__parse_incoming_request(request))
+        cls.__validate_params(params, search_required=False)
+        topic_searches = cls.__build_topic_searches(params)
+        return SearchEstimate.estimate(params, topic_searches, cls.__resolve_topic_workers(
+            params.get(cls.param_environment_key), len(topic_searches)))
+
+    @classmethod
+    def submit_job(cls, request):
+        """
+        Asynchronous variant of process_request(), the search runs in the background as a SearchJob(). Request is
+        parsed and validated before returning, so invalid requests raise here.
+        :param request: flask.request()
+        :return: dict() job status, including the job id
+        """
+        params = cls.__prepare_params(request)
+        cls.__validate_not_paged(params)
+        client = cls.__client_of(request)
+        return SearchJobs.submit(params, cls.__build_topic_searches(params), cls.__resolve_deadline(params),
+                                 lambda job: cls.__run_job(job, client)).status()
+
+    @classmethod
+    def job_status(cls, job_id):
+        """:return: dict() state and per topic progress of a search job"""
+        return SearchJobs.get(job_id).status()
+
+    @classmethod
+    def job_results(cls, job_id):
+        """:return: dict() matches found so far by a search job, same format as /search, with the job status"""
+        return SearchJobs.get(job_id).results()
+
+    @classmethod
+    def cancel_job(cls, job_id):
+        """Stop a search job, its matches found so far are kept. :return: dict() job status"""
+        return SearchJobs.cancel(job_id).status()
+
+    @classmethod
+    def stream_request(cls, request):
+        """
+        Streaming variant of process_request(). Request is parsed and validated before returning, so invalid
+        requests raise here rather than mid stream.
+        :param request: flask.request()
+        :return: generator of dict() records, matches interleaved with partition and topic summaries
+        """
+        params = cls.__prepare_params(request)
+        cls.__validate_not_paged(params)
+
+        # Begin streaming search transaction
+        return cls.__stream_search(params, cls.__client_of(request))
+
+    @classmethod
+    def __prepare_params(cls, request):
+        """Parse, log and validate incoming request, returning final Params dict()"""
         # Parse incoming request
         parsed_request = cls.__parse_incoming_request(request)
 
@@ -63,8 +191,12 @@ class RequestHandler:
         # Validate Param dict() values, through any invalid request exceptions here
         cls.__validate_params(params)
 
-        # Begin searching transaction
-        return cls.__begin_search(params)
+        return params
+
+    @classmethod
+    def __client_of(cls, request):
+        """Client of the request, searches are shared fairly between clients. Client id header or remote address"""
+        return (request.headers.get(cls.request_client_id_header) or request.remote_addr or 'unknown').strip()
 
     @classmethod
     def __parse_incoming_request(cls, request):
@@ -76,6 +208,12 @@ class RequestHandler:
         # Merges form(UI calls), args(Postman form-data) params
         parsed_request = {**request.form.to_dict(), **request.args.to_dict()}
 
+        # Multiple search terms may be passed by repeating searchParam
+        search_terms = request.form.getlist(cls.request_search_string_key) + request.args.getlist(
+            cls.request_search_string_key)
+        if len(search_terms) > 1:
+            parsed_request[cls.request_search_string_key] = search_terms
+
         # Extract json_topics from splash.html if present
         json_topics = request.form.getlist(constants.REQUEST_UI_FORM_JSON_TOPICS_KEY)
         if len(json_topics) > 0:
@@ -88,9 +226,10 @@ class RequestHandler:
             parsed_request[cls.request_avro_topics_key] = avro_topics
             parsed_request.pop(constants.REQUEST_UI_FORM_AVRO_TOPICS_KEY)
 
-        # Support for JAVA JSON body requests
-        if request.json:
-            parsed_request = {**parsed_request, **request.json}
+        # Support for JAVA JSON body requests, silent as form posts from splash.html have no JSON body
+        json_body = request.get_json(silent=True)
+        if json_body:
+            parsed_request = {**parsed_request, **json_body}
 
         # Support for POSTMAN raw JSON body requests
         if len(parsed_request) == 0:
@@ -109,9 +248,21 @@ class RequestHandler:
         :rtype dict()
         """
         params = {}
-        # Search string
-        search_string = parsed_request.get(cls.request_search_string_key, None)
-        params[cls.param_search_string_key] = search_string.strip().lower() if search_string else None
+        # Search terms, a single search string or a list of strings and/or regular expressions ('re:' prefix)
+        search_param = parsed_request.get(cls.request_search_string_key, None)
+        search_terms = search_param if isinstance(search_param, list) else [search_param] if search_param else []
+        params[cls.param_search_terms_key] = SearchMatcher.normalize_terms(search_terms)
+        # Search string, kept for logging
+        params[cls.param_search_string_key] = ", ".join(params[cls.param_search_terms_key]) or None
+
+        # Message key, key lookups only scan the partition of the key and only decode messages with this key
+        message_key = parsed_request.get(cls.request_message_key_key)
+        params[cls.param_message_key_key] = str(message_key) if message_key is not None and str(message_key) != '' \
+            else None
+
+        # Field filters, predicates on field paths of the decoded messages (list of filters, or its json string)
+        params[cls.param_field_filters_key] = FieldPredicates.normalize_filters(
+            parsed_request.get(cls.request_field_filters_key))
 
         # Environment
         params[cls.param_environment_key] = parsed_request.get(cls.request_environment_key,
@@ -128,16 +279,36 @@ class RequestHandler:
         # Other topic key
         params[cls.param_other_topic_key] = parsed_request.get(cls.request_other_topic_key, 'none').strip().lower()
 
-        # Search count (not currently being implemented)
-        params[cls.param_search_count_key] = int(
-            parsed_request.get(cls.request_search_count_key)) if parsed_request.get(
-            cls.request_search_count_key) else None
+        # Search count, max number of matches returned per topic. Scans stop once reached
+        params[cls.param_search_count_key] = cls.__convert_positive_int(
+            cls.request_search_count_key, parsed_request.get(cls.request_search_count_key))
+
+        # Newest first, walk back from the end of each partition
+        params[cls.param_newest_first_key] = str(parsed_request.get(cls.request_newest_first_key,
+                                                                    cls.default_newest_first_value)).strip().lower()
+
+        # Include stats, counters and timers of every topic scan added to the response
+        params[cls.param_include_stats_key] = str(parsed_request.get(cls.request_include_stats_key,
+                                                                     cls.default_include_stats_value)).strip().lower()
+
+        # Deadline, scans end early once reached and return the matches found so far (defaults to environment config)
+        params[cls.param_deadline_seconds_key] = cls.__convert_positive_int(
+            cls.request_deadline_seconds_key, parsed_request.get(cls.request_deadline_seconds_key))
 
-        # Process not before value if passed
-        not_before = parsed_request.get(cls.request_not_before_key, 'false').strip().lower()
-        if not_before != 'false' and not_before != '':
-            not_before = cls.__convert_not_before(not_before)
-        params[cls.param_not_before_key] = not_before
+        # Page size, paged searches return at most this many matches per topic and a cursor to the next page
+        params[cls.param_page_size_key] = cls.__convert_positive_int(
+            cls.request_page_size_key, parsed_request.get(cls.request_page_size_key))
+
+        # Partition workers, number of partitions of each topic scanned at once (defaults to environment config)
+        params[cls.param_partition_workers_key] = cls.__convert_positive_int(
+            cls.request_partition_workers_key, parsed_request.get(cls.request_partition_workers_key))
+
+        # Process not before / not after values if passed, None if not passed.
+        # Used to limit the scan of each partition to the requested time window.
+        params[cls.param_not_before_key] = cls.__convert_timestamp(
+            cls.request_not_before_key, parsed_request.get(cls.request_not_before_key))
+        params[cls.param_not_after_key] = cls.__convert_timestamp(
+            cls.request_not_after_key, parsed_request.get(cls.request_not_after_key))
 
         # Build JSON TOPIC SEARCH LIST
         params[cls.param_json_topics_key] = set()
@@ -156,86 +327,437 @@ class RequestHandler:
             else:
                 params[cls.param_json_topics_key].add(params[cls.param_other_topic_key])
 
+        # Cursor of a paged search, decoded into the offsets each topic resumes from. Page size defaults to the
+        # page size of the first page
+        params[cls.param_cursor_key] = None
+        cursor = str(parsed_request.get(cls.request_cursor_key) or '').strip()
+        if cursor:
+            page_size, params[cls.param_cursor_key] = SearchCursor.decode(params, cursor)
+            params[cls.param_page_size_key] = params[cls.param_page_size_key] or page_size
+
         return params
 
+    @classmethod
+    def __admitted_search(cls, params, client):
+        """
+        Run __begin_search() once admitted to the search's environment (SearchAdmission()). Searches estimated to
+        exceed the environment's cost limit (SearchEstimate()) are rejected before they are queued, so they never
+        hold a queue place or running slot. With include stats, the seconds the search was queued are added to the
+        response stats
+        """
+        cls.__check_estimate(params)
+        ticket = SearchAdmission.admit(params, client)
+        try:
+            response = cls.__begin_search(params)
+        finally:
+            SearchAdmission.release(ticket)
+        if response.get(cls.response_stats_key) is not None:
+            response[cls.response_stats_key][cls.stats_queued_key] = ticket.queued_seconds
+        return response
+
     @classmethod
     def __begin_search(cls, params):
         """
         Connect to kafka-broker, iterate and browse requested topics.
+        Topics are searched concurrently, each with its own KafkaReader (and AvroClient for avro topics),
+        so request latency follows the slowest topic rather than the sum of all topics.
+        With include stats, the counters and timers of every topic scan are added under the response stats key.
+        Topics whose scan was stopped by the deadline are listed under the response partial key.
+        Paged searches return at most page size matches per topic and the cursor of the next page under the response
+        cursor key (None once every topic has been scanned completely). Each page continues from the offsets the
+        previous page stopped at, topics scanned completely by earlier pages are not scanned again.
         :param params: dict() parsed request
         :return: list(), json messages that match requested search_string
         """
+        started = perf_counter()
+        deadline = cls.__resolve_deadline(params)
         response = {}
-        # Create Kafka consumer
-        kafka_reader = KafkaReader(params.get(cls.param_environment_key))
+        topic_stats = {}
+        partial_topics = []
+        topic_searches = cls.__build_topic_searches(params)
+        paged = params.get(cls.param_page_size_key) is not None
+        # response key -> offsets each topic resumes from (None if not scanned yet), topics left out are done
+        resume_offsets = params.get(cls.param_cursor_key)
+        next_offsets = {}
+        if resume_offsets is not None:
+            for response_key, topic_name, message_type in topic_searches:
+                if response_key not in resume_offsets:
+                    response[response_key] = []
+            topic_searches = [topic_search for topic_search in topic_searches if topic_search[0] in resume_offsets]
+
+        workers = cls.__resolve_topic_workers(params.get(cls.param_environment_key), len(topic_searches))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(response_key, executor.submit(
+                cls.__search_json_topic if message_type == 'json' else cls.__search_avro_topic, params, topic_name,
+                deadline, resume_offsets.get(response_key) if resume_offsets is not None else None))
+                for response_key, topic_name, message_type in topic_searches]
+            for response_key, future in futures:
+                response[response_key], close_error, scan_stats, topic_next_offsets = future.result()
+                if close_error:
+                    response[cls.response_error_key] = close_error
+                if scan_stats is not None and not scan_stats.complete:
+                    partial_topics.append(response_key)
+                topic_stats[response_key] = scan_stats.summary() if scan_stats is not None else None
+                if topic_next_offsets is None:
+                    # Scan failed, the next page retries the topic from where this page started
+                    next_offsets[response_key] = resume_offsets.get(response_key) if resume_offsets is not None \
+                        else None
+                elif topic_next_offsets:
+                    next_offsets[response_key] = topic_next_offsets
+
+        if partial_topics:
+            response[cls.response_partial_key] = partial_topics
+        if paged:
+            response[cls.response_cursor_key] = SearchCursor.encode(params, params[cls.param_page_size_key],
+                                                                    next_offsets)
+        if params.get(cls.param_include_stats_key) == 'true':
+            response[cls.response_stats_key] = {cls.stats_seconds_key: perf_counter() - started,
+                                                cls.stats_topics_key: topic_stats}
+        return response
+
+    @classmethod
+    def __build_topic_searches(cls, params):
+        """
+        :return: list() of tuple() (response key, topic name, message type), json topics followed by avro topics
+        """
+        topic_searches = [(cls.response_json_topics_prefix + topic_name, topic_name, 'json')
+                          for topic_name in params.get(cls.param_json_topics_key)]
+        topic_searches += [(cls.response_avro_topics_prefix + topic_name, topic_name, 'avro')
+                           for topic_name in params.get(cls.param_avro_topics_key)]
+        return topic_searches
+
+    @classmethod
+    def __check_estimate(cls, params):
+        """Raise ErrorHandler if the search is estimated to exceed its environment's cost limit"""
+        topic_searches = cls.__build_topic_searches(params)
+        SearchEstimate.check(params, topic_searches, cls.__resolve_topic_workers(
+            params.get(cls.param_environment_key), len(topic_searches)))
 
-        # Iterate through the json topics and browse all messages,
-        # returning all messages that match the search string requested
-        for topic_name in params.get(cls.param_json_topics_key):
-            try:
-                found_msgs = kafka_reader.search_for_msgs(params, topic_name, "json")
-            except Exception as e:
-                response[cls.response_json_topics_prefix + topic_name] = "Error searching topic. " + str(e)
-                continue
-            response[cls.response_json_topics_prefix + topic_name] = found_msgs
-
-        # Search avro topics included in request
-        if len(params.get(cls.param_avro_topics_key)) > 0:
-            # Instantiate avro client in provided environment
-            avro_client = AvroClient(params.get(cls.param_environment_key))
-            # Set kafka reader's deserializer to above avro client
-            kafka_reader.set_avro_deserializer(avro_client)
-
-            for avro_topic_name in params.get(cls.param_avro_topics_key):
-                if avro_topic_name not in ConnectionConfig.avro_topics:
-                    response[
-                        cls.response_avro_topics_prefix + avro_topic_name] = "Error. Application does not have avro schema string for requested topic: " + avro_topic_name
+    @classmethod
+    def __stream_search(cls, params, client):
+        """
+        Generator yielding records as soon as they are produced by the topic scans. Scans run on worker threads
+        and hand records over through a bounded queue, so a slow client pauses the scans instead of results
+        piling up in memory. Closing the generator (client disconnected) cancels the remaining scans.
+        Topic summaries tell whether the topic was scanned completely, or stopped by the deadline.
+        Scans start once the search is admitted to its environment, a rejected search (estimated too expensive before
+        it is queued, or not admitted) yields an error record.
+        :param params: dict() parsed request
+        :param client: string, client of the request (SearchAdmission())
+        :return: generator of dict() records
+        """
+        records = queue.Queue(maxsize=cls.default_stream_queue_size)
+        cancelled = threading.Event()
+        try:
+            cls.__check_estimate(params)
+            ticket = SearchAdmission.admit(params, client, cancel_event=cancelled)
+        except ErrorHandler as e:
+            yield {cls.stream_type_key: cls.stream_type_error, cls.stream_error_key: str(e)}
+            yield {cls.stream_type_key: cls.stream_type_end, cls.summary_matches_key: 0}
+            return
+        deadline = cls.__resolve_deadline(params)
+
+        def emit(record):
+            while not cancelled.is_set():
+                try:
+                    records.put(record, timeout=.5)
+                    return
+                except queue.Full:
                     continue
+            raise SearchCancelled("Search cancelled")
+
+        def release(future):
+            # Cancelled scans end shortly after the generator, the search stays admitted until the last one has
+            if all(topic_future.done() for topic_future in futures):
+                SearchAdmission.release(ticket)
+
+        topic_searches = cls.__build_topic_searches(params)
+        workers = cls.__resolve_topic_workers(params.get(cls.param_environment_key), len(topic_searches))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = [executor.submit(cls.__stream_topic, params, response_key, topic_name, message_type, emit,
+                                   cancelled, deadline)
+                   for response_key, topic_name, message_type in topic_searches]
+        total_matches = 0
+        try:
+            while True:
                 try:
-                    # Load avro deserializer for request topic
-                    kafka_reader.avro_deserializer.load_deserializer(avro_topic_name)
-                    avro_found_msgs = kafka_reader.search_for_msgs(params, avro_topic_name, "avro")
-                except Exception as e:
-                    response[cls.response_avro_topics_prefix + avro_topic_name] = "Error searching avro topic.  " + str(
-                        e)
+                    record = records.get(timeout=.5)
+                except queue.Empty:
+                    if all(future.done() for future in futures):
+                        break
                     continue
-                response[cls.response_avro_topics_prefix + avro_topic_name] = avro_found_msgs
+                if record.get(cls.stream_type_key) == cls.stream_type_match:
+                    total_matches += 1
+                yield record
+            # All scans finished, forward anything queued after the last check
+            while not records.empty():
+                record = records.get_nowait()
+                if record.get(cls.stream_type_key) == cls.stream_type_match:
+                    total_matches += 1
+                yield record
+            yield {cls.stream_type_key: cls.stream_type_end, cls.summary_matches_key: total_matches}
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=False)
+            for future in futures:
+                future.add_done_callback(release)
+
+    @classmethod
+    def __stream_topic(cls, params, response_key, topic_name, message_type, emit, cancelled, deadline):
+        """
+        Scan a single topic, emitting topic start, match, partition summary and topic summary records. The scan
+        ends early once cancelled is set or the deadline has passed.
+        """
+        emit({cls.stream_type_key: cls.stream_type_topic_start, cls.stream_topic_key: response_key})
+
+        def on_match(msg, parsed_msg):
+            emit({cls.stream_type_key: cls.stream_type_match,
+                  cls.stream_topic_key: response_key,
+                  cls.summary_partition_key: msg.partition(),
+                  cls.stream_offset_key: msg.offset(),
+                  cls.stream_message_key: parsed_msg})
+
+        def on_partition_done(partition_summary):
+            emit({cls.stream_type_key: cls.stream_type_partition_summary, cls.stream_topic_key: response_key,
+                  **partition_summary})
+
+        kafka_reader = None
+        try:
+            kafka_reader = cls.__open_reader(params, topic_name, message_type)
+            kafka_reader.set_interrupt(cancelled, deadline)
+            partition_summaries = kafka_reader.scan_topic(params, topic_name, message_type, on_match,
+                                                          on_partition_done)
+            emit({cls.stream_type_key: cls.stream_type_topic_summary,
+                  cls.stream_topic_key: response_key,
+                  cls.summary_partitions_key: len(partition_summaries),
+                  cls.summary_scanned_key: sum(summary[cls.summary_scanned_key] for summary in partition_summaries),
+                  cls.summary_matches_key: sum(summary[cls.summary_matches_key] for summary in partition_summaries),
+                  cls.summary_complete_key: kafka_reader.scan_stats.complete,
+                  **cls.__stream_stats(params, kafka_reader)})
+        except SearchCancelled:
+            raise
+        except Exception as e:
+            emit({cls.stream_type_key: cls.stream_type_error, cls.stream_topic_key: response_key,
+                  cls.stream_error_key: "Error searching topic. " + str(e)})
+        finally:
+            if kafka_reader is not None:
+                cls.__close_reader(kafka_reader)
+
+    @classmethod
+    def __run_job(cls, job, client):
+        """
+        Search the topics of a SearchJob() concurrently, runs on a job thread. Jobs are admitted to their environment
+        after interactive searches, a job cancelled or past its deadline while queued ends without scanning
+        """
+        try:
+            ticket = SearchAdmission.admit(job.params, client, background=True, cancel_event=job.cancel_event,
+                                           deadline=job.deadline)
+        except SearchCancelled:
+            return
+        try:
+            workers = cls.__resolve_topic_workers(job.params.get(cls.param_environment_key), len(job.topics))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(cls.__run_job_topic, job, job_topic) for job_topic in job.topics.values()]
+                for future in futures:
+                    future.result()
+        finally:
+            SearchAdmission.release(ticket)
+
+    @classmethod
+    def __run_job_topic(cls, job, job_topic):
+        """Scan a single topic of a search job, collecting its matches in job_topic (JobTopic())"""
+        kafka_reader = None
+        error = None
+        try:
+            kafka_reader = cls.__open_reader(job.params, job_topic.topic_name, job_topic.message_type)
+            kafka_reader.set_interrupt(job.cancel_event, job.deadline)
+            job_topic.start(kafka_reader)
+            kafka_reader.scan_topic(job.params, job_topic.topic_name, job_topic.message_type, job_topic.add_match)
+        except Exception as e:
+            error = "Error searching topic. " + str(e)
+        finally:
+            if kafka_reader is not None:
+                job_topic.close_error = cls.__close_reader(kafka_reader)
+        job_topic.finish(error)
+
+    @classmethod
+    def __stream_stats(cls, params, kafka_reader):
+        """Stats of the reader's topic scan for the topic summary record, if requested"""
+        if params.get(cls.param_include_stats_key) != 'true' or kafka_reader.scan_stats is None:
+            return {}
+        return {cls.response_stats_key: kafka_reader.scan_stats.summary()}
+
+    @classmethod
+    def __open_reader(cls, params, topic_name, message_type):
+        """Create KafkaReader for topic, with avro deserializer loaded for avro topics"""
+        environment = params.get(cls.param_environment_key)
+        if message_type != 'avro':
+            return KafkaReader(environment)
+
+        if topic_name not in ConnectionConfig.avro_topics:
+            raise ErrorHandler("Error. Application does not have avro schema string for requested topic: " + topic_name)
+        avro_client = AvroClient(environment)
+        kafka_reader = KafkaReader(environment)
+        kafka_reader.set_avro_deserializer(avro_client)
+        try:
+            kafka_reader.avro_deserializer.load_deserializer(topic_name)
+        except Exception:
+            cls.__close_reader(kafka_reader)
+            raise
+        return kafka_reader
+
+    @classmethod
+    def __search_json_topic(cls, params, topic_name, deadline, resume_offsets=None):
+        """
+        Browse a single json topic, returning all messages that match the search string requested
+        :param deadline: optional float, time.monotonic() value at which the scan ends early
+        :param resume_offsets: optional dict() partition offsets a paged search resumes from, see KafkaReader()
+        :return: tuple() of topic result, connection close error (None if closed cleanly), ScanStats() (None if
+                 the scan did not start) and next offsets of a paged search (None if not paged or the scan failed)
+        """
+        # Create Kafka consumer
+        kafka_reader = KafkaReader(params.get(cls.param_environment_key))
+        kafka_reader.set_interrupt(deadline=deadline)
+        kafka_reader.set_resume_offsets(resume_offsets)
+        try:
+            topic_result = kafka_reader.search_for_msgs(params, topic_name, "json")
+        except Exception as e:
+            topic_result = "Error searching topic. " + str(e)
+        return topic_result, cls.__close_reader(kafka_reader), kafka_reader.scan_stats, kafka_reader.next_offsets
+
+    @classmethod
+    def __search_avro_topic(cls, params, topic_name, deadline, resume_offsets=None):
+        """
+        Browse a single avro topic with its own avro client and deserializer
+        :param deadline: optional float, time.monotonic() value at which the scan ends early
+        :param resume_offsets: optional dict() partition offsets a paged search resumes from, see KafkaReader()
+        :return: tuple() of topic result, connection close error (None if closed cleanly), ScanStats() (None if
+                 the scan did not start) and next offsets of a paged search (None if not paged or the scan failed)
+        """
+        if topic_name not in ConnectionConfig.avro_topics:
+            return "Error. Application does not have avro schema string for requested topic: " + topic_name, None, \
+                None, None
 
-        # Close connection to queue manager
+        # Instantiate avro client in provided environment
+        avro_client = AvroClient(params.get(cls.param_environment_key))
+        # Create Kafka consumer and set kafka reader's deserializer to above avro client
+        kafka_reader = KafkaReader(params.get(cls.param_environment_key))
+        kafka_reader.set_avro_deserializer(avro_client)
+        kafka_reader.set_interrupt(deadline=deadline)
+        kafka_reader.set_resume_offsets(resume_offsets)
+        try:
+            # Load avro deserializer for request topic
+            kafka_reader.avro_deserializer.load_deserializer(topic_name)
+            topic_result = kafka_reader.search_for_msgs(params, topic_name, "avro")
+        except Exception as e:
+            topic_result = "Error searching avro topic.  " + str(e)
+        return topic_result, cls.__close_reader(kafka_reader), kafka_reader.scan_stats, kafka_reader.next_offsets
+
+    @classmethod
+    def __close_reader(cls, kafka_reader):
+        """Close connection to kafka broker. Returns error message if connection could not be closed"""
         try:
             kafka_reader.close()
         except Exception as e:
-            response[cls.response_error_key] = "Error closing connection to kafka broker: " + str(e)
+            return "Error closing connection to kafka broker: " + str(e)
+        return None
 
-        return response
+    @classmethod
+    def __resolve_topic_workers(cls, environment, topic_count):
+        """Number of topics searched at once, from environment's 'topic.workers' config value or default"""
+        configured = (ConnectionConfig.connection_details or {}).get(cls.config_topic_workers_key) or {}
+        workers = int(configured.get(environment, cls.default_topic_workers))
+        return max(1, min(workers, topic_count))
 
     @classmethod
-    def __convert_not_before(cls, not_before):
-        """Convert notBefore param into 'aware' datetime object"""
+    def __resolve_deadline(cls, params):
+        """
+        Deadline of the search's scans, from the deadlineSeconds param or the environment's 'search.deadline.seconds'
+        config value
+        :return: float, time.monotonic() value, None if the search has no deadline
+        """
+        seconds = params.get(cls.param_deadline_seconds_key)
+        if seconds is None:
+            configured = (ConnectionConfig.connection_details or {}).get(cls.config_search_deadline_key) or {}
+            seconds = configured.get(params.get(cls.param_environment_key))
+        return monotonic() + float(seconds) if seconds else None
+
+    @classmethod
+    def __convert_timestamp(cls, request_key, value):
+        """Convert notBefore/notAfter param into 'aware' datetime object (UTC unless offset given)"""
+        if value is None or str(value).strip().lower() in ('', 'false'):
+            return None
+        value = str(value).strip()
         try:
-            return pytz.UTC.localize(datetime.fromisoformat(not_before))
+            timestamp = datetime.fromisoformat(value)
+            return pytz.UTC.localize(timestamp) if timestamp.tzinfo is None else timestamp.astimezone(pytz.UTC)
         except Exception as e:
             raise ErrorHandler(
-                "Error parsing DateTime 'notBefore' -> " + not_before + " .  Value must be of format "
-                                                                        "DateTimeFormatter.ofPattern('yyyy-MM-dd HH:mm:ss') " + str(
+                "Error parsing DateTime '" + request_key + "' -> " + value + " .  Value must be of format "
+                                                                          "DateTimeFormatter.ofPattern('yyyy-MM-dd HH:mm:ss') " + str(
                     e))
 
     @classmethod
-    def __validate_params(cls, params):
+    def __convert_positive_int(cls, request_key, value):
+        """Convert optional numeric request param into a positive int. Returns None if not passed"""
+        if value is None or str(value).strip() == '':
+            return None
+        try:
+            converted = int(value)
+        except (TypeError, ValueError):
+            raise ErrorHandler("Invalid request. Param: " + request_key + " must be a whole number, received: " + str(
+                value))
+        if converted < 1:
+            raise ErrorHandler("Invalid request. Param: " + request_key + " must be greater than 0")
+        return converted
+
+    @classmethod
+    def __validate_not_paged(cls, params):
+        """Paged searches are served by /search only, streaming and background searches return every match"""
+        if params.get(cls.param_page_size_key) is not None:
+            raise ErrorHandler("Invalid request. Params: " + cls.request_page_size_key + " and " +
+                               cls.request_cursor_key + " are only supported by /search")
+
+    @classmethod
+    def __validate_params(cls, params, search_required=True):
         """
         Catch and throw all invalid request exceptions here.
+        :param search_required: bool, False for requests that do not search (estimates), search terms are optional
         Current Validations:
-        - no search_string included in request
+        - no search_string, field filters or message key included in request
+        - invalid regular expression search term
+        - notAfter earlier than notBefore
+        - pageSize combined with search_count or newestFirst
         - no valid topics included in request
         """
-        # Validate search_string was included in request
-        if not params.get(cls.param_search_string_key):
+        # Validate search_string (or field filters, message key) was included in request
+        if search_required and not params.get(cls.param_search_terms_key) and \
+                not params.get(cls.param_field_filters_key) and params.get(cls.param_message_key_key) is None:
             raise ErrorHandler(
-                "Invalid request. Required param: " + cls.request_search_string_key + " not found .... If you are receiving this error in postman "
+                "Invalid request. Required param: " + cls.request_search_string_key + " (or " +
+                cls.request_field_filters_key + ", " + cls.request_message_key_key + ") not found .... If you are receiving this error in postman "
                                                                                       "and have included the required key, "
                                                                                       "please uncheck option in Headers Content-type - "
                                                                                       "application/x-www-form-urlencoded and try again")
 
+        # Validate regular expression search terms
+        SearchMatcher.for_terms(params[cls.param_search_terms_key], params[cls.param_field_filters_key])
+
+        # Validate time window, when both bounds are given
+        if params.get(cls.param_not_before_key) and params.get(cls.param_not_after_key) and \
+                params[cls.param_not_after_key] < params[cls.param_not_before_key]:
+            raise ErrorHandler(
+                "Invalid request. " + cls.request_not_after_key + " must not be earlier than " + cls.request_not_before_key)
+
+        # Validate paged searches, pages are read oldest offsets first and limited by the page size only
+        if params.get(cls.param_page_size_key) is not None:
+            if params.get(cls.param_search_count_key) is not None:
+                raise ErrorHandler("Invalid request. " + cls.request_page_size_key + " and " +
+                                   cls.request_search_count_key + " may not be combined")
+            if params.get(cls.param_newest_first_key) == 'true':
+                raise ErrorHandler("Invalid request. " + cls.request_page_size_key + " and " +
+                                   cls.request_newest_first_key + " may not be combined")
+
         # Validate valid topics was included in request
         if len(params[cls.param_json_topics_key]) == 0 and len(params.get(cls.param_avro_topics_key)) == 0:
             raise ErrorHandler("Invalid request. No valid topics selected for search")
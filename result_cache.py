@@ -0,0 +1,151 @@
+import json
+import threading
+from collections import OrderedDict
+
+import constants
+import default_constants
+from config_handler import ConnectionConfig
+from segment_cache import CachedMessage
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of search results, keyed by environment, topic and normalized search params (search terms,
+    field filters, message type, kafka metadata flag and time window). Every entry holds, for each partition, the offset range
+    scanned and all matches found in it. A repeated search replays the cached matches of each partition and only
+    scans offsets added since (up to the partition's current high watermark). Partitions whose low watermark moved
+    past the cached range, or whose high watermark moved backwards, are scanned again. A topic recreated with at
+    least as many messages as were cached cannot be told apart, clear() the cache (or disable it) for such topics.
+    Only searches without search_count, page size and newest first are cached, as those scans stop before reaching
+    the end of each partition.
+    """
+    # Main config keys ('result.cache' section)
+    config_result_cache_key = constants.CONFIG_RESULT_CACHE_KEY
+    config_enabled_key = constants.CONFIG_RESULT_CACHE_ENABLED_KEY
+    config_max_entries_key = constants.CONFIG_RESULT_CACHE_MAX_ENTRIES_KEY
+    config_max_bytes_key = constants.CONFIG_RESULT_CACHE_MAX_BYTES_KEY
+    default_enabled = default_constants.DEFAULT_RESULT_CACHE_ENABLED
+    default_max_entries = default_constants.DEFAULT_RESULT_CACHE_MAX_ENTRIES
+    default_max_bytes = default_constants.DEFAULT_RESULT_CACHE_MAX_BYTES
+
+    # Param keys
+    param_search_terms_key = constants.PARAM_SEARCH_TERMS_KEY
+    param_field_filters_key = constants.PARAM_FIELD_FILTERS_KEY
+    param_include_kafka_meta_key = constants.PARAM_INCLUDE_KAFKA_METADATA_KEY
+    param_search_count_key = constants.PARAM_SEARCH_COUNT_KEY
+    param_page_size_key = constants.PARAM_PAGE_SIZE_KEY
+    param_newest_first_key = constants.PARAM_NEWEST_FIRST_KEY
+    param_message_key_key = constants.PARAM_MESSAGE_KEY_KEY
+
+    # Status keys
+    status_hits_key = constants.CACHE_STATUS_HITS_KEY
+    status_partial_hits_key = constants.CACHE_STATUS_PARTIAL_HITS_KEY
+    status_misses_key = constants.CACHE_STATUS_MISSES_KEY
+    status_evictions_key = constants.CACHE_STATUS_EVICTIONS_KEY
+    status_entries_key = constants.CACHE_STATUS_ENTRIES_KEY
+    status_size_bytes_key = constants.CACHE_STATUS_SIZE_BYTES_KEY
+
+    # key -> dict() partition id -> PartitionResult(), least recently used first
+    __entries = OrderedDict()
+    __size_bytes = 0
+    __counters = {status_hits_key: 0, status_partial_hits_key: 0, status_misses_key: 0, status_evictions_key: 0}
+    __lock = threading.Lock()
+
+    @classmethod
+    def key_for(cls, environment, topic, message_type, request_params, time_window):
+        """
+        :param time_window: tuple() (not before, not after) epoch milliseconds, see kafka_client.TopicScan()
+        :return: cache key of the search, None if the search is not cacheable or the cache is disabled
+        """
+        config = (ConnectionConfig.connection_details or {}).get(cls.config_result_cache_key) or {}
+        if str(config.get(cls.config_enabled_key, cls.default_enabled)).lower() != 'true':
+            return None
+        if request_params.get(cls.param_search_count_key) is not None or \
+                request_params.get(cls.param_page_size_key) is not None or \
+                request_params.get(cls.param_newest_first_key) == 'true':
+            return None
+        return (environment, topic, message_type, request_params.get(cls.param_search_terms_key),
+                request_params.get(cls.param_field_filters_key), request_params.get(cls.param_include_kafka_meta_key),
+                request_params.get(cls.param_message_key_key), time_window)
+
+    @classmethod
+    def get_partition(cls, key, partition_id, start_offset, stop_offset):
+        """
+        Cached matches of a partition usable for the requested offset range.
+        :param start_offset: int, first offset of the search
+        :param stop_offset: int, exclusive stop offset of the search (high watermark at search start)
+        :return: tuple() (exclusive stop offset covered by the cache, list() of tuple() (CachedMessage(),
+                 parsed message)), None if the partition must be scanned from start offset
+        """
+        with cls.__lock:
+            entry = cls.__entries.get(key)
+            partition_result = entry.get(partition_id) if entry is not None else None
+            if partition_result is None or not (
+                    partition_result.start_offset <= start_offset <= partition_result.stop_offset <= stop_offset):
+                cls.__counters[cls.status_misses_key] += 1
+                return None
+            cls.__entries.move_to_end(key)
+            if partition_result.stop_offset == stop_offset:
+                cls.__counters[cls.status_hits_key] += 1
+            else:
+                cls.__counters[cls.status_partial_hits_key] += 1
+            matches = partition_result.matches
+        # Offsets deleted by retention since the partition was cached
+        return partition_result.stop_offset, [match for match in matches if match[0].offset() >= start_offset]
+
+    @classmethod
+    def put_partition(cls, key, partition_id, start_offset, stop_offset, matches):
+        """
+        Cache every match of a completely scanned offset range of a partition.
+        :param matches: list() of tuple() (confluent_kafka.Message() or CachedMessage(), parsed message), in
+                        offset order
+        """
+        partition_result = PartitionResult(start_offset, stop_offset, [
+            (CachedMessage(msg.topic(), msg.partition(), msg.offset(), msg.timestamp(), None, None), parsed_msg)
+            for msg, parsed_msg in matches])
+        with cls.__lock:
+            entry = cls.__entries.setdefault(key, {})
+            cls.__entries.move_to_end(key)
+            previous = entry.get(partition_id)
+            cls.__size_bytes += partition_result.size_bytes - (previous.size_bytes if previous else 0)
+            entry[partition_id] = partition_result
+            cls.__evict()
+
+    @classmethod
+    def clear(cls):
+        with cls.__lock:
+            cls.__entries.clear()
+            cls.__size_bytes = 0
+
+    @classmethod
+    def stats(cls):
+        """:return: dict() hit, partial hit (only new offsets scanned) and miss counts per partition, entries and
+                    estimated memory use"""
+        with cls.__lock:
+            return {**cls.__counters,
+                    cls.status_entries_key: len(cls.__entries),
+                    cls.status_size_bytes_key: cls.__size_bytes}
+
+    @classmethod
+    def __evict(cls):
+        """Drop least recently used entries until the cache fits. Caller must hold the lock"""
+        config = (ConnectionConfig.connection_details or {}).get(cls.config_result_cache_key) or {}
+        max_entries = int(config.get(cls.config_max_entries_key, cls.default_max_entries))
+        max_bytes = int(config.get(cls.config_max_bytes_key, cls.default_max_bytes))
+        while cls.__entries and (len(cls.__entries) > max_entries or cls.__size_bytes > max_bytes):
+            key, entry = cls.__entries.popitem(last=False)
+            cls.__size_bytes -= sum(partition_result.size_bytes for partition_result in entry.values())
+            cls.__counters[cls.status_evictions_key] += 1
+
+
+class PartitionResult:
+    """All matches found in a partition between start offset and (exclusive) stop offset"""
+    # Estimated bytes per cached match, besides the size of its json representation
+    match_overhead_bytes = 200
+
+    def __init__(self, start_offset, stop_offset, matches):
+        self.start_offset = start_offset
+        self.stop_offset = stop_offset
+        self.matches = matches
+        self.size_bytes = sum(self.match_overhead_bytes + len(json.dumps(parsed_msg, default=str))
+                              for msg, parsed_msg in matches)
@@ -0,0 +1,321 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+import constants
+import default_constants
+from config_handler import ConnectionConfig
+from error_handler import ErrorHandler, SearchCancelled
+from search_metrics import SearchMetrics
+
+
+class SearchAdmission:
+    """
+    Admission control of searches per environment. At most 'max.running' searches scan an environment at once,
+    later searches wait in a bounded queue and are rejected once it is full or they waited 'queue.timeout.seconds'.
+    When a search ends the next one is picked by priority class, then by the number of searches its client already
+    has running (clients with fewer running searches first), then in arrival order, so one client's burst of
+    searches does not hold up everybody else. Small, time bounded searches (time window up to
+    'priority.window.seconds') come before full retention scans, background jobs come last. Queued searches move up
+    a priority class every 'priority.aging.seconds' so large scans still run under sustained load.
+    Bytes read from the brokers are limited per environment with 'max.bytes.per.second', shared by every search:
+    readers are held back after each batch consumed while the environment is over its budget.
+    A search may hold up to 'topic.workers' x 'partition.workers' pooled consumers, so at most 'consumer.pool' size
+    divided by that many searches are admitted, whatever 'max.running' is: admitted searches never wait for a
+    consumer held by another admitted search.
+    """
+    # Main config keys ('search.admission' section)
+    config_search_admission_key = constants.CONFIG_SEARCH_ADMISSION_KEY
+    config_enabled_key = constants.CONFIG_SEARCH_ADMISSION_ENABLED_KEY
+    config_max_running_key = constants.CONFIG_SEARCH_ADMISSION_MAX_RUNNING_KEY
+    config_max_bytes_per_second_key = constants.CONFIG_SEARCH_ADMISSION_MAX_BYTES_PER_SECOND_KEY
+    config_queue_size_key = constants.CONFIG_SEARCH_ADMISSION_QUEUE_SIZE_KEY
+    config_queue_timeout_key = constants.CONFIG_SEARCH_ADMISSION_QUEUE_TIMEOUT_KEY
+    config_priority_window_key = constants.CONFIG_SEARCH_ADMISSION_PRIORITY_WINDOW_KEY
+    config_priority_aging_key = constants.CONFIG_SEARCH_ADMISSION_PRIORITY_AGING_KEY
+    default_enabled = default_constants.DEFAULT_SEARCH_ADMISSION_ENABLED
+    default_max_running = default_constants.DEFAULT_SEARCH_ADMISSION_MAX_RUNNING
+    default_max_bytes_per_second = default_constants.DEFAULT_SEARCH_ADMISSION_MAX_BYTES_PER_SECOND
+    default_queue_size = default_constants.DEFAULT_SEARCH_ADMISSION_QUEUE_SIZE
+    default_queue_timeout = default_constants.DEFAULT_SEARCH_ADMISSION_QUEUE_TIMEOUT_SECONDS
+    default_priority_window = default_constants.DEFAULT_SEARCH_ADMISSION_PRIORITY_WINDOW_SECONDS
+    default_priority_aging = default_constants.DEFAULT_SEARCH_ADMISSION_PRIORITY_AGING_SECONDS
+    # Consumers a search may hold at once ('consumer.pool', 'topic.workers', 'partition.workers')
+    config_consumer_pool_key = constants.CONFIG_CONSUMER_POOL_KEY
+    config_consumer_pool_size_key = constants.CONFIG_CONSUMER_POOL_SIZE_KEY
+    config_topic_workers_key = constants.CONFIG_TOPIC_WORKERS_KEY
+    config_partition_workers_key = constants.CONFIG_PARTITION_WORKERS_KEY
+    default_consumer_pool_size = default_constants.DEFAULT_CONSUMER_POOL_SIZE
+    default_topic_workers = default_constants.DEFAULT_TOPIC_WORKERS
+    default_partition_workers = default_constants.DEFAULT_PARTITION_WORKERS
+    default_max_partition_workers = default_constants.DEFAULT_MAX_PARTITION_WORKERS
+
+    # Param keys
+    param_environment_key = constants.PARAM_ENVIRONMENT_KEY
+    param_not_before_key = constants.PARAM_NOT_BEFORE_KEY
+    param_not_after_key = constants.PARAM_NOT_AFTER_KEY
+    # Status keys
+    status_running_key = constants.ADMISSION_STATUS_RUNNING_KEY
+    status_queued_key = constants.ADMISSION_STATUS_QUEUED_KEY
+    status_max_running_key = constants.ADMISSION_STATUS_MAX_RUNNING_KEY
+    status_max_bytes_per_second_key = constants.ADMISSION_STATUS_MAX_BYTES_PER_SECOND_KEY
+    status_clients_key = constants.ADMISSION_STATUS_CLIENTS_KEY
+
+    # Priority classes, lowest first
+    priority_small = 0
+    priority_full = 1
+    priority_background = 2
+    # Queued searches check for cancellation, deadline and queue timeout this often, throttled readers for
+    # interruption
+    wait_seconds = .1
+
+    # environment -> EnvironmentAdmission()
+    __environments = {}
+    # environment -> ByteBudget()
+    __budgets = {}
+    __sequence = 0
+    __lock = threading.Lock()
+
+    @classmethod
+    def admit(cls, params, client, background=False, cancel_event=None, deadline=None):
+        """
+        Wait until the search may scan its environment. Every admitted search must be released, see release()
+        :param params: dict() parsed request
+        :param client: string identifying the client, searches are shared fairly between clients
+        :param background: True for background jobs, admitted after interactive searches and never timed out
+        :param cancel_event: optional threading.Event(), ends the wait when set (raises SearchCancelled)
+        :param deadline: optional float, time.monotonic() value ending the wait (raises SearchCancelled)
+        :return: AdmissionTicket()
+        """
+        environment = params.get(cls.param_environment_key)
+        ticket = AdmissionTicket(environment, client, cls.__priority_of(params, background))
+        if not cls.__enabled():
+            ticket.admitted.set()
+            return ticket
+
+        with cls.__lock:
+            state = cls.__environments.get(environment)
+            if state is None:
+                state = cls.__environments[environment] = EnvironmentAdmission()
+            cls.__sequence += 1
+            ticket.sequence = cls.__sequence
+            if not state.waiting and state.running < cls.__max_running(environment):
+                state.start(ticket)
+            elif len(state.waiting) >= int(cls.__config(cls.config_queue_size_key, cls.default_queue_size)):
+                SearchMetrics.record_admission_rejected(environment, 'queue_full')
+                raise ErrorHandler("Search rejected, " + str(len(state.waiting)) + " searches already queued for "
+                                   "environment: " + str(environment) + ". Try again later")
+            else:
+                state.waiting.append(ticket)
+
+        timeout = None if background else float(cls.__config(cls.config_queue_timeout_key, cls.default_queue_timeout))
+        expires = ticket.enqueued + timeout if timeout else None
+        while not ticket.admitted.wait(cls.wait_seconds):
+            now = time.monotonic()
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            if not cancelled and (deadline is None or now < deadline) and (expires is None or now < expires):
+                continue
+            with cls.__lock:
+                if ticket.admitted.is_set():
+                    break
+                state.waiting.remove(ticket)
+            if cancelled or (deadline is not None and now >= deadline):
+                raise SearchCancelled("Search " + ("cancelled" if cancelled else "deadline reached") +
+                                      " while queued for environment: " + str(environment))
+            SearchMetrics.record_admission_rejected(environment, 'queue_timeout')
+            raise ErrorHandler("Search rejected after waiting " + str(round(now - ticket.enqueued, 1)) +
+                               " seconds for environment: " + str(environment) + ". Try again later")
+
+        ticket.queued_seconds = ticket.started - ticket.enqueued
+        SearchMetrics.record_admission(environment, ticket.queued_seconds)
+        return ticket
+
+    @classmethod
+    def release(cls, ticket):
+        """End an admitted search, admitting the next queued searches of its environment"""
+        with cls.__lock:
+            state = cls.__environments.get(ticket.environment)
+            if ticket.released or state is None or ticket not in state.started:
+                ticket.released = True
+                return
+            ticket.released = True
+            state.finish(ticket)
+            cls.__schedule(ticket.environment, state)
+
+    @classmethod
+    def throttle(cls, environment, msgs, interrupted=None):
+        """
+        Hold back a reader that consumed msgs from the brokers of environment while the environment is over its
+        bytes per second budget
+        :param msgs: list() of confluent_kafka.Message() just consumed
+        :param interrupted: optional callable(), True ends the wait early
+        :return: float, seconds waited
+        """
+        rate = float(cls.__environment_config(cls.config_max_bytes_per_second_key, environment,
+                                              cls.default_max_bytes_per_second) or 0)
+        if rate <= 0 or not cls.__enabled():
+            return 0.0
+        scanned_bytes = sum(len(msg) for msg in msgs)
+        started = time.monotonic()
+        with cls.__lock:
+            budget = cls.__budgets.get(environment)
+            if budget is None:
+                budget = cls.__budgets[environment] = ByteBudget(rate, started)
+            delay = budget.take(scanned_bytes, rate, started)
+        if delay <= 0:
+            return 0.0
+        until = started + delay
+        now = started
+        while now < until and not (interrupted and interrupted()):
+            time.sleep(min(cls.wait_seconds, until - now))
+            now = time.monotonic()
+        return now - started
+
+    @classmethod
+    def status(cls):
+        """:return: dict() environment -> running and queued searches, per client, and the environment's limits"""
+        with cls.__lock:
+            environments = {environment: (state.running_by_client(), state.queued_by_client())
+                            for environment, state in cls.__environments.items()}
+        status = {}
+        for environment, (running, queued) in environments.items():
+            status[environment] = {
+                cls.status_running_key: sum(running.values()),
+                cls.status_queued_key: sum(queued.values()),
+                cls.status_max_running_key: cls.__max_running(environment),
+                cls.status_max_bytes_per_second_key: float(cls.__environment_config(
+                    cls.config_max_bytes_per_second_key, environment, cls.default_max_bytes_per_second) or 0) or None,
+                cls.status_clients_key: {client: {cls.status_running_key: running.get(client, 0),
+                                                  cls.status_queued_key: queued.get(client, 0)}
+                                         for client in sorted(set(running) | set(queued))}}
+        return status
+
+    @classmethod
+    def __schedule(cls, environment, state):
+        """Admit queued searches while the environment has room. Caller must hold the lock"""
+        max_running = cls.__max_running(environment)
+        aging = float(cls.__config(cls.config_priority_aging_key, cls.default_priority_aging))
+        now = time.monotonic()
+        while state.waiting and state.running < max_running:
+            ticket = min(state.waiting, key=lambda waiting: (
+                max(0, waiting.priority - int((now - waiting.enqueued) // aging)) if aging > 0 else waiting.priority,
+                state.client_running.get(waiting.client, 0),
+                waiting.sequence))
+            state.waiting.remove(ticket)
+            state.start(ticket)
+
+    @classmethod
+    def __priority_of(cls, params, background):
+        """Background jobs last, searches with a time window up to the priority window first"""
+        if background:
+            return cls.priority_background
+        not_before = params.get(cls.param_not_before_key)
+        if not_before is None:
+            return cls.priority_full
+        not_after = params.get(cls.param_not_after_key) or datetime.now(timezone.utc)
+        window = float(cls.__config(cls.config_priority_window_key, cls.default_priority_window))
+        return cls.priority_small if (not_after - not_before).total_seconds() <= window else cls.priority_full
+
+    @classmethod
+    def __max_running(cls, environment):
+        """Configured 'max.running', limited to the searches the consumer pool can serve with every worker busy"""
+        max_running = int(cls.__environment_config(cls.config_max_running_key, environment, cls.default_max_running))
+        return max(1, min(max_running, cls.__consumer_pool_size() // cls.__consumers_per_search(environment)))
+
+    @classmethod
+    def __consumers_per_search(cls, environment):
+        """Pooled consumers a search of environment holds at most: one per topic worker and partition worker"""
+        config = ConnectionConfig.connection_details or {}
+        topic_workers = int((config.get(cls.config_topic_workers_key) or {}).get(environment,
+                                                                                cls.default_topic_workers))
+        partition_workers = int((config.get(cls.config_partition_workers_key) or {}).get(
+            environment, cls.default_partition_workers))
+        return max(1, topic_workers) * max(1, min(partition_workers, cls.default_max_partition_workers))
+
+    @classmethod
+    def __consumer_pool_size(cls):
+        pool_config = (ConnectionConfig.connection_details or {}).get(cls.config_consumer_pool_key) or {}
+        return int(pool_config.get(cls.config_consumer_pool_size_key, cls.default_consumer_pool_size))
+
+    @classmethod
+    def __enabled(cls):
+        return str(cls.__config(cls.config_enabled_key, cls.default_enabled)).lower() == 'true'
+
+    @classmethod
+    def __environment_config(cls, key, environment, default):
+        """Config value per environment (environment -> value), or a single value for every environment"""
+        value = cls.__config(key, default)
+        if isinstance(value, dict):
+            return value.get(environment, default)
+        return value
+
+    @classmethod
+    def __config(cls, key, default):
+        config = (ConnectionConfig.connection_details or {}).get(cls.config_search_admission_key) or {}
+        return config.get(key, default)
+
+
+class EnvironmentAdmission:
+    """Running and queued searches of an environment, changed under SearchAdmission lock"""
+
+    def __init__(self):
+        self.running = 0
+        # client -> searches running
+        self.client_running = {}
+        # AdmissionTicket() of the searches running, and of the searches queued in arrival order
+        self.started = set()
+        self.waiting = []
+
+    def start(self, ticket):
+        self.running += 1
+        self.client_running[ticket.client] = self.client_running.get(ticket.client, 0) + 1
+        self.started.add(ticket)
+        ticket.started = time.monotonic()
+        ticket.admitted.set()
+
+    def finish(self, ticket):
+        self.running -= 1
+        self.started.discard(ticket)
+        self.client_running[ticket.client] -= 1
+        if not self.client_running[ticket.client]:
+            del self.client_running[ticket.client]
+
+    def running_by_client(self):
+        return dict(self.client_running)
+
+    def queued_by_client(self):
+        queued = {}
+        for ticket in self.waiting:
+            queued[ticket.client] = queued.get(ticket.client, 0) + 1
+        return queued
+
+
+class AdmissionTicket:
+    """A search waiting for, or admitted to, its environment"""
+
+    def __init__(self, environment, client, priority):
+        self.environment = environment
+        self.client = client
+        self.priority = priority
+        self.sequence = 0
+        self.admitted = threading.Event()
+        self.released = False
+        # time.monotonic() values, queued seconds once admitted
+        self.enqueued = time.monotonic()
+        self.started = self.enqueued
+        self.queued_seconds = 0.0
+
+
+class ByteBudget:
+    """Token bucket of an environment's bytes per second budget, holding at most one second of bytes"""
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, rate, now):
+        self.tokens = rate
+        self.updated = now
+
+    def take(self, scanned_bytes, rate, now):
+        """:return: float, seconds the reader waits before reading on, 0 while within budget"""
+        self.tokens = min(rate, self.tokens + (now - self.updated) * rate) - scanned_bytes
+        self.updated = now
+        return -self.tokens / rate if self.tokens < 0 else 0.0
@@ -0,0 +1,91 @@
+import base64
+import binascii
+import hashlib
+import json
+
+import constants
+from error_handler import ErrorHandler
+
+
+class SearchCursor:
+    """
+    Resume cursor of a paged search (pageSize). Opaque to clients, it holds the page size, a fingerprint of the
+    search it belongs to and, for every topic not scanned completely yet, the next offset to read and the stop
+    offset of each of its partitions. Stop offsets are the high watermarks captured by the first page, so paging
+    through a search reads a fixed snapshot of every topic and no message is returned twice.
+    """
+    cursor_version = 1
+    cursor_version_key = 'v'
+    cursor_search_key = 's'
+    cursor_page_size_key = 'n'
+    cursor_topics_key = 't'
+
+    param_search_terms_key = constants.PARAM_SEARCH_TERMS_KEY
+    param_field_filters_key = constants.PARAM_FIELD_FILTERS_KEY
+    param_environment_key = constants.PARAM_ENVIRONMENT_KEY
+    param_json_topics_key = constants.PARAM_JSON_TOPICS_KEY
+    param_avro_topics_key = constants.PARAM_AVRO_TOPICS_KEY
+    param_not_before_key = constants.PARAM_NOT_BEFORE_KEY
+    param_not_after_key = constants.PARAM_NOT_AFTER_KEY
+    param_message_key_key = constants.PARAM_MESSAGE_KEY_KEY
+    request_cursor_key = constants.REQUEST_CURSOR_KEY
+
+    @classmethod
+    def encode(cls, params, page_size, topic_offsets):
+        """
+        :param params: dict() parsed request
+        :param page_size: int
+        :param topic_offsets: dict() response key -> dict() partition id -> tuple() (next offset, exclusive stop
+                              offset), or None if the topic has not been scanned yet. Topics scanned completely are
+                              left out
+        :return: string cursor of the next page, None once every topic has been scanned completely
+        """
+        if not topic_offsets:
+            return None
+        cursor = {cls.cursor_version_key: cls.cursor_version,
+                  cls.cursor_search_key: cls.__fingerprint(params),
+                  cls.cursor_page_size_key: page_size,
+                  cls.cursor_topics_key: {response_key: {str(partition_id): list(bounds)
+                                                         for partition_id, bounds in offsets.items()}
+                                          if offsets is not None else None
+                                          for response_key, offsets in topic_offsets.items()}}
+        return base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode()
+
+    @classmethod
+    def decode(cls, params, cursor):
+        """
+        :param params: dict() parsed request, must describe the same search as the request the cursor came from
+        :param cursor: string
+        :return: tuple() (page size, topic offsets), see encode()
+        """
+        try:
+            decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            version = decoded[cls.cursor_version_key]
+            fingerprint = decoded[cls.cursor_search_key]
+            page_size = int(decoded[cls.cursor_page_size_key])
+            topic_offsets = {response_key: {int(partition_id): (int(bounds[0]), int(bounds[1]))
+                                            for partition_id, bounds in offsets.items()}
+                             if offsets is not None else None
+                             for response_key, offsets in decoded[cls.cursor_topics_key].items()}
+        except (binascii.Error, ValueError, TypeError, KeyError, IndexError, AttributeError):
+            raise ErrorHandler("Invalid request. Param: " + cls.request_cursor_key + " is not a valid cursor")
+        if version != cls.cursor_version:
+            raise ErrorHandler("Invalid request. Param: " + cls.request_cursor_key + " is from an older version, "
+                                                                                     "restart the search")
+        if fingerprint != cls.__fingerprint(params):
+            raise ErrorHandler("Invalid request. Param: " + cls.request_cursor_key + " belongs to a different search, "
+                                                                                     "search params must not change "
+                                                                                     "between pages")
+        return page_size, topic_offsets
+
+    @classmethod
+    def __fingerprint(cls, params):
+        """Hash of the params selecting the messages of a search, the output format may change between pages"""
+        search = [params.get(cls.param_search_terms_key), params.get(cls.param_field_filters_key),
+                  params.get(cls.param_environment_key), sorted(params.get(cls.param_json_topics_key) or ()),
+                  sorted(params.get(cls.param_avro_topics_key) or ()), params.get(cls.param_not_before_key),
+                  params.get(cls.param_not_after_key)]
+        # Only when given, cursors of searches without a message key keep their fingerprint
+        if params.get(cls.param_message_key_key) is not None:
+            search.append(params[cls.param_message_key_key])
+        return hashlib.sha1(json.dumps(search, default=str).encode()).hexdigest()[:16]
@@ -0,0 +1,222 @@
+import constants
+import default_constants
+from config_handler import ConnectionConfig
+from error_handler import ErrorHandler
+from kafka_client import KafkaReader
+from search_metrics import SearchMetrics
+
+
+class SearchEstimate:
+    """
+    Topic statistics and search cost estimates (/search/estimate), from topic metadata and offsets only, no message is
+    read. For every topic: partition count, messages per partition and in the requested time window, estimated bytes
+    and whether retention may already have deleted the start of the window. The cost of a search is the messages it
+    would scan (time window and message key applied) at the average message size and scan rate measured by this
+    process's earlier scans of the topic (SearchMetrics), configured defaults until the topic has been scanned.
+    Estimates are upper bounds, result cache, segment cache and token index hits are not accounted for.
+    Searches limited to a number of matches (search_count, pageSize) stop once they found them: at most
+    limit / 'assumed.selectivity' messages are counted for them (per partition when newest first, the limit applies
+    to every partition), so a large limit is warned about and rejected like an unlimited search.
+    """
+    # Main config keys ('search.estimate' section)
+    config_search_estimate_key = constants.CONFIG_SEARCH_ESTIMATE_KEY
+    config_message_bytes_key = constants.CONFIG_SEARCH_ESTIMATE_MESSAGE_BYTES_KEY
+    config_messages_per_second_key = constants.CONFIG_SEARCH_ESTIMATE_MESSAGES_PER_SECOND_KEY
+    config_warn_seconds_key = constants.CONFIG_SEARCH_ESTIMATE_WARN_SECONDS_KEY
+    config_max_seconds_key = constants.CONFIG_SEARCH_ESTIMATE_MAX_SECONDS_KEY
+    config_selectivity_key = constants.CONFIG_SEARCH_ESTIMATE_SELECTIVITY_KEY
+    default_message_bytes = default_constants.DEFAULT_SEARCH_ESTIMATE_MESSAGE_BYTES
+    default_messages_per_second = default_constants.DEFAULT_SEARCH_ESTIMATE_MESSAGES_PER_SECOND
+    default_min_measured_messages = default_constants.DEFAULT_SEARCH_ESTIMATE_MIN_MEASURED_MESSAGES
+    default_warn_seconds = default_constants.DEFAULT_SEARCH_ESTIMATE_WARN_SECONDS
+    default_max_seconds = default_constants.DEFAULT_SEARCH_ESTIMATE_MAX_SECONDS
+    default_selectivity = default_constants.DEFAULT_SEARCH_ESTIMATE_SELECTIVITY
+
+    # Param keys
+    param_environment_key = constants.PARAM_ENVIRONMENT_KEY
+    param_not_before_key = constants.PARAM_NOT_BEFORE_KEY
+    param_search_count_key = constants.PARAM_SEARCH_COUNT_KEY
+    param_page_size_key = constants.PARAM_PAGE_SIZE_KEY
+    param_newest_first_key = constants.PARAM_NEWEST_FIRST_KEY
+    request_not_before_key = constants.REQUEST_NOT_BEFORE_KEY
+    request_not_after_key = constants.REQUEST_NOT_AFTER_KEY
+    request_message_key_key = constants.REQUEST_MESSAGE_KEY_KEY
+    # Response keys
+    response_estimate_key = constants.RESPONSE_ESTIMATE_KEY
+    partition_count_key = constants.ESTIMATE_PARTITION_COUNT_KEY
+    partitions_key = constants.ESTIMATE_PARTITIONS_KEY
+    partition_key = constants.ESTIMATE_PARTITION_KEY
+    low_watermark_key = constants.ESTIMATE_LOW_WATERMARK_KEY
+    high_watermark_key = constants.ESTIMATE_HIGH_WATERMARK_KEY
+    messages_key = constants.ESTIMATE_MESSAGES_KEY
+    bytes_key = constants.ESTIMATE_BYTES_KEY
+    message_bytes_key = constants.ESTIMATE_MESSAGE_BYTES_KEY
+    window_messages_key = constants.ESTIMATE_WINDOW_MESSAGES_KEY
+    window_coverage_key = constants.ESTIMATE_WINDOW_COVERAGE_KEY
+    retention_truncated_key = constants.ESTIMATE_RETENTION_TRUNCATED_KEY
+    search_key = constants.ESTIMATE_SEARCH_KEY
+    seconds_key = constants.ESTIMATE_SECONDS_KEY
+    messages_per_second_key = constants.ESTIMATE_MESSAGES_PER_SECOND_KEY
+    measured_key = constants.ESTIMATE_MEASURED_KEY
+    warning_key = constants.ESTIMATE_WARNING_KEY
+    rejected_key = constants.ESTIMATE_REJECTED_KEY
+    limited_key = constants.ESTIMATE_LIMITED_KEY
+
+    @classmethod
+    def estimate(cls, params, topic_searches, topic_workers):
+        """
+        :param params: dict() parsed request, search terms are optional
+        :param topic_searches: list() of tuple() (response key, topic name, message type)
+        :param topic_workers: int, topics searched at once
+        :return: dict() response key -> topic stats (or error message), and the estimate of the whole search under
+                 the response estimate key: messages, bytes, seconds, warning (None if not expensive), rejected and
+                 limited (True if a topic's messages were capped by the search's match limit)
+        """
+        environment = params.get(cls.param_environment_key)
+        response = {}
+        messages = 0
+        estimated_bytes = 0
+        topic_seconds = []
+        limited = False
+        for response_key, topic_name, message_type in topic_searches:
+            try:
+                topic_stats = cls.__topic_stats(environment, params, topic_name, message_type)
+            except Exception as e:
+                response[response_key] = "Error describing topic. " + str(e)
+                continue
+            response[response_key] = topic_stats
+            messages += topic_stats[cls.search_key][cls.messages_key]
+            estimated_bytes += topic_stats[cls.search_key][cls.bytes_key]
+            topic_seconds.append(topic_stats[cls.search_key][cls.seconds_key])
+            limited = limited or topic_stats[cls.search_key][cls.limited_key]
+
+        # Topics are scanned topic_workers at a time
+        seconds = max(max(topic_seconds, default=0.0), sum(topic_seconds) / max(1, topic_workers))
+        warn_seconds = float(cls.__environment_config(cls.config_warn_seconds_key, environment,
+                                                      cls.default_warn_seconds) or 0)
+        max_seconds = float(cls.__environment_config(cls.config_max_seconds_key, environment,
+                                                     cls.default_max_seconds) or 0)
+        rejected = 0 < max_seconds < seconds
+        warning = None
+        if rejected or 0 < warn_seconds < seconds:
+            warning = "Search estimated to scan " + str(messages) + " messages (" + str(
+                round(estimated_bytes / 1048576.0, 1)) + " MB) in about " + str(round(seconds, 1)) + " seconds"
+            if rejected:
+                warning += ", over the limit of " + str(int(max_seconds)) + " seconds of environment: " + str(
+                    environment)
+            warning += ". Narrow the time window (" + cls.request_not_before_key + "/" + \
+                       cls.request_not_after_key + "), look up a " + cls.request_message_key_key + \
+                       " or run it as a background job (/search/jobs)"
+        response[cls.response_estimate_key] = {cls.messages_key: messages,
+                                               cls.bytes_key: estimated_bytes,
+                                               cls.seconds_key: seconds,
+                                               cls.warning_key: warning,
+                                               cls.rejected_key: rejected,
+                                               cls.limited_key: limited}
+        return response
+
+    @classmethod
+    def check(cls, params, topic_searches, topic_workers):
+        """
+        Raise ErrorHandler if the search is estimated to take longer than its environment's 'max.seconds'. No
+        offsets are looked up unless a limit is configured. Topics that cannot be described are left to the search
+        """
+        environment = params.get(cls.param_environment_key)
+        if not float(cls.__environment_config(cls.config_max_seconds_key, environment, cls.default_max_seconds) or 0):
+            return
+        estimate = cls.estimate(params, topic_searches, topic_workers)[cls.response_estimate_key]
+        if estimate[cls.rejected_key]:
+            SearchMetrics.record_admission_rejected(environment, 'estimated_cost')
+            raise ErrorHandler("Search rejected. " + estimate[cls.warning_key])
+
+    @classmethod
+    def __topic_stats(cls, environment, params, topic_name, message_type):
+        """:return: dict() partition and message counts of topic, and the estimated cost of searching it"""
+        kafka_reader = KafkaReader(environment)
+        try:
+            partition_offsets = kafka_reader.describe_topic(params, topic_name, message_type)
+        finally:
+            kafka_reader.close()
+        message_bytes, messages_per_second, measured = cls.__scan_rates(environment, topic_name)
+        max_messages = cls.__max_messages(environment, params)
+        newest_first = params.get(cls.param_newest_first_key) == 'true'
+
+        partitions = []
+        search_partitions = 0
+        search_messages = 0
+        retention_truncated = False
+        limited = False
+        for partition_id, (low_offset, high_offset, start_offset, stop_offset, scanned) in partition_offsets.items():
+            window_messages = stop_offset - start_offset if start_offset is not None else 0
+            partitions.append({cls.partition_key: partition_id,
+                               cls.low_watermark_key: low_offset,
+                               cls.high_watermark_key: high_offset,
+                               cls.messages_key: high_offset - low_offset,
+                               cls.window_messages_key: window_messages})
+            # The window starts at the oldest message kept, older messages of the window may have been deleted
+            if params.get(cls.param_not_before_key) is not None and start_offset == low_offset and low_offset > 0:
+                retention_truncated = True
+            if scanned:
+                search_partitions += 1
+                partition_messages = window_messages
+                # Newest first, the match limit applies to every partition
+                if newest_first and max_messages is not None and partition_messages > max_messages:
+                    partition_messages = max_messages
+                    limited = True
+                search_messages += partition_messages
+        if not newest_first and max_messages is not None and search_messages > max_messages:
+            search_messages = max_messages
+            limited = True
+
+        messages = sum(partition[cls.messages_key] for partition in partitions)
+        window_messages = sum(partition[cls.window_messages_key] for partition in partitions)
+        return {cls.partition_count_key: len(partitions),
+                cls.messages_key: messages,
+                cls.bytes_key: int(messages * message_bytes),
+                cls.message_bytes_key: round(message_bytes, 1),
+                cls.window_messages_key: window_messages,
+                cls.window_coverage_key: round(window_messages / float(messages), 4) if messages else None,
+                cls.retention_truncated_key: retention_truncated,
+                cls.partitions_key: partitions,
+                cls.search_key: {cls.partitions_key: search_partitions,
+                                 cls.messages_key: search_messages,
+                                 cls.bytes_key: int(search_messages * message_bytes),
+                                 cls.seconds_key: search_messages / messages_per_second,
+                                 cls.messages_per_second_key: round(messages_per_second, 1),
+                                 cls.measured_key: measured,
+                                 cls.limited_key: limited}}
+
+    @classmethod
+    def __max_messages(cls, environment, params):
+        """
+        :return: int, messages a search with a match limit (search_count, or pageSize per page) is expected to read
+                 before reaching it at the assumed selectivity, None for searches without a limit
+        """
+        limit = params.get(cls.param_search_count_key) or params.get(cls.param_page_size_key)
+        if limit is None:
+            return None
+        selectivity = float(cls.__environment_config(cls.config_selectivity_key, environment,
+                                                     cls.default_selectivity))
+        return int(limit / selectivity) if selectivity > 0 else None
+
+    @classmethod
+    def __scan_rates(cls, environment, topic_name):
+        """
+        :return: tuple() (average message bytes, messages scanned per second, True if measured by earlier scans of
+                 the topic rather than configured defaults)
+        """
+        messages, scanned_bytes, seconds = SearchMetrics.scan_totals(environment, topic_name)
+        if messages >= cls.default_min_measured_messages and seconds > 0:
+            return scanned_bytes / float(messages), messages / seconds, True
+        return (float(cls.__environment_config(cls.config_message_bytes_key, environment, cls.default_message_bytes)),
+                float(cls.__environment_config(cls.config_messages_per_second_key, environment,
+                                               cls.default_messages_per_second)), False)
+
+    @classmethod
+    def __environment_config(cls, key, environment, default):
+        """Config value per environment (environment -> value), or a single value for every environment"""
+        config = (ConnectionConfig.connection_details or {}).get(cls.config_search_estimate_key) or {}
+        value = config.get(key, default)
+        if isinstance(value, dict):
+            return value.get(environment, default)
+        return value
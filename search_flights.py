@@ -0,0 +1,100 @@
+import json
+import threading
+
+import constants
+import default_constants
+from config_handler import ConnectionConfig
+from error_handler import ErrorHandler
+from search_metrics import SearchMetrics
+
+
+class SearchFlights:
+    """
+    Single flight coalescing of identical /search requests. The first request of a search runs it, identical
+    requests arriving while it runs wait for it and return the same result instead of scanning the same topics
+    again. Requests are identical when every search param is equal, so coalesced requests always get the result
+    they would have got on their own, only without the scan. Every request gets its own copy of the response dict,
+    the matches in it are shared and must not be modified once returned.
+    """
+    # Main config keys
+    config_coalescing_enabled_key = constants.CONFIG_SEARCH_COALESCING_ENABLED_KEY
+    default_enabled = default_constants.DEFAULT_SEARCH_COALESCING_ENABLED
+
+    # Param keys
+    param_environment_key = constants.PARAM_ENVIRONMENT_KEY
+    param_include_stats_key = constants.PARAM_INCLUDE_STATS_KEY
+    # Response keys
+    response_stats_key = constants.RESPONSE_STATS_KEY
+    stats_coalesced_key = constants.STATS_COALESCED_KEY
+
+    # flight key -> Flight() of the search running
+    __flights = {}
+    __lock = threading.Lock()
+
+    @classmethod
+    def run(cls, params, search):
+        """
+        Run search, or wait for the identical search already running
+        :param params: dict() parsed request
+        :param search: callable(), returns the search's response
+        :return: response, matches shared by every request coalesced with this one
+        """
+        if str((ConnectionConfig.connection_details or {}).get(cls.config_coalescing_enabled_key,
+                                                               cls.default_enabled)).lower() != 'true':
+            return search()
+        key = cls.__key_for(params)
+        with cls.__lock:
+            flight = cls.__flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = cls.__flights[key] = Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            SearchMetrics.record_coalesced(params.get(cls.param_environment_key))
+            flight.done.wait()
+            if flight.error is not None:
+                raise ErrorHandler(str(flight.error))
+            return cls.__copy(flight.result)
+
+        try:
+            flight.result = search()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with cls.__lock:
+                del cls.__flights[key]
+            # No request can join the flight anymore, followers are final
+            if flight.error is None and params.get(cls.param_include_stats_key) == 'true' and \
+                    isinstance(flight.result, dict) and flight.result.get(cls.response_stats_key) is not None:
+                flight.result[cls.response_stats_key][cls.stats_coalesced_key] = flight.followers
+            flight.done.set()
+        return flight.result
+
+    @classmethod
+    def __copy(cls, result):
+        """Copy of the response dict and its stats block, the leader's response stays as it is"""
+        if not isinstance(result, dict):
+            return result
+        result = dict(result)
+        if isinstance(result.get(cls.response_stats_key), dict):
+            result[cls.response_stats_key] = dict(result[cls.response_stats_key])
+        return result
+
+    @staticmethod
+    def __key_for(params):
+        """Every param of the request, topic sets in sorted order"""
+        return json.dumps({name: sorted(value) if isinstance(value, set) else value for name, value in params.items()},
+                          sort_keys=True, default=str)
+
+
+class Flight:
+    """A running search and the requests waiting for its result"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Requests coalesced with the one running the search
+        self.followers = 0
@@ -0,0 +1,262 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import constants
+import default_constants
+from config_handler import ConnectionConfig
+from error_handler import ErrorHandler
+
+
+class SearchJobs:
+    """
+    Searches run in the background (/search/jobs), so long scans do not hold a request thread or depend on the client
+    waiting for them. Jobs are run by a bounded pool of threads, jobs submitted beyond 'max.running' are queued.
+    Progress and partial results of a job can be read while it runs, finished jobs and their results are kept for
+    'ttl.seconds' and at most 'max.jobs' jobs are kept overall.
+    """
+    # Main config keys ('search.jobs' section)
+    config_search_jobs_key = constants.CONFIG_SEARCH_JOBS_KEY
+    config_max_running_key = constants.CONFIG_SEARCH_JOBS_MAX_RUNNING_KEY
+    config_max_jobs_key = constants.CONFIG_SEARCH_JOBS_MAX_JOBS_KEY
+    config_ttl_key = constants.CONFIG_SEARCH_JOBS_TTL_KEY
+    default_max_running = default_constants.DEFAULT_SEARCH_JOBS_MAX_RUNNING
+    default_max_jobs = default_constants.DEFAULT_SEARCH_JOBS_MAX_JOBS
+    default_ttl = default_constants.DEFAULT_SEARCH_JOBS_TTL_SECONDS
+
+    # job id -> SearchJob(), oldest first
+    __jobs = OrderedDict()
+    __executor = None
+    __lock = threading.Lock()
+
+    @classmethod
+    def submit(cls, params, topic_searches, deadline, run):
+        """
+        Queue a search job
+        :param params: dict() parsed request
+        :param topic_searches: list() of tuple() (response key, topic name, message type)
+        :param deadline: optional float, time.monotonic() value at which the job's scans end early
+        :param run: callable(SearchJob()), searches the job's topics
+        :return: SearchJob()
+        """
+        job = SearchJob(params, topic_searches, deadline)
+        with cls.__lock:
+            cls.__expire(room=1)
+            if len(cls.__jobs) >= cls.__config(cls.config_max_jobs_key, cls.default_max_jobs):
+                raise ErrorHandler("Too many search jobs, wait for running jobs to finish or cancel them")
+            cls.__jobs[job.job_id] = job
+            if cls.__executor is None:
+                cls.__executor = ThreadPoolExecutor(
+                    max_workers=cls.__config(cls.config_max_running_key, cls.default_max_running),
+                    thread_name_prefix='search-job')
+            cls.__executor.submit(job.run, run)
+        return job
+
+    @classmethod
+    def get(cls, job_id):
+        """:return: SearchJob(), raises ErrorHandler if unknown or expired"""
+        with cls.__lock:
+            cls.__expire()
+            job = cls.__jobs.get(job_id)
+        if job is None:
+            raise ErrorHandler("Unknown or expired search job: " + str(job_id))
+        return job
+
+    @classmethod
+    def cancel(cls, job_id):
+        """Stop a queued or running job, keeping the matches found so far. :return: SearchJob()"""
+        job = cls.get(job_id)
+        job.cancel_event.set()
+        return job
+
+    @classmethod
+    def shutdown(cls):
+        """Cancel every job and stop the job threads, used at application shutdown"""
+        with cls.__lock:
+            executor, cls.__executor = cls.__executor, None
+            for job in cls.__jobs.values():
+                job.cancel_event.set()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    @classmethod
+    def __expire(cls, room=0):
+        """
+        Drop finished jobs past their TTL, then the oldest finished jobs until room more jobs fit in max jobs.
+        Caller must hold the lock
+        """
+        now = time.monotonic()
+        ttl = cls.__config(cls.config_ttl_key, cls.default_ttl)
+        max_jobs = cls.__config(cls.config_max_jobs_key, cls.default_max_jobs)
+        for job_id, job in list(cls.__jobs.items()):
+            if job.finished is not None and (now - job.finished > ttl or len(cls.__jobs) + room > max_jobs):
+                del cls.__jobs[job_id]
+
+    @classmethod
+    def __config(cls, key, default):
+        config = (ConnectionConfig.connection_details or {}).get(cls.config_search_jobs_key) or {}
+        return int(config.get(key, default))
+
+
+class SearchJob:
+    """A background search: its params, state, per topic progress and matches found so far"""
+    # Status keys and states
+    job_id_key = constants.JOB_ID_KEY
+    job_state_key = constants.JOB_STATE_KEY
+    job_submitted_key = constants.JOB_SUBMITTED_KEY
+    job_seconds_key = constants.JOB_SECONDS_KEY
+    job_deadline_seconds_key = constants.JOB_DEADLINE_SECONDS_KEY
+    job_topics_key = constants.JOB_TOPICS_KEY
+    job_error_key = constants.JOB_ERROR_KEY
+    summary_matches_key = constants.SUMMARY_MATCHES_KEY
+    state_queued = constants.JOB_STATE_QUEUED
+    state_running = constants.JOB_STATE_RUNNING
+    state_completed = constants.JOB_STATE_COMPLETED
+    state_partial = constants.JOB_STATE_PARTIAL
+    state_cancelled = constants.JOB_STATE_CANCELLED
+    state_failed = constants.JOB_STATE_FAILED
+
+    # Response keys
+    response_error_key = constants.RESPONSE_ERROR_KEY
+    response_job_key = constants.RESPONSE_JOB_KEY
+
+    def __init__(self, params, topic_searches, deadline):
+        self.job_id = uuid.uuid4().hex
+        self.params = params
+        self.submitted = time.monotonic()
+        self.deadline = deadline
+        self.cancel_event = threading.Event()
+        self.state = self.state_queued
+        self.error = None
+        self.submitted_at = datetime.now(timezone.utc)
+        # time.monotonic() values, None until the job started/finished
+        self.started = None
+        self.finished = None
+        # response key -> JobTopic()
+        self.topics = OrderedDict((response_key, JobTopic(topic_name, message_type))
+                                  for response_key, topic_name, message_type in topic_searches)
+
+    def run(self, run):
+        """Runs on a job thread. :param run: callable(SearchJob())"""
+        if self.cancel_event.is_set():
+            self.__finish(self.state_cancelled)
+            return
+        self.started = time.monotonic()
+        self.state = self.state_running
+        try:
+            run(self)
+        except Exception as e:
+            self.error = "Error running search job. " + str(e)
+            self.__finish(self.state_failed)
+            return
+        if all(job_topic.complete for job_topic in self.topics.values()):
+            self.__finish(self.state_completed)
+        else:
+            # Cancelled, or deadline reached, before every topic was scanned completely
+            self.__finish(self.state_cancelled if self.cancel_event.is_set() else self.state_partial)
+
+    def __finish(self, state):
+        self.state = state
+        self.finished = time.monotonic()
+
+    def status(self):
+        """:return: dict() state, timing and progress of every topic"""
+        end = self.finished if self.finished is not None else time.monotonic()
+        status = {self.job_id_key: self.job_id,
+                  self.job_state_key: self.state,
+                  self.job_submitted_key: self.submitted_at.isoformat(),
+                  self.job_seconds_key: end - self.submitted,
+                  self.job_deadline_seconds_key: round(self.deadline - self.submitted, 3) if self.deadline is not None
+                  else None,
+                  self.summary_matches_key: sum(job_topic.match_count() for job_topic in self.topics.values()),
+                  self.job_topics_key: OrderedDict((response_key, job_topic.progress())
+                                                   for response_key, job_topic in self.topics.items())}
+        if self.error:
+            status[self.job_error_key] = self.error
+        return status
+
+    def results(self):
+        """:return: dict() matches found so far, in the format of /search responses, with the job status"""
+        response = OrderedDict()
+        for response_key, job_topic in self.topics.items():
+            response[response_key] = job_topic.results(self.params)
+            if job_topic.close_error:
+                response[self.response_error_key] = job_topic.close_error
+        response[self.response_job_key] = self.status()
+        return response
+
+
+class JobTopic:
+    """Progress and matches of a single topic of a search job"""
+    summary_topic_key = constants.STREAM_TOPIC_KEY
+    summary_matches_key = constants.SUMMARY_MATCHES_KEY
+    job_state_key = constants.JOB_STATE_KEY
+    job_error_key = constants.JOB_ERROR_KEY
+    state_queued = constants.JOB_STATE_QUEUED
+    state_running = constants.JOB_STATE_RUNNING
+    state_completed = constants.JOB_STATE_COMPLETED
+    state_partial = constants.JOB_STATE_PARTIAL
+    state_failed = constants.JOB_STATE_FAILED
+
+    def __init__(self, topic_name, message_type):
+        self.topic_name = topic_name
+        self.message_type = message_type
+        self.state = self.state_queued
+        # KafkaReader() scanning the topic, set once started
+        self.kafka_reader = None
+        # Error message replacing the topic's results, connection close error
+        self.error = None
+        self.close_error = None
+        # partition id -> list() of tuple() (message timestamp, parsed message), in scan order
+        self.found_msgs = defaultdict(list)
+        self.lock = threading.Lock()
+
+    @property
+    def complete(self):
+        scan_stats = self.kafka_reader.scan_stats if self.kafka_reader is not None else None
+        return self.error is not None or (scan_stats is not None and scan_stats.complete)
+
+    def start(self, kafka_reader):
+        self.kafka_reader = kafka_reader
+        self.state = self.state_running
+
+    def add_match(self, msg, parsed_msg):
+        """on_match callback of the topic's scan"""
+        with self.lock:
+            self.found_msgs[msg.partition()].append((msg.timestamp()[1], parsed_msg))
+
+    def finish(self, error=None):
+        if error is not None:
+            self.error = error
+            self.state = self.state_failed
+        else:
+            self.state = self.state_completed if self.complete else self.state_partial
+
+    def match_count(self):
+        with self.lock:
+            return sum(len(msgs) for msgs in self.found_msgs.values())
+
+    def progress(self):
+        """:return: dict() state, matches so far and scan progress (partitions done, messages scanned vs offsets)"""
+        scan_stats = self.kafka_reader.scan_stats if self.kafka_reader is not None else None
+        progress = {self.summary_topic_key: self.topic_name,
+                    self.job_state_key: self.state,
+                    self.summary_matches_key: self.match_count()}
+        if scan_stats is not None:
+            progress.update(scan_stats.progress())
+        if self.error:
+            progress[self.job_error_key] = self.error
+        return progress
+
+    def results(self, params):
+        """:return: list() of matches so far in response order, or the topic's error message"""
+        if self.error:
+            return self.error
+        if self.kafka_reader is None:
+            return []
+        with self.lock:
+            found_msgs = {partition_id: list(msgs) for partition_id, msgs in self.found_msgs.items()}
+        return self.kafka_reader.build_results(params, found_msgs)
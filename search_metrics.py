@@ -0,0 +1,340 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import constants
+import default_constants
+
+
+class ScanStats:
+    """
+    Counters and timers of a single topic scan (kafka_client.TopicScan()). Partition counters are only updated by
+    the thread scanning the partition, topic wide timers may be updated from several partition workers.
+    """
+    # Topic wide phases: topic metadata lookup (list_topics), consumer acquisition, watermark and time index lookups,
+    # partition workers held back by the environment's bytes per second budget (search_admission.py)
+    phase_metadata = constants.STATS_PHASE_METADATA
+    phase_connect = constants.STATS_PHASE_CONNECT
+    phase_offsets = constants.STATS_PHASE_OFFSETS
+    phase_throttle = constants.STATS_PHASE_THROTTLE
+
+    # Stats keys
+    stats_partition_key = constants.SUMMARY_PARTITION_KEY
+    stats_partitions_key = constants.SUMMARY_PARTITIONS_KEY
+    stats_scanned_key = constants.SUMMARY_SCANNED_KEY
+    stats_matches_key = constants.SUMMARY_MATCHES_KEY
+    stats_bytes_key = constants.STATS_BYTES_KEY
+    stats_prefiltered_key = constants.STATS_PREFILTERED_KEY
+    stats_decode_errors_key = constants.STATS_DECODE_ERRORS_KEY
+    stats_seconds_key = constants.STATS_SECONDS_KEY
+    stats_phases_key = constants.STATS_PHASES_KEY
+    stats_complete_key = constants.SUMMARY_COMPLETE_KEY
+    stats_partitions_done_key = constants.STATS_PARTITIONS_DONE_KEY
+    stats_offsets_key = constants.STATS_OFFSETS_KEY
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # Wall clock seconds of the whole scan, set by finish()
+        self.seconds = None
+        # False if the scan was interrupted (stop event or deadline) before reading every partition completely
+        self.complete = True
+        # phase -> cumulative seconds, summed over partition workers
+        self.phase_seconds = {self.phase_metadata: 0.0, self.phase_connect: 0.0, self.phase_offsets: 0.0,
+                              self.phase_throttle: 0.0}
+        # partition id -> PartitionStats()
+        self.partitions = {}
+        self.__lock = threading.Lock()
+
+    def partition(self, partition_id):
+        """:return: PartitionStats() of partition, created on first use"""
+        partition_stats = self.partitions.get(partition_id)
+        if partition_stats is None:
+            with self.__lock:
+                partition_stats = self.partitions.setdefault(partition_id, PartitionStats(partition_id))
+        return partition_stats
+
+    def set_offset_bounds(self, offset_bounds):
+        """:param offset_bounds: dict() partition id -> tuple() (start offset or None, exclusive stop offset)"""
+        for partition_id, (start_offset, stop_offset) in offset_bounds.items():
+            self.partition(partition_id).offsets = stop_offset - start_offset if start_offset is not None else 0
+
+    def add_time(self, phase, seconds):
+        with self.__lock:
+            self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        """Add the time spent in the with block to phase"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - started)
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+
+    def totals(self):
+        """:return: dict() counters summed over partitions and seconds per phase, partition phases included"""
+        partitions = sorted(self.partitions.values(), key=lambda partition_stats: partition_stats.partition_id)
+        with self.__lock:
+            phases = dict(self.phase_seconds)
+        for phase in PartitionStats.phases:
+            phases[phase] = sum(partition_stats.phase_seconds(phase) for partition_stats in partitions)
+        return {self.stats_scanned_key: sum(partition_stats.scanned for partition_stats in partitions),
+                self.stats_bytes_key: sum(partition_stats.bytes for partition_stats in partitions),
+                self.stats_matches_key: sum(partition_stats.matches for partition_stats in partitions),
+                self.stats_prefiltered_key: sum(partition_stats.prefiltered for partition_stats in partitions),
+                self.stats_decode_errors_key: sum(partition_stats.decode_errors for partition_stats in partitions),
+                self.stats_phases_key: phases}
+
+    def progress(self):
+        """
+        :return: dict() partitions, partitions done, messages scanned and offsets to scan (between the offset bounds
+                 of every partition, once resolved), read while the scan is running
+        """
+        partitions = list(self.partitions.values())
+        return {self.stats_partitions_key: len(partitions),
+                self.stats_partitions_done_key: sum(1 for partition_stats in partitions if partition_stats.done),
+                self.stats_scanned_key: sum(partition_stats.scanned for partition_stats in partitions),
+                self.stats_offsets_key: sum(partition_stats.offsets for partition_stats in partitions)}
+
+    def summary(self):
+        """:return: dict() totals, wall clock seconds and per partition stats, for the response stats block"""
+        partitions = sorted(self.partitions.values(), key=lambda partition_stats: partition_stats.partition_id)
+        return {**self.totals(),
+                self.stats_seconds_key: self.seconds,
+                self.stats_complete_key: self.complete,
+                self.stats_partitions_key: [partition_stats.summary() for partition_stats in partitions]}
+
+
+class PartitionStats:
+    """Counters and timers of a single partition scan"""
+    # Partition phases: consume() calls returning messages, empty consume() calls waiting for messages, decoding and
+    # matching of messages passing the prefilter
+    phase_fetch = constants.STATS_PHASE_FETCH
+    phase_idle = constants.STATS_PHASE_IDLE
+    phase_decode = constants.STATS_PHASE_DECODE
+    phases = (phase_fetch, phase_idle, phase_decode)
+
+    __slots__ = ('partition_id', 'offsets', 'done', 'scanned', 'bytes', 'matches', 'prefiltered', 'decode_errors',
+                 'fetch_seconds', 'idle_seconds', 'decode_seconds')
+
+    def __init__(self, partition_id):
+        self.partition_id = partition_id
+        # Offsets between the partition's offset bounds, set once resolved
+        self.offsets = 0
+        self.done = False
+        self.scanned = 0
+        self.bytes = 0
+        self.matches = 0
+        # Messages skipped by the raw prefilter, without decoding
+        self.prefiltered = 0
+        # Malformed messages skipped
+        self.decode_errors = 0
+        self.fetch_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.decode_seconds = 0.0
+
+    def phase_seconds(self, phase):
+        if phase == self.phase_fetch:
+            return self.fetch_seconds
+        if phase == self.phase_idle:
+            return self.idle_seconds
+        return self.decode_seconds
+
+    def add_work(self, other):
+        """Add the decode errors and phase times of other, a chunk read for a shared scan, to this partition"""
+        self.decode_errors += other.decode_errors
+        self.fetch_seconds += other.fetch_seconds
+        self.idle_seconds += other.idle_seconds
+        self.decode_seconds += other.decode_seconds
+
+    def summary(self):
+        return {ScanStats.stats_partition_key: self.partition_id,
+                ScanStats.stats_scanned_key: self.scanned,
+                ScanStats.stats_bytes_key: self.bytes,
+                ScanStats.stats_matches_key: self.matches,
+                ScanStats.stats_prefiltered_key: self.prefiltered,
+                ScanStats.stats_decode_errors_key: self.decode_errors,
+                ScanStats.stats_phases_key: {phase: self.phase_seconds(phase) for phase in self.phases}}
+
+
+class SearchMetrics:
+    """
+    Process wide search metrics, rendered in the Prometheus text exposition format by /metrics. Topic scan counters
+    are labelled by environment and topic, request metrics by endpoint. Every process of a multi worker deployment
+    keeps its own metrics.
+    """
+    metric_prefix = constants.METRICS_PREFIX
+    duration_buckets = default_constants.DEFAULT_METRICS_DURATION_BUCKETS
+
+    # name -> tuple() (type, help)
+    metric_definitions = {
+        'requests_total': ('counter', 'Search requests handled, by endpoint and outcome'),
+        'request_duration_seconds': ('histogram', 'Time spent searching, by endpoint (response serialization '
+                                                  'excluded)'),
+        'jsonify_duration_seconds': ('histogram', 'Time spent serializing search responses, by endpoint'),
+        'topic_scans_total': ('counter', 'Topic scans, by environment, topic and outcome'),
+        'topic_scan_duration_seconds': ('histogram', 'Wall clock time of topic scans, by environment and topic'),
+        'messages_scanned_total': ('counter', 'Messages read from kafka or the segment cache'),
+        'bytes_scanned_total': ('counter', 'Message value bytes read from kafka or the segment cache'),
+        'matches_total': ('counter', 'Messages matching the search'),
+        'prefiltered_total': ('counter', 'Messages skipped by the raw prefilter without decoding'),
+        'decode_errors_total': ('counter', 'Malformed messages that could not be decoded, skipped'),
+        'scan_phase_seconds_total': ('counter', 'Time spent per scan phase, summed over partition workers'),
+        'searches_coalesced_total': ('counter', 'Search requests answered by an identical search already running, '
+                                                'by environment'),
+        'shared_scan_chunks_total': ('counter', 'Chunks read by shared partition scans, by environment and topic'),
+        'shared_scan_chunk_searches_total': ('counter', 'Searches served by the chunks read by shared partition '
+                                                        'scans, more than chunks read when scans are shared'),
+        'shared_scan_joins_total': ('counter', 'Searches joining a shared partition scan already running'),
+        'admission_queue_seconds': ('histogram', 'Time searches waited for admission to their environment'),
+        'admission_rejected_total': ('counter', 'Searches rejected by admission control, by environment and reason '
+                                                '(queue_full, queue_timeout)'),
+        'audit_log_dropped_total': ('counter', 'Request audit log records dropped, queue full or log file not '
+                                               'writable'),
+    }
+
+    # name -> dict() labels tuple() -> value, or list() of bucket counts, sum and count for histograms
+    __values = {name: {} for name in metric_definitions}
+    __lock = threading.Lock()
+
+    @classmethod
+    def record_scan(cls, environment, topic, stats, error=False):
+        """
+        Add a finished topic scan to the metrics
+        :param stats: ScanStats()
+        :param error: bool, scan raised an error
+        """
+        totals = stats.totals()
+        labels = (('environment', environment), ('topic', topic))
+        with cls.__lock:
+            cls.__increment('topic_scans_total', labels + (('outcome', 'error' if error else 'ok'),))
+            cls.__observe('topic_scan_duration_seconds', labels, stats.seconds or 0.0)
+            cls.__increment('messages_scanned_total', labels, totals[ScanStats.stats_scanned_key])
+            cls.__increment('bytes_scanned_total', labels, totals[ScanStats.stats_bytes_key])
+            cls.__increment('matches_total', labels, totals[ScanStats.stats_matches_key])
+            cls.__increment('prefiltered_total', labels, totals[ScanStats.stats_prefiltered_key])
+            cls.__increment('decode_errors_total', labels, totals[ScanStats.stats_decode_errors_key])
+            for phase, seconds in totals[ScanStats.stats_phases_key].items():
+                cls.__increment('scan_phase_seconds_total', labels + (('phase', phase),), seconds)
+
+    @classmethod
+    def scan_totals(cls, environment, topic):
+        """
+        Measured scan totals of a topic since the process started, used to estimate the cost of searches
+        :return: tuple() (messages scanned, bytes scanned, wall clock seconds of its scans)
+        """
+        labels = (('environment', environment), ('topic', topic))
+        with cls.__lock:
+            duration = cls.__values['topic_scan_duration_seconds'].get(labels)
+            return (cls.__values['messages_scanned_total'].get(labels, 0),
+                    cls.__values['bytes_scanned_total'].get(labels, 0),
+                    duration[1] if duration is not None else 0.0)
+
+    @classmethod
+    def record_request(cls, endpoint, seconds, jsonify_seconds=None, error=False):
+        """
+        :param endpoint: string, path of the endpoint
+        :param seconds: float, time spent searching
+        :param jsonify_seconds: optional float, time spent serializing the response
+        """
+        labels = (('endpoint', endpoint),)
+        with cls.__lock:
+            cls.__increment('requests_total', labels + (('outcome', 'error' if error else 'ok'),))
+            cls.__observe('request_duration_seconds', labels, seconds)
+            if jsonify_seconds is not None:
+                cls.__observe('jsonify_duration_seconds', labels, jsonify_seconds)
+
+    @classmethod
+    def record_coalesced(cls, environment):
+        """A search request joined the identical search already running (search_flights.py)"""
+        with cls.__lock:
+            cls.__increment('searches_coalesced_total', (('environment', environment),))
+
+    @classmethod
+    def record_shared_scan_chunk(cls, environment, topic, searches):
+        """:param searches: int, searches the chunk was read for (shared_scans.py)"""
+        labels = (('environment', environment), ('topic', topic))
+        with cls.__lock:
+            cls.__increment('shared_scan_chunks_total', labels)
+            cls.__increment('shared_scan_chunk_searches_total', labels, searches)
+
+    @classmethod
+    def record_shared_scan_join(cls, environment, topic):
+        with cls.__lock:
+            cls.__increment('shared_scan_joins_total', (('environment', environment), ('topic', topic)))
+
+    @classmethod
+    def record_admission(cls, environment, queued_seconds):
+        """:param queued_seconds: float, time the search waited for admission (search_admission.py)"""
+        with cls.__lock:
+            cls.__observe('admission_queue_seconds', (('environment', environment),), queued_seconds)
+
+    @classmethod
+    def record_admission_rejected(cls, environment, reason):
+        with cls.__lock:
+            cls.__increment('admission_rejected_total', (('environment', environment), ('reason', reason)))
+
+    @classmethod
+    def record_audit_log_dropped(cls, records):
+        """:param records: int, audit log records dropped (logger.py)"""
+        with cls.__lock:
+            cls.__increment('audit_log_dropped_total', (), records)
+
+    @classmethod
+    def render(cls):
+        """:return: string, all metrics in the Prometheus text exposition format"""
+        lines = []
+        with cls.__lock:
+            for name, (metric_type, help_text) in cls.metric_definitions.items():
+                full_name = cls.metric_prefix + name
+                lines.append('# HELP ' + full_name + ' ' + help_text)
+                lines.append('# TYPE ' + full_name + ' ' + metric_type)
+                for labels, value in sorted(cls.__values[name].items()):
+                    if metric_type != 'histogram':
+                        lines.append(full_name + cls.__format_labels(labels) + ' ' + cls.__format_value(value))
+                        continue
+                    bucket_counts, total, count = value
+                    for bound, bucket_count in zip(cls.duration_buckets, bucket_counts):
+                        lines.append(full_name + '_bucket' + cls.__format_labels(labels + (('le', repr(bound)),)) +
+                                     ' ' + str(bucket_count))
+                    lines.append(full_name + '_bucket' + cls.__format_labels(labels + (('le', '+Inf'),)) + ' ' +
+                                 str(count))
+                    lines.append(full_name + '_sum' + cls.__format_labels(labels) + ' ' + cls.__format_value(total))
+                    lines.append(full_name + '_count' + cls.__format_labels(labels) + ' ' + str(count))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def clear(cls):
+        with cls.__lock:
+            for values in cls.__values.values():
+                values.clear()
+
+    @classmethod
+    def __increment(cls, name, labels, amount=1):
+        """Caller must hold the lock"""
+        values = cls.__values[name]
+        values[labels] = values.get(labels, 0) + amount
+
+    @classmethod
+    def __observe(cls, name, labels, seconds):
+        """Add an observation to a histogram (cumulative bucket counts, sum, count). Caller must hold the lock"""
+        value = cls.__values[name].setdefault(labels, [[0] * len(cls.duration_buckets), 0.0, 0])
+        for index, bound in enumerate(cls.duration_buckets):
+            if seconds <= bound:
+                value[0][index] += 1
+        value[1] += seconds
+        value[2] += 1
+
+    @staticmethod
+    def __format_labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                              + '"' for name, value in labels) + '}'
+
+    @staticmethod
+    def __format_value(value):
+        return repr(float(value)) if isinstance(value, float) else str(value)
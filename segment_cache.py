@@ -0,0 +1,347 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+import constants
+import default_constants
+from config_handler import ConnectionConfig
+from error_handler import CorruptSegment, ErrorHandler
+
+
+class CachedMessage:
+    """Message read from the segment cache. Exposes the confluent_kafka.Message() accessors used by the parsers"""
+    __slots__ = ('_topic', '_partition', '_offset', '_timestamp', '_key', '_value')
+
+    def __init__(self, topic, partition, offset, timestamp, key, value):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._timestamp = timestamp
+        self._key = key
+        self._value = value
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def timestamp(self):
+        return self._timestamp
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def headers(self):
+        return None
+
+    def error(self):
+        return None
+
+    def __len__(self):
+        return len(self._value) if self._value is not None else 0
+
+
+class Segment:
+    """
+    Cache file holding every record of a partition between base offset and (exclusive) end offset.
+    Record layout: offset, timestamp type, timestamp, key length, value length (-1 for None), key, value.
+    Sealed files end with a trailer (magic, number of records), files without it were truncated.
+    """
+    record_header = struct.Struct('>qbqii')
+    trailer = struct.Struct('>4sq')
+    trailer_magic = b'KBS1'
+
+    def __init__(self, path, base_offset, end_offset, size):
+        self.path = path
+        self.base_offset = base_offset
+        self.end_offset = end_offset
+        self.size = size
+        self.last_used = time.monotonic()
+
+    def read(self, topic, partition, start_offset, stop_offset):
+        """
+        Generator of CachedMessage() between start offset and exclusive stop offset, read through a memory map.
+        Raises CorruptSegment once the file turns out to be damaged, the records read until then are valid.
+        """
+        self.last_used = time.monotonic()
+        if self.size < self.trailer.size:
+            raise CorruptSegment("Truncated segment: " + self.path)
+        with open(self.path, 'rb') as segment_file, \
+                mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as segment_map:
+            if len(segment_map) != self.size:
+                raise CorruptSegment("Segment changed size: " + self.path)
+            records_size = self.size - self.trailer.size
+            magic, record_count = self.trailer.unpack_from(segment_map, records_size)
+            if magic != self.trailer_magic:
+                raise CorruptSegment("Truncated segment: " + self.path)
+            position = 0
+            records = 0
+            while position < records_size:
+                if position + self.record_header.size > records_size:
+                    raise CorruptSegment("Corrupt record at byte " + str(position) + " of segment: " + self.path)
+                offset, timestamp_type, timestamp, key_length, value_length = self.record_header.unpack_from(
+                    segment_map, position)
+                position += self.record_header.size
+                if position + max(key_length, 0) + max(value_length, 0) > records_size or \
+                        not self.base_offset <= offset < self.end_offset:
+                    raise CorruptSegment("Corrupt record at byte " + str(position) + " of segment: " + self.path)
+                records += 1
+                key = None
+                if key_length >= 0:
+                    key = segment_map[position:position + key_length]
+                    position += key_length
+                value = None
+                if value_length >= 0:
+                    value = segment_map[position:position + value_length]
+                    position += value_length
+                if offset >= stop_offset:
+                    return
+                if offset >= start_offset:
+                    yield CachedMessage(topic, partition, offset, (timestamp_type, timestamp), key, value)
+            if records != record_count:
+                raise CorruptSegment("Segment holds " + str(records) + " records instead of " + str(record_count) +
+                                     ": " + self.path)
+
+
+class SegmentWriter:
+    """Writes records fetched from the broker into a new segment, sealed into the cache by SegmentCache.seal()"""
+
+    def __init__(self, partition_key, directory, base_offset):
+        self.partition_key = partition_key
+        self.directory = directory
+        self.base_offset = base_offset
+        self.path = os.path.join(directory, str(base_offset) + '.tmp')
+        self.file = open(self.path, 'wb')
+        self.size = 0
+        self.records = 0
+
+    def append(self, msg):
+        key = msg.key()
+        value = msg.value()
+        timestamp_type, timestamp = msg.timestamp()
+        record = Segment.record_header.pack(msg.offset(), timestamp_type, timestamp,
+                                            -1 if key is None else len(key), -1 if value is None else len(value))
+        self.file.write(record)
+        if key is not None:
+            self.file.write(key)
+        if value is not None:
+            self.file.write(value)
+        self.size += len(record) + (len(key) if key else 0) + (len(value) if value else 0)
+        self.records += 1
+
+    def discard(self):
+        self.file.close()
+        SegmentCache.remove_file(self.path)
+
+
+class SegmentCache:
+    """
+    Optional on-disk cache of raw message records, keyed by environment/topic/partition and offset range.
+    Enabled with the 'segment.cache' section of main config. Scans read cached offset ranges locally and only fetch
+    the offsets that are not cached (typically those beyond the cached high mark) from the broker. Total size is
+    bounded by 'max.bytes', least recently used segments are evicted first. Segments below a partition's low
+    watermark (deleted by retention) are dropped, and a partition whose high watermark moved backwards (topic
+    recreated) is dropped entirely. Not intended for compacted topics, cached records are not compacted.
+    """
+    # Main config keys ('segment.cache' section)
+    config_segment_cache_key = constants.CONFIG_SEGMENT_CACHE_KEY
+    config_enabled_key = constants.CONFIG_SEGMENT_CACHE_ENABLED_KEY
+    config_directory_key = constants.CONFIG_SEGMENT_CACHE_DIRECTORY_KEY
+    config_max_bytes_key = constants.CONFIG_SEGMENT_CACHE_MAX_BYTES_KEY
+    config_topics_key = constants.CONFIG_SEGMENT_CACHE_TOPICS_KEY
+    default_enabled = default_constants.DEFAULT_SEGMENT_CACHE_ENABLED
+    default_directory = default_constants.DEFAULT_SEGMENT_CACHE_DIRECTORY
+    default_max_bytes = default_constants.DEFAULT_SEGMENT_CACHE_MAX_BYTES
+
+    # (environment, topic, partition) -> list() of Segment(), sorted by base offset
+    __segments = {}
+    __lock = threading.Lock()
+
+    @classmethod
+    def enabled_for(cls, environment, topic):
+        config = cls.__config()
+        if str(config.get(cls.config_enabled_key, cls.default_enabled)).lower() != 'true':
+            return False
+        topics = config.get(cls.config_topics_key)
+        return not topics or topic in topics
+
+    @classmethod
+    def trim(cls, environment, topic, partition, low_watermark, high_watermark):
+        """Drop cached segments no longer present on the broker"""
+        partition_key = (environment, topic, partition)
+        with cls.__lock:
+            segments = cls.__load_partition(partition_key)
+            if segments and segments[-1].end_offset > high_watermark:
+                # Offsets beyond the broker's high watermark, topic was recreated
+                dropped, segments[:] = list(segments), []
+            else:
+                dropped = [segment for segment in segments if segment.end_offset <= low_watermark]
+                segments[:] = [segment for segment in segments if segment.end_offset > low_watermark]
+        for segment in dropped:
+            cls.remove_file(segment.path)
+
+    @classmethod
+    def plan(cls, environment, topic, partition, start_offset, stop_offset):
+        """
+        Split an offset range into cached and uncached pieces.
+        :return: list() of tuple() (start offset, exclusive stop offset, Segment() or None if not cached)
+        """
+        with cls.__lock:
+            segments = list(cls.__load_partition((environment, topic, partition)))
+        pieces = []
+        position = start_offset
+        for segment in segments:
+            if segment.end_offset <= position or position >= stop_offset:
+                continue
+            if segment.base_offset >= stop_offset:
+                break
+            if segment.base_offset > position:
+                pieces.append((position, segment.base_offset, None))
+                position = segment.base_offset
+            piece_stop = min(segment.end_offset, stop_offset)
+            pieces.append((position, piece_stop, segment))
+            position = piece_stop
+        if position < stop_offset:
+            pieces.append((position, stop_offset, None))
+        return pieces
+
+    @classmethod
+    def open_writer(cls, environment, topic, partition, base_offset):
+        """:return: SegmentWriter(), None if the cache directory cannot be written"""
+        directory = os.path.join(cls.__config().get(cls.config_directory_key, cls.default_directory),
+                                 environment, topic, str(partition))
+        # Loading the partition removes unsealed segments, it must not see the file written below
+        with cls.__lock:
+            cls.__load_partition((environment, topic, partition))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            return SegmentWriter((environment, topic, partition), directory, base_offset)
+        except OSError:
+            return None
+
+    @classmethod
+    def seal(cls, writer, end_offset):
+        """
+        Add a written segment to the cache. Discarded if empty, or if another scan cached an overlapping range
+        in the meantime.
+        """
+        try:
+            writer.file.write(Segment.trailer.pack(Segment.trailer_magic, writer.records))
+            writer.size += Segment.trailer.size
+        finally:
+            writer.file.close()
+        if end_offset <= writer.base_offset:
+            cls.remove_file(writer.path)
+            return
+        path = os.path.join(writer.directory, str(writer.base_offset) + '-' + str(end_offset) + '.seg')
+        segment = Segment(path, writer.base_offset, end_offset, writer.size)
+        with cls.__lock:
+            segments = cls.__load_partition(writer.partition_key)
+            if any(existing.base_offset < end_offset and writer.base_offset < existing.end_offset
+                   for existing in segments):
+                overlaps = True
+            else:
+                overlaps = False
+                try:
+                    os.replace(writer.path, path)
+                except OSError:
+                    overlaps = True
+                else:
+                    segments.append(segment)
+                    segments.sort(key=lambda cached: cached.base_offset)
+        if overlaps:
+            cls.remove_file(writer.path)
+        cls.__evict()
+
+    @classmethod
+    def drop(cls, segment):
+        """Remove a damaged segment, its offsets are fetched from the broker again"""
+        with cls.__lock:
+            for partition_segments in cls.__segments.values():
+                if segment in partition_segments:
+                    partition_segments.remove(segment)
+        cls.remove_file(segment.path)
+
+    @classmethod
+    def clear(cls):
+        """Drop every cached segment"""
+        with cls.__lock:
+            segments = [segment for partition_segments in cls.__segments.values() for segment in partition_segments]
+            cls.__segments.clear()
+        for segment in segments:
+            cls.remove_file(segment.path)
+
+    @staticmethod
+    def remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            # File may still be mapped by a running scan (windows), it is removed on the next cache load
+            pass
+
+    @classmethod
+    def __evict(cls):
+        """Remove least recently used segments until the cache fits in max bytes"""
+        max_bytes = int(cls.__config().get(cls.config_max_bytes_key, cls.default_max_bytes))
+        evicted = []
+        with cls.__lock:
+            segments = [segment for partition_segments in cls.__segments.values() for segment in partition_segments]
+            total_bytes = sum(segment.size for segment in segments)
+            for segment in sorted(segments, key=lambda cached: cached.last_used):
+                if total_bytes <= max_bytes:
+                    break
+                total_bytes -= segment.size
+                evicted.append(segment)
+            for partition_segments in cls.__segments.values():
+                partition_segments[:] = [segment for segment in partition_segments if segment not in evicted]
+        for segment in evicted:
+            cls.remove_file(segment.path)
+
+    @classmethod
+    def __load_partition(cls, partition_key):
+        """Segments of a partition, loaded from the cache directory on first use. Caller must hold the lock"""
+        if partition_key in cls.__segments:
+            return cls.__segments[partition_key]
+        environment, topic, partition = partition_key
+        directory = os.path.join(cls.__config().get(cls.config_directory_key, cls.default_directory),
+                                 environment, topic, str(partition))
+        segments = []
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                path = os.path.join(directory, filename)
+                name, extension = os.path.splitext(filename)
+                try:
+                    if extension != '.seg':
+                        # Unsealed segment of an interrupted scan
+                        os.remove(path)
+                        continue
+                    base_offset, end_offset = (int(offset) for offset in name.split('-'))
+                    segments.append(Segment(path, base_offset, end_offset, os.path.getsize(path)))
+                except (OSError, ValueError):
+                    continue
+        segments.sort(key=lambda cached: cached.base_offset)
+        # Overlapping segments can only be left behind by a failed eviction, keep the first of each overlap
+        non_overlapping = []
+        for segment in segments:
+            if non_overlapping and segment.base_offset < non_overlapping[-1].end_offset:
+                cls.remove_file(segment.path)
+                continue
+            non_overlapping.append(segment)
+        cls.__segments[partition_key] = non_overlapping
+        return non_overlapping
+
+    @classmethod
+    def __config(cls):
+        config = (ConnectionConfig.connection_details or {}).get(cls.config_segment_cache_key) or {}
+        if not isinstance(config, dict):
+            raise ErrorHandler("Invalid '" + cls.config_segment_cache_key + "' section in main config file")
+        return config
@@ -0,0 +1,186 @@
+import threading
+
+import constants
+import default_constants
+from config_handler import ConnectionConfig
+from search_metrics import SearchMetrics
+
+
+class SharedScans:
+    """
+    Shared partition scans. Concurrent searches of the same partition (environment, topic, message type) are
+    served by a single pass over it: one of the searches drives the pass, reading the partition in chunks on its
+    own consumer, and every message read is decoded once and evaluated against each search attached to the chunk.
+    Searches arriving while a chunk is read join from the next chunk on and wrap around, the offsets they missed
+    are read once the pass reaches the end of their range. When the driving search has read its own range it hands
+    the pass over to one of the searches still waiting, so no thread or consumer is added.
+    Matches are delivered to each search in offset order once its whole range has been read (or its scan was
+    interrupted, with the matches found so far).
+    Searches with a match limit (search_count, pageSize), newest first, key lookups (single partition, mostly
+    skipped without decoding) and token indexed topics are not shared.
+    """
+    # Main config keys ('shared.scans' section)
+    config_shared_scans_key = constants.CONFIG_SHARED_SCANS_KEY
+    config_enabled_key = constants.CONFIG_SHARED_SCANS_ENABLED_KEY
+    config_chunk_size_key = constants.CONFIG_SHARED_SCANS_CHUNK_SIZE_KEY
+    default_enabled = default_constants.DEFAULT_SHARED_SCANS_ENABLED
+    default_chunk_size = default_constants.DEFAULT_SHARED_SCANS_CHUNK_SIZE
+    # Waiting searches check whether their scan was interrupted this often
+    wait_seconds = .1
+
+    # (environment, topic, message type, partition id) -> SharedPartition()
+    __partitions = {}
+    __lock = threading.Lock()
+
+    @classmethod
+    def enabled_for(cls, scan):
+        """:param scan: kafka_client.TopicScan(), True if its partitions may be read by shared scans"""
+        config = (ConnectionConfig.connection_details or {}).get(cls.config_shared_scans_key) or {}
+        if str(config.get(cls.config_enabled_key, cls.default_enabled)).lower() != 'true':
+            return False
+        return scan.limit is None and not scan.newest_first and scan.token_index is None and scan.message_key is None
+
+    @classmethod
+    def read(cls, environment, scan, partition_id, start_offset, stop_offset, on_match, read_chunk):
+        """
+        Read a partition range of scan through the partition's shared scan, blocks until the range has been read
+        or the scan is interrupted.
+        :param scan: kafka_client.TopicScan()
+        :param start_offset: int, first offset to read
+        :param stop_offset: int, exclusive stop offset
+        :param on_match: callable(confluent_kafka.Message(), parsed message), called on this thread
+        :param read_chunk: callable(chunk start, chunk stop, list() of SharedRequest()), reads a chunk on the
+                           caller's consumer, evaluating every message against the requests. Returns the offset
+                           the chunk was read up to (exclusive)
+        :return: tuple() (messages scanned, bytes scanned) for scan
+        """
+        key = (environment, scan.topic, scan.message_type, partition_id)
+        request = SharedRequest(scan, start_offset, stop_offset)
+        with cls.__lock:
+            partition = cls.__partitions.get(key)
+            if partition is None:
+                partition = cls.__partitions[key] = SharedPartition()
+            partition.requests.append(request)
+            shared = len(partition.requests) > 1
+        if shared:
+            SearchMetrics.record_shared_scan_join(environment, scan.topic)
+
+        try:
+            cls.__drive(partition, request, read_chunk, environment, scan.topic)
+        finally:
+            with cls.__lock:
+                partition.requests.remove(request)
+                if not partition.requests:
+                    del cls.__partitions[key]
+            with partition.condition:
+                partition.condition.notify_all()
+
+        for offset, msg, parsed_msg in sorted(request.matches, key=lambda match: match[0]):
+            on_match(msg, parsed_msg)
+        return request.scanned, request.bytes
+
+    @classmethod
+    def __drive(cls, partition, request, read_chunk, environment, topic):
+        """Wait for the driving search, or drive the pass, until request's range has been read"""
+        chunk_size = cls.__chunk_size()
+        while True:
+            with partition.condition:
+                while partition.driving and request.remaining and not request.scan.interrupted():
+                    partition.condition.wait(cls.wait_seconds)
+                if not request.remaining or request.scan.interrupted():
+                    return
+                partition.driving = True
+                chunk_start, chunk_stop = partition.next_chunk(request, chunk_size)
+                with cls.__lock:
+                    chunk_requests = [chunk_request for chunk_request in partition.requests
+                                      if chunk_request.attach(chunk_start, chunk_stop)]
+            read_to = chunk_start
+            try:
+                read_to = read_chunk(chunk_start, chunk_stop, chunk_requests)
+            finally:
+                with partition.condition:
+                    for chunk_request in chunk_requests:
+                        chunk_request.cover(chunk_start, read_to)
+                    partition.position = read_to
+                    partition.driving = False
+                    partition.condition.notify_all()
+            SearchMetrics.record_shared_scan_chunk(environment, topic, len(chunk_requests))
+
+    @classmethod
+    def __chunk_size(cls):
+        config = (ConnectionConfig.connection_details or {}).get(cls.config_shared_scans_key) or {}
+        return max(1, int(config.get(cls.config_chunk_size_key, cls.default_chunk_size)))
+
+
+class SharedPartition:
+    """Pass over a single partition shared by the searches attached to it"""
+
+    def __init__(self):
+        # SharedRequest() of every search reading the partition, changed under SharedScans lock
+        self.requests = []
+        self.condition = threading.Condition()
+        # A search is reading a chunk, and offset the last chunk was read up to
+        self.driving = False
+        self.position = 0
+
+    def next_chunk(self, request, chunk_size):
+        """
+        Next chunk read by the driving search, within its own remaining range: continuing from where the last
+        chunk ended, wrapping around to the start of its remaining range once past the end.
+        :return: tuple() (chunk start, exclusive chunk stop)
+        """
+        for start_offset, stop_offset in request.remaining:
+            if stop_offset > self.position:
+                chunk_start = max(start_offset, self.position)
+                return chunk_start, min(stop_offset, chunk_start + chunk_size)
+        start_offset, stop_offset = request.remaining[0]
+        return start_offset, min(stop_offset, start_offset + chunk_size)
+
+
+class SharedRequest:
+    """A search's range of a shared partition scan, offsets still to read and matches found"""
+    __slots__ = ('scan', 'remaining', 'chunk_ranges', 'matches', 'scanned', 'bytes')
+
+    def __init__(self, scan, start_offset, stop_offset):
+        self.scan = scan
+        # list() of tuple() (start offset, exclusive stop offset) still to read, ascending
+        self.remaining = [(start_offset, stop_offset)] if start_offset < stop_offset else []
+        # Part of the remaining ranges within the chunk being read
+        self.chunk_ranges = []
+        # list() of tuple() (offset, message, parsed message), appended by the driving search
+        self.matches = []
+        self.scanned = 0
+        self.bytes = 0
+
+    def attach(self, chunk_start, chunk_stop):
+        """Prepare for a chunk, False if none of the chunk's offsets remain to be read"""
+        self.chunk_ranges = [(max(start_offset, chunk_start), min(stop_offset, chunk_stop))
+                             for start_offset, stop_offset in self.remaining
+                             if start_offset < chunk_stop and stop_offset > chunk_start]
+        return bool(self.chunk_ranges)
+
+    def wants(self, offset):
+        """True if offset is part of the chunk being read and remains to be read by this search"""
+        for start_offset, stop_offset in self.chunk_ranges:
+            if start_offset <= offset < stop_offset:
+                return True
+        return False
+
+    def add_match(self, msg, parsed_msg):
+        self.matches.append((msg.offset(), msg, parsed_msg))
+
+    def cover(self, chunk_start, read_to):
+        """Remove the offsets read by a chunk from the remaining ranges"""
+        self.chunk_ranges = []
+        if read_to <= chunk_start:
+            return
+        remaining = []
+        for start_offset, stop_offset in self.remaining:
+            if stop_offset <= chunk_start or start_offset >= read_to:
+                remaining.append((start_offset, stop_offset))
+                continue
+            if start_offset < chunk_start:
+                remaining.append((start_offset, chunk_start))
+            if stop_offset > read_to:
+                remaining.append((read_to, stop_offset))
+        self.remaining = remaining
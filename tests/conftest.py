@@ -0,0 +1,146 @@
+"""
+Shared fixtures. Searches run end to end (flask view, RequestHandler, KafkaReader) against the in-process fake
+consumer and schema registry of benchmarks/fake_kafka.py, no kafka cluster needed.
+"""
+import json
+import os
+import random
+import sys
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+sys.path.insert(0, os.path.join(REPOSITORY_DIRECTORY, 'benchmarks'))
+
+import fake_kafka
+from config_handler import ConnectionConfig
+
+ENVIRONMENT = 'test'
+TOPIC = 'test-topic'
+
+# Main config of every search test, tests override sections with search_app.configure()
+BASE_CONFIG = {
+    'bootstrap.servers': {ENVIRONMENT: 'fake-broker:9092'},
+    'schema_registry_url': {ENVIRONMENT: 'https://fake-registry'},
+    'ssl': {ENVIRONMENT: {'ssl.key.location': 'fake.key', 'ssl.key.password': 'fake',
+                          'ssl.certificate.location': 'fake.crt', 'pfx_file': 'fake.pfx'}},
+    'ssl.ca.location': 'fake.cer',
+    'group.id': 'test',
+    'client.id': 'test',
+    'enable.auto.commit': 'False',
+    'session.timeout.ms': '6000',
+    'default.topic.config': {'auto.offset.reset': 'smallest'},
+    'security.protocol': 'SSL',
+    'api.version.request': 'True',
+    'enable.partition.eof': 'True',
+}
+
+
+class SearchApp:
+    """Flask test client of the application's view, searching topics generated with fake_kafka.FakeTopics"""
+    environment = ENVIRONMENT
+    topic = TOPIC
+    search_token = fake_kafka.FakeTopics.search_token
+
+    def __init__(self, work_directory):
+        from flask import Flask
+
+        import view
+
+        self.work_directory = work_directory
+        app = Flask(__name__)
+        app.register_blueprint(view.view)
+        self.client = app.test_client()
+        self.message_type = 'json'
+
+    def configure(self, **sections):
+        """Main config values on top of BASE_CONFIG, e.g. configure(**{'partition.workers': {'test': 4}})"""
+        ConnectionConfig.connection_details.update(sections)
+
+    def generate(self, message_type='json', partitions=4, messages=500, selectivity=.05, key_of=None, seed=0):
+        """
+        Generate the test topic
+        :param key_of: optional callable(offset in topic) -> bytes, re-keys every message and partitions it with
+                       the murmur2 partitioner of the Java client
+        """
+        from kafka_manager import ConsumerConnectionManager
+        from key_partitioner import KeyPartitioner
+
+        self.message_type = message_type
+        fake_kafka.FakeTopics.generate(self.topic, message_type, partitions, messages, 200, selectivity, seed)
+        if key_of is not None:
+            values = [msg for partition in fake_kafka.FakeTopics.topics[self.topic] for msg in partition]
+            keyed = [[] for _ in range(partitions)]
+            for index, (key, value, timestamp) in enumerate(values):
+                key = key_of(index)
+                keyed[(KeyPartitioner.murmur2(key) & 0x7fffffff) % partitions].append((key, value, timestamp))
+            fake_kafka.FakeTopics.topics[self.topic] = keyed
+        ConnectionConfig.avro_topics = {self.topic: fake_kafka.AVRO_SCHEMA_FILE} if message_type == 'avro' else {}
+        ConsumerConnectionManager.invalidate_metadata()
+
+    def produce(self, messages, selectivity=.1, seed=1):
+        """Append messages to every partition of the json test topic, with the ids and timestamps generate() uses"""
+        rng = random.Random(seed)
+        for partition_id, msgs in enumerate(fake_kafka.FakeTopics.topics[self.topic]):
+            for _ in range(messages):
+                offset = len(msgs)
+                body = {'id': 'msg-' + str(partition_id) + '-' + str(offset),
+                        'note': self.search_token if rng.random() < selectivity else 'alpha'}
+                msgs.append((body['id'].encode(), json.dumps(body).encode(),
+                             fake_kafka.FakeTopics.base_timestamp_ms + offset * 1000))
+
+    def search(self, endpoint='/search', **params):
+        """:return: dict() response of a search of the test topic"""
+        body = {'environment': self.environment, self.message_type + '_topics': [self.topic],
+                'searchParam': self.search_token}
+        body.update(params)
+        body = {key: value for key, value in body.items() if value is not None}
+        fake_kafka.FakeTopics.reset_counters()
+        return self.client.post(endpoint, json=body).get_json()
+
+    def matches(self, response):
+        """:return: list() of the matches of the test topic in response"""
+        matches = response[('JSON_TOPIC_' if self.message_type == 'json' else 'AVRO_TOPIC_') + self.topic]
+        assert isinstance(matches, list), matches
+        return matches
+
+    @staticmethod
+    def delivered_messages():
+        """:return: int, messages returned by the fake consumers since the last search started"""
+        return fake_kafka.FakeTopics.delivered_messages
+
+    @staticmethod
+    def all_messages():
+        """:return: list() of tuple() (partition id, offset, key, value, timestamp) of the test topic"""
+        return [(partition_id, offset, key, value, timestamp)
+                for partition_id, msgs in enumerate(fake_kafka.FakeTopics.topics[TOPIC])
+                for offset, (key, value, timestamp) in enumerate(msgs)]
+
+
+@pytest.fixture
+def search_app(tmp_path, monkeypatch):
+    from avro_client import AvroClient
+    from kafka_manager import ConsumerConnectionManager
+    from result_cache import ResultCache
+    from search_jobs import SearchJobs
+    from search_metrics import SearchMetrics
+    from segment_cache import SegmentCache
+    from token_index import TokenIndex
+
+    fake_kafka.install()
+    # Scan rates measured by earlier tests would change search estimates
+    SearchMetrics.clear()
+    monkeypatch.chdir(tmp_path)
+    fake_kafka.write_avro_schema(str(tmp_path))
+    monkeypatch.setattr(ConnectionConfig, 'connection_details', dict(BASE_CONFIG))
+    monkeypatch.setattr(ConnectionConfig, 'avro_topics', {})
+    monkeypatch.setattr(ConnectionConfig, 'logger_details', {})
+    yield SearchApp(str(tmp_path))
+    SearchJobs.shutdown()
+    TokenIndex.stop_indexers()
+    ConsumerConnectionManager.close_pools()
+    ConsumerConnectionManager.invalidate_metadata()
+    ResultCache.clear()
+    SegmentCache.clear()
+    AvroClient.invalidate_cache()
@@ -0,0 +1,135 @@
+"""
+ConsumerPool: long-lived consumers shared by requests, with idle eviction, health checks and a size limit.
+"""
+import threading
+import time
+
+import pytest
+
+import fake_kafka
+from error_handler import ErrorHandler
+from kafka_manager import ConsumerConnectionManager
+
+
+@pytest.fixture
+def closed(search_app, monkeypatch):
+    """Consumers closed by the pools"""
+    closed = []
+    close = fake_kafka.FakeConsumer.close
+
+    def tracked_close(consumer):
+        closed.append(consumer)
+        close(consumer)
+
+    monkeypatch.setattr(fake_kafka.FakeConsumer, 'close', tracked_close)
+    return closed
+
+
+def configure_pool(search_app, **pool_config):
+    search_app.configure(**{'consumer.pool': pool_config})
+
+
+def acquire(search_app):
+    return ConsumerConnectionManager.acquire_consumer(search_app.environment)
+
+
+def release(search_app, consumer, discard=False):
+    ConsumerConnectionManager.release_consumer(search_app.environment, consumer, discard)
+
+
+def test_released_consumers_are_reused(search_app, closed):
+    first, second = acquire(search_app), acquire(search_app)
+    assert first is not second
+    release(search_app, first)
+    release(search_app, second)
+
+    # Most recently used first
+    assert acquire(search_app) is second
+    assert acquire(search_app) is first
+    assert not closed
+
+
+def test_idle_consumers_are_closed_after_the_idle_timeout(search_app, closed):
+    configure_pool(search_app, **{'idle.timeout.seconds': .05})
+    consumer = acquire(search_app)
+    release(search_app, consumer)
+    time.sleep(.1)
+
+    assert acquire(search_app) is not consumer
+    assert closed == [consumer]
+
+
+def test_health_check_drops_broken_consumers(search_app, closed):
+    configure_pool(search_app, **{'health.check.interval.seconds': 0})
+    healthy, broken = acquire(search_app), acquire(search_app)
+    release(search_app, healthy)
+    release(search_app, broken)
+
+    def list_topics(topic=None, timeout=None):
+        raise RuntimeError('broker connection lost')
+
+    broken.list_topics = list_topics
+    consumer = acquire(search_app)
+
+    assert consumer is healthy
+    assert closed == [broken]
+
+
+def test_consumers_idle_for_less_than_the_health_check_interval_are_not_checked(search_app, closed):
+    consumer = acquire(search_app)
+    release(search_app, consumer)
+    consumer.list_topics = None
+
+    assert acquire(search_app) is consumer
+
+
+def test_consumers_failing_to_unassign_are_discarded(search_app, closed):
+    consumer, discarded = acquire(search_app), acquire(search_app)
+    release(search_app, consumer)
+    release(search_app, discarded, discard=True)
+    assert closed == [discarded]
+
+    broken = acquire(search_app)
+    assert broken is consumer
+
+    def unassign():
+        raise RuntimeError('consumer closed')
+
+    broken.unassign = unassign
+    release(search_app, broken)
+
+    assert closed == [discarded, broken]
+    assert acquire(search_app) not in closed
+
+
+def test_acquire_waits_for_a_consumer_when_the_pool_is_full(search_app, closed):
+    configure_pool(search_app, size=1, **{'acquire.timeout.seconds': 5})
+    consumer = acquire(search_app)
+    acquired = []
+    waiting = threading.Thread(target=lambda: acquired.append(acquire(search_app)))
+    waiting.start()
+    time.sleep(.1)
+    assert not acquired
+
+    release(search_app, consumer)
+    waiting.join(5)
+
+    assert acquired == [consumer]
+
+
+def test_acquire_times_out_when_the_pool_stays_full(search_app, closed):
+    configure_pool(search_app, size=1, **{'acquire.timeout.seconds': .05})
+    acquire(search_app)
+
+    with pytest.raises(ErrorHandler, match='Timed out waiting for an available Kafka consumer'):
+        acquire(search_app)
+
+
+def test_close_pools_closes_idle_consumers(search_app, closed):
+    consumers = [acquire(search_app) for _ in range(3)]
+    for consumer in consumers:
+        release(search_app, consumer)
+
+    ConsumerConnectionManager.close_pools()
+
+    assert sorted(map(id, closed)) == sorted(map(id, consumers))
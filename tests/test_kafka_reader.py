@@ -0,0 +1,67 @@
+"""
+Topic scans of KafkaReader through /search: parallel partition scans, newest first scans, search_count and time
+windows. /search returns the matches of a topic last partition first, newest message first.
+"""
+
+
+def matching_ids(search_app, offsets=None):
+    """Ids of the messages of the test topic holding the search token, in /search response order"""
+    return [key.decode() for partition_id, offset, key, value, timestamp in reversed(search_app.all_messages())
+            if search_app.search_token.encode() in value and (offsets is None or offset in offsets)]
+
+
+def test_serial_scan_returns_every_match(search_app):
+    search_app.generate(partitions=4, messages=400)
+
+    matches = search_app.matches(search_app.search())
+
+    assert [match['id'] for match in matches] == matching_ids(search_app)
+
+
+def test_parallel_partition_scan_matches_serial_scan(search_app):
+    search_app.generate(partitions=6, messages=400)
+    serial = search_app.matches(search_app.search())
+
+    search_app.configure(**{'partition.workers': {search_app.environment: 4}})
+    parallel = search_app.matches(search_app.search())
+
+    assert sorted(match['id'] for match in parallel) == sorted(match['id'] for match in serial)
+    assert len(parallel) == len(matching_ids(search_app))
+
+
+def test_partition_workers_request_param_overrides_config(search_app):
+    search_app.generate(partitions=4, messages=300)
+
+    matches = search_app.matches(search_app.search(partitionWorkers=3))
+
+    assert sorted(match['id'] for match in matches) == sorted(matching_ids(search_app))
+
+
+def test_newest_first_with_search_count_returns_newest_matches(search_app):
+    search_app.generate(partitions=1, messages=2000)
+
+    newest = search_app.matches(search_app.search(newestFirst='true', search_count=5))
+
+    assert [match['id'] for match in newest] == matching_ids(search_app)[:5]
+    # Only the end of the partition is read
+    assert search_app.delivered_messages() < 2000
+
+
+def test_search_count_stops_scan_early(search_app):
+    search_app.generate(partitions=1, messages=2000)
+
+    matches = search_app.matches(search_app.search(search_count=3))
+
+    # The oldest three matches are found, returned newest first
+    assert [match['id'] for match in matches] == matching_ids(search_app)[-3:]
+    assert search_app.delivered_messages() < 2000
+
+
+def test_time_window_limits_scanned_offsets(search_app):
+    search_app.generate(partitions=2, messages=600)
+    # Message timestamps are base timestamp + offset seconds, 2020-09-13 12:26:40 UTC + offset
+    matches = search_app.matches(search_app.search(notBefore='2020-09-13 12:31:40', notAfter='2020-09-13 12:33:19'))
+
+    assert [match['id'] for match in matches] == matching_ids(search_app, range(300, 400))
+    # Partitions are read from the first offset in the window, consume() batches may run past its end
+    assert search_app.delivered_messages() <= 2 * (600 - 300) + 2
@@ -0,0 +1,89 @@
+"""
+Key lookups: KeyPartitioner against the partitioners of the Kafka clients, and messageKey searches only scanning
+the key's partition.
+"""
+import json
+import zlib
+
+import pytest
+
+from config_handler import ConnectionConfig
+from error_handler import ErrorHandler
+from key_partitioner import KeyPartitioner
+
+
+@pytest.mark.parametrize('key, expected', [
+    # Test vectors of the Java client (org.apache.kafka.common.utils.UtilsTest.testMurmur2)
+    (b'21', -973932308),
+    (b'foobar', -790332482),
+    (b'a-little-bit-long-string', -985981536),
+    (b'a-little-bit-longer-string', -1486304829),
+    (b'lkjh234lh9fiuh90y23oiuhsafujhadof229phr9h19h89h8', -58897971),
+    (b'abc', 479470107),
+])
+def test_murmur2_matches_the_java_client(key, expected):
+    assert KeyPartitioner.murmur2(key) == expected
+
+
+@pytest.fixture
+def partitioner_config(monkeypatch):
+    config = {'key.partitioner': {'topics': {'crc-topic': 'consistent', 'custom-topic': 'none',
+                                             'unknown-topic': 'sticky'}}}
+    monkeypatch.setattr(ConnectionConfig, 'connection_details', config)
+    return config
+
+
+def test_partition_for_uses_the_topic_partitioner(partitioner_config):
+    for key in (b'', b'a', b'order-1', b'\xff' * 9):
+        assert KeyPartitioner.partition_for('other-topic', key, 12) == (KeyPartitioner.murmur2(key) & 0x7fffffff) % 12
+        assert KeyPartitioner.partition_for('crc-topic', key, 12) == zlib.crc32(key) % 12
+        assert KeyPartitioner.partition_for('custom-topic', key, 12) is None
+
+
+def test_default_partitioner_is_configurable(partitioner_config):
+    partitioner_config['key.partitioner']['default'] = 'none'
+
+    assert KeyPartitioner.partition_for('other-topic', b'order-1', 12) is None
+    assert KeyPartitioner.partition_for('crc-topic', b'order-1', 12) == zlib.crc32(b'order-1') % 12
+
+
+def test_unknown_partitioner_is_rejected(partitioner_config):
+    with pytest.raises(ErrorHandler, match='Unknown key partitioner'):
+        KeyPartitioner.partition_for('unknown-topic', b'order-1', 12)
+
+
+def customer_key(offset):
+    return ('customer-' + str(offset % 40)).encode()
+
+
+def key_matches(search_app, key):
+    """Ids of the messages with key holding the search token, in /search response order"""
+    return [json.loads(value)['id'] for partition_id, offset, msg_key, value, timestamp
+            in reversed(search_app.all_messages()) if msg_key == key and search_app.search_token.encode() in value]
+
+
+def test_key_lookup_returns_the_matches_of_a_full_scan(search_app):
+    search_app.generate(partitions=6, messages=300, selectivity=.3, key_of=customer_key)
+    full_scan = [match['id'] for match in search_app.matches(search_app.search())]
+
+    for key in (b'customer-0', b'customer-17', b'customer-39'):
+        matches = search_app.matches(search_app.search(messageKey=key.decode()))
+
+        expected = key_matches(search_app, key)
+        assert expected
+        assert [match['id'] for match in matches] == expected
+        assert [match_id for match_id in full_scan if match_id in expected] == expected
+        # Only the partition of the key is read
+        key_partition = (KeyPartitioner.murmur2(key) & 0x7fffffff) % 6
+        partition_messages = [message for message in search_app.all_messages() if message[0] == key_partition]
+        assert search_app.delivered_messages() <= len(partition_messages) + 1
+
+
+def test_key_lookup_scans_every_partition_without_a_known_partitioner(search_app):
+    search_app.generate(partitions=4, messages=200, selectivity=.3, key_of=customer_key)
+    search_app.configure(**{'key.partitioner': {'default': 'none'}})
+
+    matches = search_app.matches(search_app.search(messageKey='customer-3'))
+
+    assert matches
+    assert search_app.delivered_messages() >= 4 * 200
@@ -0,0 +1,96 @@
+"""
+Request audit log: records are queued by RequestLogger.log_request() and written by the AuditLogWriter() thread.
+"""
+import os
+import threading
+
+import pytest
+
+import constants
+from config_handler import ConnectionConfig
+from logger import AuditLogWriter, CsvFormatter, RequestLogger
+from search_metrics import SearchMetrics
+
+
+def params(index):
+    return {constants.PARAM_SEARCH_STRING_KEY: 'needle-' + str(index), constants.PARAM_ENVIRONMENT_KEY: 'test',
+            constants.PARAM_JSON_TOPICS_KEY: ['orders'], constants.PARAM_AVRO_TOPICS_KEY: []}
+
+
+def logged_searches(log_filepath):
+    with open(log_filepath, encoding='utf-8') as log_file:
+        return [line[len('search_param:'):].strip() for line in log_file.read().splitlines()
+                if line.startswith('search_param:')]
+
+
+def dropped_total():
+    name = constants.METRICS_PREFIX + 'audit_log_dropped_total '
+    return next((int(line[len(name):]) for line in SearchMetrics.render().splitlines() if line.startswith(name)), 0)
+
+
+@pytest.fixture
+def log_filepath(tmp_path, monkeypatch):
+    log_filepath = str(tmp_path / 'logs' / 'requests.log')
+    monkeypatch.setattr(ConnectionConfig, 'logger_details', {'logger.enable': 'true',
+                                                              'logger.requests.path': log_filepath,
+                                                              'logger.batch.size': '7'})
+    yield log_filepath
+    RequestLogger.shutdown()
+
+
+def test_every_logged_request_is_written_by_shutdown(log_filepath):
+    RequestLogger.create_logger()
+    for index in range(100):
+        RequestLogger.log_request(params(index))
+
+    RequestLogger.shutdown()
+
+    assert logged_searches(log_filepath) == ['needle-' + str(index) for index in range(100)]
+
+
+def test_logger_disabled_by_default(log_filepath, monkeypatch):
+    monkeypatch.setattr(ConnectionConfig, 'logger_details', {'logger.requests.path': log_filepath})
+    RequestLogger.create_logger()
+    RequestLogger.log_request(params(0))
+
+    RequestLogger.shutdown()
+
+    with pytest.raises(FileNotFoundError):
+        logged_searches(log_filepath)
+
+
+def test_records_are_dropped_when_the_queue_is_full(log_filepath, monkeypatch):
+    formatting = threading.Event()
+    resume = threading.Event()
+    format_record = CsvFormatter.format_record
+
+    def held_format_record(formatter, timestamp, record_params):
+        formatting.set()
+        resume.wait(5)
+        return format_record(formatter, timestamp, record_params)
+
+    monkeypatch.setattr(CsvFormatter, 'format_record', held_format_record)
+    os.makedirs(os.path.dirname(log_filepath))
+    dropped = dropped_total()
+    writer = AuditLogWriter(log_filepath, queue_size=3, batch_size=10)
+    # The writer thread takes the first record and is held formatting it, the next 3 fill the queue
+    writer.put((0.0, params(0)))
+    assert formatting.wait(5)
+    for index in range(1, 9):
+        writer.put((0.0, params(index)))
+
+    assert dropped_total() == dropped + 5
+    resume.set()
+    writer.stop()
+    assert logged_searches(log_filepath) == ['needle-' + str(index) for index in range(4)]
+
+
+def test_records_are_dropped_when_the_log_file_is_not_writable(tmp_path):
+    dropped = dropped_total()
+    writer = AuditLogWriter(str(tmp_path), queue_size=10, batch_size=10)
+    for index in range(3):
+        writer.put((0.0, params(index)))
+
+    writer.stop()
+
+    assert dropped_total() == dropped + 3
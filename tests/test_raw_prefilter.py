@@ -0,0 +1,166 @@
+"""
+RawPrefilter soundness: a prefilter may let through messages that do not match, but must never reject a message
+that the search (SearchMatcher against the decoded message) matches. Checked over random messages and search
+terms, built the way KafkaReader builds its prefilters.
+"""
+import io
+import json
+import random
+import struct
+
+import fastavro
+
+from message_filter import FieldPredicates, RawPrefilter, SearchMatcher
+
+# Raw json number shapes, including those whose python repr differs from the raw text
+NUMBER_SHAPES = ('0', '7', '-3', '42', '1.5', '2.50', '-0.0', '1e5', '1E+2', '2.5e-3', '0.1000000000000000055',
+                 '12345678901234567890', '3.0000001', '0.00001', '1.0', '100', '6.02214076e23')
+# Text fragments, including escapes, non ascii text and characters whose lower case is ascii
+TEXT_PIECES = ('abc', 'Order', 'NEW', 'paid', 'none', 'true', 'x y', 'K', 'K', 'İ', 'café', 'Été',
+               '\\n', '\\u0041', '\\"q\\"', '\\\\', '42', '1.5', 'e5', 'null', 'inf', '-', '_', 'z')
+WORDS = ('abc', 'order', 'new', 'paid', 'none', 'true', 'false', 'null', 'k', 'x y', 'caf', 'café', 'a',
+         '42', '1.5', '100000.0', '1e+20', 'e-05', '0.1', '-0.0', 'nan', 'inf', '12345678901234567890', 'order1')
+
+
+def random_raw_json(rng, depth=0):
+    """Raw json text of a random value"""
+    kind = rng.randrange(6 if depth < 3 else 4)
+    if kind == 0:
+        return rng.choice(NUMBER_SHAPES)
+    if kind == 1:
+        return '"' + ''.join(rng.choice(TEXT_PIECES) for _ in range(rng.randint(0, 4))) + '"'
+    if kind == 2:
+        return rng.choice(('true', 'false', 'null'))
+    if kind == 3:
+        return '"' + rng.choice(WORDS) + '"'
+    if kind == 4:
+        return '[' + ', '.join(random_raw_json(rng, depth + 1) for _ in range(rng.randint(0, 3))) + ']'
+    return '{' + ', '.join('"' + rng.choice(('id', 'Name', 'status', 'amount', 'K')) + str(index) + '": ' +
+                           random_raw_json(rng, depth + 1) for index in range(rng.randint(0, 4))) + '}'
+
+
+def random_terms(rng, text):
+    """Search terms: substrings of the searched text (matching) and vocabulary words (mostly not matching)"""
+    terms = []
+    for _ in range(rng.randint(1, 3)):
+        if text and rng.random() < .6:
+            start = rng.randrange(len(text))
+            terms.append(text[start:start + rng.randint(1, 8)])
+        else:
+            terms.append(rng.choice(WORDS))
+    return SearchMatcher.normalize_terms(terms)
+
+
+def json_prefilter(matcher):
+    """Prefilter of a json search, as built by KafkaReader"""
+    prefilters = []
+    if matcher.terms and not matcher.regexes:
+        prefilters.append(RawPrefilter.any_of([RawPrefilter.for_json(term) for term in matcher.literals]))
+    if matcher.predicates is not None:
+        prefilters.extend(RawPrefilter.for_json(text) for text in matcher.predicates.raw_texts())
+    return RawPrefilter.all_of(prefilters)
+
+
+def test_json_prefilter_never_rejects_a_matching_message():
+    rng = random.Random(7)
+    checked = 0
+    for _ in range(4000):
+        raw_text = '{"value": ' + random_raw_json(rng) + ', "note": "' + rng.choice(WORDS) + '"}'
+        raw_value = raw_text.encode()
+        data = json.loads(raw_value)
+        terms = random_terms(rng, str(data).lower())
+        matcher = SearchMatcher.for_terms(terms)
+        prefilter = json_prefilter(matcher)
+        if matcher.match_message(data) is not None:
+            checked += 1
+            assert prefilter is None or prefilter.is_candidate(raw_value), (raw_text, terms)
+    # The random terms must exercise matching messages, not only rejections
+    assert checked > 1000
+
+
+def test_json_prefilter_rejects_messages_without_the_term():
+    prefilter = RawPrefilter.for_json('needle')
+
+    assert prefilter.is_candidate(b'{"note": "a NEEDLE here"}')
+    assert not prefilter.is_candidate(b'{"note": "nothing here"}')
+    assert not prefilter.is_candidate(None)
+
+
+def test_json_prefilter_is_not_built_for_unsafe_search_strings():
+    for search_string in ('a:b', "'x'", 'a, b', '{', 'café'):
+        assert RawPrefilter.for_json(search_string) is None
+
+
+def test_json_prefilter_never_rejects_a_message_passing_field_filters():
+    rng = random.Random(11)
+    checked = 0
+    for _ in range(3000):
+        value_text = random_raw_json(rng, depth=3)
+        raw_value = ('{"customer": {"id": ' + value_text + '}, "note": "x"}').encode()
+        data = json.loads(raw_value)
+        found = data['customer']['id']
+        if isinstance(found, (dict, list)):
+            continue
+        op = rng.choice(('equals', 'contains'))
+        filter_value = found if op == 'equals' else str(found)[:rng.randint(1, 4)]
+        if op == 'contains' and not filter_value:
+            continue
+        field_filters = FieldPredicates.normalize_filters([{'field': 'customer.id', 'op': op, 'value': filter_value}])
+        matcher = SearchMatcher.for_terms((), field_filters)
+        if matcher.match_message(data) is not None:
+            checked += 1
+            prefilter = json_prefilter(matcher)
+            assert prefilter is None or prefilter.is_candidate(raw_value), (raw_value, field_filters)
+    assert checked > 500
+
+
+AVRO_SCHEMA = {
+    'type': 'record', 'name': 'Order', 'fields': [
+        {'name': 'id', 'type': 'string'},
+        {'name': 'count', 'type': 'int'},
+        {'name': 'amount', 'type': 'double'},
+        {'name': 'paid', 'type': 'boolean'},
+        {'name': 'status', 'type': {'type': 'enum', 'name': 'Status', 'symbols': ['NEW', 'SHIPPED']}},
+        {'name': 'comment', 'type': ['null', 'string'], 'default': None},
+        {'name': 'tags', 'type': {'type': 'array', 'items': 'string'}},
+        {'name': 'attributes', 'type': {'type': 'map', 'values': 'string'}}]}
+AVRO_TEXTS = ('abc', 'Order', 'needle', 'café', 'K', 'x y', 'quiet', 'zulu', 'Mixed Case', '')
+
+
+def random_avro_record(rng):
+    return {'id': rng.choice(AVRO_TEXTS) + rng.choice(AVRO_TEXTS),
+            'count': rng.randint(-1000, 1000),
+            'amount': rng.choice((0.1, 1e21, -2.5, 3.0, float(rng.randint(0, 99)))),
+            'paid': rng.random() < .5,
+            'status': rng.choice(('NEW', 'SHIPPED')),
+            'comment': rng.choice((None, rng.choice(AVRO_TEXTS))),
+            'tags': [rng.choice(AVRO_TEXTS) for _ in range(rng.randint(0, 2))],
+            'attributes': {rng.choice(AVRO_TEXTS) or 'k': rng.choice(AVRO_TEXTS) for _ in range(rng.randint(0, 2))}}
+
+
+def test_avro_prefilter_never_rejects_a_matching_message():
+    rng = random.Random(3)
+    schema_string = json.dumps(AVRO_SCHEMA)
+    parsed_schema = fastavro.parse_schema(AVRO_SCHEMA)
+    checked = 0
+    for _ in range(3000):
+        raw = io.BytesIO()
+        raw.write(struct.pack('>bI', 0, 1))
+        fastavro.schemaless_writer(raw, parsed_schema, random_avro_record(rng))
+        raw_value = raw.getvalue()
+        data = fastavro.schemaless_reader(io.BytesIO(raw_value[5:]), parsed_schema, parsed_schema)
+        terms = random_terms(rng, str(data).lower())
+        matcher = SearchMatcher.for_terms(terms)
+        prefilter = RawPrefilter.any_of([RawPrefilter.for_avro(term, schema_string) for term in matcher.literals])
+        if matcher.match_message(data) is not None:
+            checked += 1
+            assert prefilter is None or prefilter.is_candidate(raw_value), (data, terms)
+    assert checked > 1000
+
+
+def test_avro_prefilter_is_not_built_for_schema_text_or_numbers():
+    schema_string = json.dumps(AVRO_SCHEMA)
+
+    assert RawPrefilter.for_avro('needle', schema_string) is not None
+    for search_string in ('status', 'shipped', 'true', '42', 'none', 'amount'):
+        assert RawPrefilter.for_avro(search_string, schema_string) is None
@@ -0,0 +1,128 @@
+"""
+Search result cache: repeated searches replay cached matches and only scan the offsets added since, cached and
+uncached searches return the same matches.
+"""
+from result_cache import ResultCache
+from segment_cache import CachedMessage
+
+
+def enable_cache(search_app, **cache_config):
+    search_app.configure(**{'result.cache': dict({'enabled': 'true'}, **cache_config)})
+
+
+def uncached_ids(search_app, **params):
+    search_app.configure(**{'result.cache': {'enabled': 'false'}})
+    ids = [match['id'] for match in search_app.matches(search_app.search(**params))]
+    search_app.configure(**{'result.cache': {'enabled': 'true'}})
+    return ids
+
+
+def cache_status(search_app):
+    return search_app.client.get('/cache/status').get_json()
+
+
+def test_cache_is_disabled_by_default(search_app):
+    search_app.generate(partitions=2, messages=300)
+    search_app.search()
+
+    search_app.search()
+
+    assert search_app.delivered_messages() >= 600
+    assert cache_status(search_app)['entries'] == 0
+
+
+def test_repeated_search_only_scans_new_offsets(search_app):
+    search_app.generate(partitions=3, messages=300)
+    enable_cache(search_app)
+    first = [match['id'] for match in search_app.matches(search_app.search())]
+    status = cache_status(search_app)
+
+    # Nothing new: every partition is replayed from the cache
+    repeated = [match['id'] for match in search_app.matches(search_app.search())]
+    assert repeated == first
+    assert search_app.delivered_messages() == 0
+    assert cache_status(search_app)['hits'] - status['hits'] == 3
+
+    search_app.produce(50)
+    status = cache_status(search_app)
+    updated = [match['id'] for match in search_app.matches(search_app.search())]
+    assert cache_status(search_app)['partial_hits'] - status['partial_hits'] == 3
+    # Only the 50 new offsets of each partition are read (and an end of partition event each)
+    assert search_app.delivered_messages() <= 3 * (50 + 1)
+    assert updated == uncached_ids(search_app)
+    assert set(first) < set(updated)
+
+    # The merged range is cached in turn
+    search_app.search()
+    assert search_app.delivered_messages() == 0
+
+
+def test_time_window_searches_are_cached_separately(search_app):
+    search_app.generate(partitions=2, messages=600)
+    enable_cache(search_app)
+    window = {'notBefore': '2020-09-13 12:31:40', 'notAfter': '2020-09-13 12:33:19'}
+    search_app.search()
+
+    windowed = [match['id'] for match in search_app.matches(search_app.search(**window))]
+
+    assert search_app.delivered_messages() > 0
+    assert windowed == uncached_ids(search_app, **window)
+
+
+def test_least_recently_used_searches_are_evicted_at_max_entries(search_app):
+    search_app.generate(partitions=2, messages=300)
+    enable_cache(search_app, **{'max.entries': 2})
+    status = cache_status(search_app)
+    for search_param in ('alpha', 'bravo', search_app.search_token):
+        search_app.search(searchParam=search_param)
+
+    assert cache_status(search_app)['entries'] == 2
+    assert cache_status(search_app)['evictions'] - status['evictions'] == 1
+    # The oldest search is scanned again, the newest is replayed
+    search_app.search(searchParam=search_app.search_token)
+    assert search_app.delivered_messages() == 0
+    search_app.search(searchParam='alpha')
+    assert search_app.delivered_messages() >= 600
+
+
+def test_searches_are_evicted_at_max_bytes(search_app):
+    search_app.generate(partitions=2, messages=300, selectivity=.2)
+    enable_cache(search_app, **{'max.bytes': 1000})
+
+    search_app.search()
+
+    status = cache_status(search_app)
+    assert status['entries'] == 0
+    assert status['size_bytes'] == 0
+
+
+def test_searches_stopping_early_bypass_the_cache(search_app):
+    search_app.generate(partitions=2, messages=300)
+    enable_cache(search_app)
+
+    for params in ({'search_count': 2}, {'pageSize': 2}, {'newestFirst': 'true'}):
+        search_app.search(**params)
+        search_app.search(**params)
+        assert search_app.delivered_messages() > 0, params
+    assert cache_status(search_app)['entries'] == 0
+
+
+def cached_match(offset):
+    return CachedMessage('topic', 0, offset, 0, None, None), {'offset': offset}
+
+
+def test_partition_ranges(search_app):
+    key = ('test', 'topic', 'json', ('needle',), (), None, None, (None, None))
+    enable_cache(search_app)
+    ResultCache.put_partition(key, 0, 100, 200, [cached_match(offset) for offset in (100, 150, 199)])
+
+    assert ResultCache.get_partition(key, 0, 100, 200)[0] == 200
+    # New offsets up to 250 remain to be scanned
+    assert ResultCache.get_partition(key, 0, 100, 250)[0] == 200
+    # Offsets deleted by retention are left out
+    stop_offset, matches = ResultCache.get_partition(key, 0, 120, 250)
+    assert [msg.offset() for msg, parsed_msg in matches] == [150, 199]
+    # Ranges starting before the cached range, or ending before its end (topic recreated), are scanned again
+    assert ResultCache.get_partition(key, 0, 50, 250) is None
+    assert ResultCache.get_partition(key, 0, 100, 150) is None
+    assert ResultCache.get_partition(key, 1, 100, 200) is None
@@ -0,0 +1,194 @@
+"""
+SearchAdmission: queued searches admitted by priority class (aged while waiting), then clients with fewer searches
+running, then arrival order; bounded queue; max.running limited by the consumer pool.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import constants
+from config_handler import ConnectionConfig
+from error_handler import ErrorHandler, SearchCancelled
+from search_admission import SearchAdmission
+
+
+class Admissions:
+    """Searches of a single environment, queued on threads, recording the order they are admitted in"""
+
+    def __init__(self, environment):
+        self.environment = environment
+        self.admitted = []
+        self.tickets = {}
+        self.errors = {}
+        self.condition = threading.Condition()
+
+    def params(self, window_seconds=None):
+        params = {constants.PARAM_ENVIRONMENT_KEY: self.environment}
+        if window_seconds is not None:
+            not_after = datetime.now(timezone.utc)
+            params[constants.PARAM_NOT_BEFORE_KEY] = not_after - timedelta(seconds=window_seconds)
+            params[constants.PARAM_NOT_AFTER_KEY] = not_after
+        return params
+
+    def run(self, name, client='client', window_seconds=None, background=False):
+        """Admit a search right away, :return: AdmissionTicket()"""
+        ticket = SearchAdmission.admit(self.params(window_seconds), client, background)
+        self.tickets[name] = ticket
+        return ticket
+
+    def queue(self, name, client='client', window_seconds=None, background=False):
+        """Queue a search on a thread, returns once it is queued"""
+        queued = self.status()[SearchAdmission.status_queued_key]
+
+        def admit():
+            try:
+                ticket = SearchAdmission.admit(self.params(window_seconds), client, background)
+            except ErrorHandler as e:
+                with self.condition:
+                    self.errors[name] = e
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.tickets[name] = ticket
+                self.admitted.append(name)
+                self.condition.notify_all()
+
+        threading.Thread(target=admit, daemon=True).start()
+        self.wait_for(lambda: self.status()[SearchAdmission.status_queued_key] > queued)
+
+    def release(self, name):
+        """Release a search and :return: the name of the search admitted in its place"""
+        admitted = len(self.admitted)
+        SearchAdmission.release(self.tickets[name])
+        self.wait_for(lambda: len(self.admitted) > admitted)
+        return self.admitted[admitted]
+
+    def release_all(self):
+        for ticket in list(self.tickets.values()):
+            SearchAdmission.release(ticket)
+
+    def status(self):
+        return SearchAdmission.status()[self.environment]
+
+    def wait_for(self, condition, timeout_seconds=5):
+        deadline = time.monotonic() + timeout_seconds
+        with self.condition:
+            while not condition():
+                assert time.monotonic() < deadline
+                self.condition.wait(.01)
+
+
+@pytest.fixture
+def admissions(request, monkeypatch):
+    monkeypatch.setattr(ConnectionConfig, 'connection_details', {})
+    # Admission state is kept per environment for the life of the process
+    admissions = Admissions('admission-' + request.node.name)
+    yield admissions
+    admissions.release_all()
+
+
+def configure(**admission_config):
+    ConnectionConfig.connection_details['search.admission'] = dict({'enabled': 'true', 'max.running': 1,
+                                                                   'priority.aging.seconds': 0}, **admission_config)
+
+
+def test_searches_are_not_queued_unless_enabled(admissions):
+    for index in range(20):
+        assert admissions.run('search-' + str(index)).admitted.is_set()
+
+
+def test_small_window_searches_go_before_full_scans_and_jobs_go_last(admissions):
+    configure()
+    admissions.run('running')
+    admissions.queue('job', background=True)
+    admissions.queue('full scan')
+    admissions.queue('one hour window', window_seconds=3600)
+    admissions.queue('two hour window', window_seconds=7200)
+
+    assert admissions.release('running') == 'one hour window'
+    assert admissions.release('one hour window') == 'full scan'
+    assert admissions.release('full scan') == 'two hour window'
+    assert admissions.release('two hour window') == 'job'
+
+
+def test_queued_searches_move_up_a_priority_class_as_they_wait(admissions):
+    configure(**{'priority.aging.seconds': .2})
+    admissions.run('running')
+    admissions.queue('full scan')
+    # Waited two aging periods, the full scan now ranks with small searches and was queued first
+    time.sleep(.45)
+    admissions.queue('small', window_seconds=60)
+
+    assert admissions.release('running') == 'full scan'
+    assert admissions.release('full scan') == 'small'
+
+
+def test_clients_with_fewer_searches_running_go_first(admissions):
+    configure(**{'max.running': 2})
+    admissions.run('a1', client='a')
+    admissions.run('a2', client='a')
+    admissions.queue('a3', client='a')
+    admissions.queue('a4', client='a')
+    admissions.queue('b1', client='b')
+    admissions.queue('b2', client='b')
+
+    # a still runs a2, b runs nothing: b1 goes before a3, queued earlier
+    assert admissions.release('a1') == 'b1'
+    # Now b runs b1 and a runs nothing
+    assert admissions.release('a2') == 'a3'
+    assert admissions.release('b1') == 'b2'
+    assert admissions.release('a3') == 'a4'
+
+
+def test_searches_are_rejected_once_the_queue_is_full(admissions):
+    configure(**{'queue.size': 1})
+    admissions.run('running')
+    admissions.queue('queued')
+
+    with pytest.raises(ErrorHandler, match='already queued'):
+        SearchAdmission.admit(admissions.params(), 'client')
+    assert admissions.release('running') == 'queued'
+
+
+def test_queued_searches_are_rejected_after_the_queue_timeout(admissions):
+    configure(**{'queue.timeout.seconds': .2})
+    admissions.run('running')
+
+    with pytest.raises(ErrorHandler, match='after waiting'):
+        SearchAdmission.admit(admissions.params(), 'client')
+    assert admissions.status()[SearchAdmission.status_queued_key] == 0
+
+
+def test_cancelled_searches_leave_the_queue(admissions):
+    configure()
+    admissions.run('running')
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    with pytest.raises(SearchCancelled):
+        SearchAdmission.admit(admissions.params(), 'client', cancel_event=cancel_event)
+    assert admissions.status()[SearchAdmission.status_queued_key] == 0
+
+
+@pytest.mark.parametrize('pool_size, topic_workers, partition_workers, max_running, expected', [
+    (16, None, None, 8, 4),
+    (64, 4, 4, 8, 4),
+    (64, 2, 4, 4, 4),
+    (8, 4, 4, 8, 1),
+    # Partition workers are capped at 16 per topic
+    (1000, 1, 100, 1000, 62),
+])
+def test_max_running_is_limited_by_the_consumer_pool(admissions, pool_size, topic_workers, partition_workers,
+                                                     max_running, expected):
+    environment = admissions.environment
+    configure(**{'max.running': {environment: max_running}})
+    ConnectionConfig.connection_details['consumer.pool'] = {'size': pool_size}
+    if topic_workers is not None:
+        ConnectionConfig.connection_details['topic.workers'] = {environment: topic_workers}
+    if partition_workers is not None:
+        ConnectionConfig.connection_details['partition.workers'] = {environment: partition_workers}
+    admissions.run('running')
+
+    assert admissions.status()[SearchAdmission.status_max_running_key] == expected
@@ -0,0 +1,93 @@
+"""
+Paged searches: SearchCursor encoding and /search pages (pageSize, cursor) adding up to the full search.
+"""
+import base64
+import json
+
+import pytest
+
+import constants
+from error_handler import ErrorHandler
+from search_cursor import SearchCursor
+
+PARAMS = {constants.PARAM_SEARCH_TERMS_KEY: ('needle',),
+          constants.PARAM_FIELD_FILTERS_KEY: (),
+          constants.PARAM_ENVIRONMENT_KEY: 'test',
+          constants.PARAM_JSON_TOPICS_KEY: ['b-topic', 'a-topic'],
+          constants.PARAM_AVRO_TOPICS_KEY: [],
+          constants.PARAM_NOT_BEFORE_KEY: None,
+          constants.PARAM_NOT_AFTER_KEY: None}
+TOPIC_OFFSETS = {'JSON_TOPIC_a-topic': {0: (10, 500), 3: (0, 7)}, 'JSON_TOPIC_b-topic': None}
+
+
+def test_cursor_round_trip():
+    cursor = SearchCursor.encode(PARAMS, 50, TOPIC_OFFSETS)
+
+    assert SearchCursor.decode(dict(PARAMS), cursor) == (50, TOPIC_OFFSETS)
+
+
+def test_no_cursor_once_every_topic_is_scanned():
+    assert SearchCursor.encode(PARAMS, 50, {}) is None
+
+
+def test_cursor_does_not_depend_on_topic_order():
+    cursor = SearchCursor.encode(PARAMS, 50, TOPIC_OFFSETS)
+    params = dict(PARAMS, **{constants.PARAM_JSON_TOPICS_KEY: ['a-topic', 'b-topic']})
+
+    assert SearchCursor.decode(params, cursor) == (50, TOPIC_OFFSETS)
+
+
+@pytest.mark.parametrize('key, value', [(constants.PARAM_SEARCH_TERMS_KEY, ('other',)),
+                                        (constants.PARAM_ENVIRONMENT_KEY, 'prod'),
+                                        (constants.PARAM_JSON_TOPICS_KEY, ['a-topic']),
+                                        (constants.PARAM_NOT_AFTER_KEY, 1600000000000),
+                                        (constants.PARAM_MESSAGE_KEY_KEY, 'key-1')])
+def test_cursor_of_a_different_search_is_rejected(key, value):
+    cursor = SearchCursor.encode(PARAMS, 50, TOPIC_OFFSETS)
+
+    with pytest.raises(ErrorHandler, match='different search'):
+        SearchCursor.decode(dict(PARAMS, **{key: value}), cursor)
+
+
+def test_invalid_cursor_is_rejected():
+    for cursor in ('not a cursor', base64.urlsafe_b64encode(b'{"v": 1}').decode(), ''):
+        with pytest.raises(ErrorHandler, match='not a valid cursor'):
+            SearchCursor.decode(PARAMS, cursor)
+
+
+def test_cursor_of_another_version_is_rejected():
+    cursor = json.loads(base64.urlsafe_b64decode(SearchCursor.encode(PARAMS, 50, TOPIC_OFFSETS)))
+    cursor['v'] = SearchCursor.cursor_version + 1
+    cursor = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+    with pytest.raises(ErrorHandler, match='older version'):
+        SearchCursor.decode(PARAMS, cursor)
+
+
+def test_pages_add_up_to_the_full_search(search_app):
+    search_app.generate(partitions=3, messages=400, selectivity=.1)
+    full_search = [match['id'] for match in search_app.matches(search_app.search())]
+
+    paged = []
+    cursor = None
+    for _ in range(len(full_search)):
+        response = search_app.search(pageSize=7, cursor=cursor)
+        page = search_app.matches(response)
+        assert len(page) <= 7
+        paged.extend(match['id'] for match in page)
+        cursor = response['CURSOR']
+        if cursor is None:
+            break
+
+    assert cursor is None
+    assert len(paged) == len(set(paged))
+    assert sorted(paged) == sorted(full_search)
+
+
+def test_cursor_of_another_search_term_is_rejected_by_search(search_app):
+    search_app.generate(partitions=2, messages=200)
+    cursor = search_app.search(pageSize=2)['CURSOR']
+
+    response = search_app.search(searchParam='other', pageSize=2, cursor=cursor)
+
+    assert 'different search' in json.dumps(response)
@@ -0,0 +1,122 @@
+"""
+Search estimates (/search/estimate) and the rejection of searches over the environment's max.seconds.
+"""
+import json
+
+import fake_kafka
+from search_admission import SearchAdmission
+
+TOPIC_KEY = 'JSON_TOPIC_test-topic'
+
+
+def configure_estimate(search_app, **estimate_config):
+    """100 messages per second, the test topic's 1200 messages take 12 seconds"""
+    search_app.configure(**{'search.estimate': dict({'default.messages.per.second': 100, 'warn.seconds': 0},
+                                                    **estimate_config)})
+
+
+def test_topic_stats_and_window_coverage(search_app):
+    search_app.generate(partitions=2, messages=600)
+    configure_estimate(search_app)
+
+    response = search_app.search('/search/estimate', notBefore='2020-09-13 12:31:40', notAfter='2020-09-13 12:33:19')
+
+    topic = response[TOPIC_KEY]
+    assert (topic['partition_count'], topic['messages'], topic['window_messages']) == (2, 1200, 200)
+    assert topic['window_coverage'] == round(200 / 1200.0, 4)
+    assert not topic['retention_truncated']
+    assert [(partition['partition'], partition['low_watermark'], partition['high_watermark'],
+             partition['window_messages']) for partition in topic['partitions']] == [(0, 0, 600, 100), (1, 0, 600, 100)]
+    assert topic['search']['partitions'] == 2
+    assert topic['search']['messages'] == 200
+    assert topic['search']['seconds'] == 2.0
+    assert not topic['search']['measured']
+    assert response['ESTIMATE']['messages'] == 200
+
+
+def test_retention_truncated_window(search_app, monkeypatch):
+    search_app.generate(partitions=2, messages=600)
+    # Offsets below 100 were deleted by retention
+    monkeypatch.setattr(fake_kafka.FakeConsumer, 'get_watermark_offsets', lambda self, topic_partition, timeout=None,
+                        cached=False: (100, len(fake_kafka.FakeTopics.topics[topic_partition.topic][
+                                               topic_partition.partition])))
+
+    within_retention = search_app.search('/search/estimate', notBefore='2020-09-13 12:31:40')[TOPIC_KEY]
+    truncated = search_app.search('/search/estimate', notBefore='2020-09-13 12:26:40')[TOPIC_KEY]
+
+    assert not within_retention['retention_truncated']
+    assert truncated['retention_truncated']
+    assert truncated['messages'] == truncated['window_messages'] == 1000
+
+
+def test_key_lookup_estimates_a_single_partition(search_app):
+    search_app.generate(partitions=4, messages=200, key_of=lambda offset: ('customer-' + str(offset % 10)).encode())
+    key_partition = [partition_id for partition_id, offset, key, value, timestamp in search_app.all_messages()
+                     if key == b'customer-3'][0]
+    partition_messages = len([message for message in search_app.all_messages() if message[0] == key_partition])
+
+    topic = search_app.search('/search/estimate', messageKey='customer-3')[TOPIC_KEY]
+
+    assert topic['search']['partitions'] == 1
+    assert topic['search']['messages'] == partition_messages
+    assert topic['messages'] == 800
+
+
+def test_expensive_searches_are_warned_about_then_rejected(search_app):
+    search_app.generate(partitions=2, messages=600)
+    configure_estimate(search_app, **{'warn.seconds': 5})
+
+    warned = search_app.search('/search/estimate')['ESTIMATE']
+    assert (warned['seconds'], warned['rejected']) == (12.0, False)
+    assert 'about 12.0 seconds' in warned['warning']
+    assert search_app.matches(search_app.search())
+
+    configure_estimate(search_app, **{'warn.seconds': 5, 'max.seconds': {search_app.environment: 10}})
+    rejected = search_app.search('/search/estimate')['ESTIMATE']
+    assert rejected['rejected']
+    assert 'over the limit of 10 seconds' in rejected['warning']
+    assert 'Search rejected' in json.dumps(search_app.search())
+    # Messages are never read
+    assert search_app.delivered_messages() == 0
+    # A narrower window is accepted
+    assert search_app.matches(search_app.search(notBefore='2020-09-13 12:31:40'))
+
+
+def test_match_limit_caps_the_estimate_but_a_large_limit_is_still_rejected(search_app):
+    search_app.generate(partitions=2, messages=600)
+    configure_estimate(search_app, **{'max.seconds': 10, 'assumed.selectivity': .01})
+
+    small_limit = search_app.search('/search/estimate', search_count=1)['ESTIMATE']
+    assert (small_limit['messages'], small_limit['limited'], small_limit['rejected']) == (100, True, False)
+    assert search_app.matches(search_app.search(search_count=1))
+
+    # newestFirst applies the limit to every partition
+    newest_first = search_app.search('/search/estimate', search_count=1, newestFirst='true')['ESTIMATE']
+    assert (newest_first['messages'], newest_first['limited']) == (200, True)
+
+    huge_limit = search_app.search('/search/estimate', search_count=1000000000)['ESTIMATE']
+    assert (huge_limit['messages'], huge_limit['limited'], huge_limit['rejected']) == (1200, False, True)
+    assert 'Search rejected' in json.dumps(search_app.search(search_count=1000000000))
+    assert 'Search rejected' in json.dumps(search_app.search(pageSize=1000000000))
+
+
+def test_expensive_searches_are_rejected_before_they_are_queued(search_app):
+    search_app.generate(partitions=2, messages=600)
+    configure_estimate(search_app, **{'max.seconds': 10})
+    search_app.configure(**{'search.admission': {'enabled': 'true', 'max.running': 1, 'queue.timeout.seconds': 5}})
+    # The environment's only running slot is taken
+    ticket = SearchAdmission.admit({'environment': search_app.environment}, 'other client')
+    try:
+        response = search_app.search()
+        stream = search_app.client.post('/search/stream', json={'environment': search_app.environment,
+                                                                'json_topics': [search_app.topic],
+                                                                'searchParam': search_app.search_token})
+        records = [json.loads(line) for line in stream.get_data(as_text=True).splitlines()]
+        status = SearchAdmission.status()[search_app.environment]
+    finally:
+        SearchAdmission.release(ticket)
+
+    assert 'Search rejected' in json.dumps(response)
+    assert records[0]['type'] == 'error' and 'Search rejected' in records[0]['error']
+    assert records[-1]['type'] == 'end'
+    assert (status['running'], status['queued']) == (1, 0)
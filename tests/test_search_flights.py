@@ -0,0 +1,153 @@
+"""
+Request coalescing: identical searches running at the same time are run once, their requests share the result.
+"""
+import threading
+
+import pytest
+
+import constants
+from config_handler import ConnectionConfig
+from error_handler import ErrorHandler
+from search_flights import SearchFlights
+from search_metrics import SearchMetrics
+
+
+class Searches:
+    """Searches run through SearchFlights on threads, held until released"""
+
+    def __init__(self, monkeypatch):
+        self.runs = []
+        self.release = threading.Event()
+        self.results = {}
+        self.errors = {}
+        self.threads = []
+        self.coalesced = []
+        self.condition = threading.Condition()
+        record_coalesced = SearchMetrics.record_coalesced
+
+        def count_coalesced(environment):
+            with self.condition:
+                self.coalesced.append(environment)
+                self.condition.notify_all()
+            record_coalesced(environment)
+
+        monkeypatch.setattr(SearchMetrics, 'record_coalesced', count_coalesced)
+
+    def start(self, name, params, error=None):
+        def search():
+            with self.condition:
+                self.runs.append(name)
+                self.condition.notify_all()
+            self.release.wait(5)
+            if error is not None:
+                raise error
+            return {'JSON_TOPIC_topic': [name], constants.RESPONSE_STATS_KEY: {'seconds': 1.0}}
+
+        def run():
+            try:
+                self.results[name] = SearchFlights.run(params, search)
+            except Exception as e:
+                self.errors[name] = e
+
+        thread = threading.Thread(target=run)
+        self.threads.append(thread)
+        thread.start()
+
+    def wait_for(self, condition):
+        with self.condition:
+            assert self.condition.wait_for(condition, 5)
+
+    def finish(self):
+        self.release.set()
+        for thread in self.threads:
+            thread.join(5)
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    monkeypatch.setattr(ConnectionConfig, 'connection_details', {'search.coalescing.enabled': 'true'})
+    searches = Searches(monkeypatch)
+    yield searches
+    searches.finish()
+
+
+def params(search_terms=('needle',), include_stats='false'):
+    return {constants.PARAM_ENVIRONMENT_KEY: 'test', constants.PARAM_JSON_TOPICS_KEY: {'b', 'a'},
+            constants.PARAM_SEARCH_TERMS_KEY: search_terms, constants.PARAM_INCLUDE_STATS_KEY: include_stats}
+
+
+def test_identical_searches_run_once(searches):
+    searches.start('leader', params())
+    searches.wait_for(lambda: searches.runs)
+    for index in range(3):
+        searches.start('follower-' + str(index), params())
+    searches.wait_for(lambda: len(searches.coalesced) == 3)
+
+    searches.finish()
+
+    assert searches.runs == ['leader']
+    assert {name: result['JSON_TOPIC_topic'] for name, result in searches.results.items()} == {
+        name: ['leader'] for name in ('leader', 'follower-0', 'follower-1', 'follower-2')}
+
+
+def test_leader_stats_count_the_coalesced_requests(searches):
+    searches.start('leader', params(include_stats='true'))
+    searches.wait_for(lambda: searches.runs)
+    searches.start('follower', params(include_stats='true'))
+    searches.wait_for(lambda: searches.coalesced)
+
+    searches.finish()
+
+    assert searches.results['leader'][constants.RESPONSE_STATS_KEY]['coalesced'] == 1
+    # Every request has its own response dict, sharing the matches
+    assert searches.results['follower'] is not searches.results['leader']
+    assert searches.results['follower']['JSON_TOPIC_topic'] is searches.results['leader']['JSON_TOPIC_topic']
+    searches.results['follower'][constants.RESPONSE_STATS_KEY]['seconds'] = 2.0
+    assert searches.results['leader'][constants.RESPONSE_STATS_KEY]['seconds'] == 1.0
+
+
+def test_followers_get_the_leaders_error(searches):
+    searches.start('leader', params(), error=ValueError('broker unavailable'))
+    searches.wait_for(lambda: searches.runs)
+    searches.start('follower', params())
+    searches.wait_for(lambda: searches.coalesced)
+
+    searches.finish()
+
+    assert isinstance(searches.errors['leader'], ValueError)
+    assert isinstance(searches.errors['follower'], ErrorHandler)
+    assert str(searches.errors['follower']) == 'broker unavailable'
+
+
+def test_searches_with_different_params_are_not_coalesced(searches):
+    searches.start('needle', params())
+    searches.start('other', params(search_terms=('other',)))
+    searches.start('stats', params(include_stats='true'))
+    searches.wait_for(lambda: len(searches.runs) == 3)
+
+    searches.finish()
+
+    assert sorted(searches.runs) == ['needle', 'other', 'stats']
+    assert not searches.coalesced
+
+
+def test_later_identical_searches_run_again(searches):
+    searches.release.set()
+    searches.start('first', params())
+    searches.threads[0].join(5)
+    searches.start('second', params())
+
+    searches.finish()
+
+    assert searches.runs == ['first', 'second']
+
+
+def test_coalescing_is_disabled_by_default(searches, monkeypatch):
+    monkeypatch.setattr(ConnectionConfig, 'connection_details', {})
+    for name in ('first', 'second'):
+        searches.start(name, params())
+    searches.wait_for(lambda: len(searches.runs) == 2)
+
+    searches.finish()
+
+    assert not searches.coalesced
@@ -0,0 +1,137 @@
+"""
+Background searches through the /search/jobs routes: job states, cancellation, deadlines and the max.jobs limit.
+"""
+import threading
+import time
+
+import pytest
+
+import fake_kafka
+
+
+class ConsumeGate:
+    """Holds consume() calls of the fake consumers after the first 'allowed' calls until opened"""
+
+    def __init__(self, monkeypatch, allowed):
+        self.allowed = allowed
+        self.calls = 0
+        self.opened = threading.Event()
+        self.lock = threading.Lock()
+        consume = fake_kafka.FakeConsumer.consume
+
+        def gated_consume(consumer, num_messages=1, timeout=-1):
+            with self.lock:
+                self.calls += 1
+                held = self.calls > self.allowed
+            if held:
+                self.opened.wait(self.hold_seconds)
+            return consume(consumer, num_messages, timeout)
+
+        self.hold_seconds = 5
+        monkeypatch.setattr(fake_kafka.FakeConsumer, 'consume', gated_consume)
+
+
+@pytest.fixture
+def gate(search_app, monkeypatch):
+    # Small batches scanned by a single partition worker, so a held scan has only read part of the topic
+    search_app.configure(**{'consume.batch.size': 50, 'partition.workers': {search_app.environment: 1}})
+    search_app.generate(partitions=2, messages=400, selectivity=.1)
+    gate = ConsumeGate(monkeypatch, allowed=2)
+    yield gate
+    gate.opened.set()
+
+
+def submit(search_app, **params):
+    return search_app.search('/search/jobs', **params)
+
+
+def status(search_app, job_id):
+    return search_app.client.get('/search/jobs/' + job_id).get_json()
+
+
+def results(search_app, job_id):
+    return search_app.client.get('/search/jobs/' + job_id + '/results').get_json()
+
+
+def wait_for_state(search_app, job_id, *states):
+    started = time.monotonic()
+    while time.monotonic() - started < 10:
+        job_status = status(search_app, job_id)
+        if job_status['state'] in states:
+            return job_status
+        time.sleep(.01)
+    raise AssertionError('job ' + job_id + ' never reached ' + str(states) + ': ' + str(job_status))
+
+
+def test_job_runs_to_completion(search_app, gate):
+    job = submit(search_app)
+    assert job['state'] in ('queued', 'running')
+
+    gate.opened.set()
+    job_status = wait_for_state(search_app, job['job_id'], 'completed')
+
+    expected = search_app.matches(search_app.search())
+    job_results = results(search_app, job['job_id'])
+    assert search_app.matches(job_results) == expected
+    assert job_status['matches'] == len(expected)
+    assert job_results['JOB']['state'] == 'completed'
+    assert job_status['topics']['JSON_TOPIC_' + search_app.topic]['state'] == 'completed'
+
+
+def test_cancelled_job_keeps_partial_matches(search_app, gate):
+    job = submit(search_app)
+    wait_for_state(search_app, job['job_id'], 'running')
+    while gate.calls <= gate.allowed:
+        time.sleep(.01)
+    partial = search_app.matches(results(search_app, job['job_id']))
+
+    cancelled = search_app.client.post('/search/jobs/' + job['job_id'] + '/cancel').get_json()
+    assert cancelled['job_id'] == job['job_id']
+    gate.opened.set()
+    job_status = wait_for_state(search_app, job['job_id'], 'cancelled')
+
+    matches = search_app.matches(results(search_app, job['job_id']))
+    all_matches = search_app.matches(search_app.search())
+    assert partial
+    assert 0 < len(matches) < len(all_matches)
+    assert all(match in all_matches for match in matches)
+    assert job_status['matches'] == len(matches)
+
+
+def test_job_past_its_deadline_is_partial(search_app, gate):
+    # Held scans resume after the one second deadline
+    gate.hold_seconds = 1.2
+    job = submit(search_app, deadlineSeconds=1)
+    assert job['deadline_seconds'] == 1
+
+    job_status = wait_for_state(search_app, job['job_id'], 'partial', 'completed')
+    gate.opened.set()
+
+    assert job_status['state'] == 'partial'
+    assert job_status['topics']['JSON_TOPIC_' + search_app.topic]['state'] == 'partial'
+    assert 0 < len(search_app.matches(results(search_app, job['job_id']))) < len(
+        search_app.matches(search_app.search()))
+
+
+def test_jobs_beyond_max_jobs_are_rejected(search_app, gate):
+    search_app.configure(**{'search.jobs': {'max.running': 1, 'max.jobs': 2}})
+    running = submit(search_app)
+    queued = submit(search_app)
+    wait_for_state(search_app, running['job_id'], 'running')
+    assert status(search_app, queued['job_id'])['state'] == 'queued'
+
+    rejected = submit(search_app)
+    assert 'Too many search jobs' in rejected['ERROR']
+
+    # Finished jobs make room for new ones
+    search_app.client.post('/search/jobs/' + queued['job_id'] + '/cancel')
+    search_app.client.post('/search/jobs/' + running['job_id'] + '/cancel')
+    gate.opened.set()
+    wait_for_state(search_app, queued['job_id'], 'cancelled')
+    wait_for_state(search_app, running['job_id'], 'cancelled')
+    assert submit(search_app)['state'] in ('queued', 'running', 'completed')
+
+
+def test_unknown_job(search_app):
+    assert 'Unknown or expired search job' in status(search_app, 'missing')['ERROR']
+    assert 'Unknown or expired search job' in results(search_app, 'missing')['ERROR']
@@ -0,0 +1,167 @@
+"""
+SearchMatcher: several search terms and regular expressions tested in one pass, matches tagged with their terms.
+"""
+import pytest
+
+from error_handler import ErrorHandler
+from message_filter import FieldPredicates, SearchMatcher
+
+
+def test_normalize_terms_lower_cases_literals_and_drops_empty_and_duplicate_terms():
+    terms = SearchMatcher.normalize_terms([' Order ', 'order', '', 're:Ord[0-9]+', 're:', 42, 'NEW'])
+
+    assert terms == ('order', 're:Ord[0-9]+', '42', 'new')
+
+
+def test_match_returns_the_terms_found():
+    matcher = SearchMatcher.for_terms(('order', 'paid', 're:id-[0-9]{3}\\b'))
+
+    assert matcher.match("{'order': 'x', 'id': 'ID-123'}") == ['order', 're:id-[0-9]{3}\\b']
+    assert matcher.match("{'status': 'paid', 'id': 'id-1234'}") == ['paid']
+    assert matcher.match("{'status': 'new'}") == []
+
+
+def test_literal_terms_sharing_a_prefix_are_all_found():
+    matcher = SearchMatcher.for_terms(('ord', 'order', 'orders', 'other'))
+
+    assert matcher.match('the orders') == ['ord', 'order', 'orders']
+    assert matcher.match('an ord') == ['ord']
+    assert matcher.match('other') == ['other']
+    assert matcher.match('or') == []
+
+
+def test_regex_terms_are_case_insensitive():
+    matcher = SearchMatcher.for_terms(('re:^\\{.*NEEDLE',))
+
+    assert matcher.match('{"note": "a needle"}') == ['re:^\\{.*NEEDLE']
+
+
+def test_match_message_applies_field_filters_before_terms():
+    field_filters = FieldPredicates.normalize_filters([{'field': 'status', 'value': 'NEW'}])
+    matcher = SearchMatcher.for_terms(('cust-1',), field_filters)
+
+    assert matcher.match_message({'status': 'NEW', 'customer': 'CUST-1'}) == ['cust-1']
+    assert matcher.match_message({'status': 'PAID', 'customer': 'cust-1'}) is None
+    assert matcher.match_message({'status': 'NEW', 'customer': 'cust-2'}) is None
+    assert SearchMatcher.for_terms((), field_filters).match_message({'status': 'NEW'}) == []
+
+
+def test_only_multi_term_and_regex_searches_tag_matches():
+    assert not SearchMatcher.for_terms(('order',)).tag_matches
+    assert SearchMatcher.for_terms(('order', 'paid')).tag_matches
+    assert SearchMatcher.for_terms(('re:ord',)).tag_matches
+
+
+def test_invalid_regex_is_rejected():
+    with pytest.raises(ErrorHandler):
+        SearchMatcher(('re:(unclosed',))
+
+
+ORDER = {'id': 'ord-1', 'total': 42.5, 'count': 3, 'code': '007', 'paid': True, 'note': None,
+         'customer': {'name': 'Ada Lovelace', 'address': {'city': 'London', 'zip': 'N1'}},
+         'items': [{'sku': 'A-1', 'qty': 2}, {'sku': 'B-2', 'qty': 10}], 'tags': ['Rush', 'gift'],
+         'created': '2020-09-13T12:30:00Z'}
+
+
+def predicates(*field_filters):
+    return FieldPredicates(FieldPredicates.normalize_filters(list(field_filters)))
+
+
+def test_equals_on_nested_fields_and_list_items():
+    assert predicates({'field': 'customer.address.city', 'value': 'London'}).matches(ORDER)
+    assert not predicates({'field': 'customer.address.city', 'value': 'london'}).matches(ORDER)
+    assert predicates({'field': 'items.sku', 'value': 'B-2'}).matches(ORDER)
+    assert predicates({'field': 'items.1.sku', 'value': 'B-2'}).matches(ORDER)
+    assert not predicates({'field': 'items.0.sku', 'value': 'B-2'}).matches(ORDER)
+    assert predicates({'field': 'tags', 'value': 'gift'}).matches(ORDER)
+
+
+def test_equals_compares_numbers_as_numbers_and_other_values_as_text():
+    assert predicates({'field': 'count', 'value': 3.0}).matches(ORDER)
+    assert predicates({'field': 'count', 'value': '3'}).matches(ORDER)
+    assert predicates({'field': 'total', 'value': 42.5}).matches(ORDER)
+    # '007' is a string field, compared as text with the number's text
+    assert not predicates({'field': 'code', 'value': 7}).matches(ORDER)
+    assert predicates({'field': 'code', 'value': '007'}).matches(ORDER)
+    assert predicates({'field': 'paid', 'value': True}).matches(ORDER)
+    assert predicates({'field': 'paid', 'value': 'true'}).matches(ORDER)
+    assert not predicates({'field': 'paid', 'value': 1}).matches(ORDER)
+    assert predicates({'field': 'note', 'value': None}).matches(ORDER)
+
+
+def test_contains_is_case_insensitive():
+    assert predicates({'field': 'customer.name', 'op': 'contains', 'value': 'LOVE'}).matches(ORDER)
+    assert predicates({'field': 'tags', 'op': 'contains', 'value': 'rus'}).matches(ORDER)
+    assert not predicates({'field': 'customer.name', 'op': 'contains', 'value': 'babbage'}).matches(ORDER)
+    # Nested records are not searched as text
+    assert not predicates({'field': 'customer', 'op': 'contains', 'value': 'London'}).matches(ORDER)
+
+
+def test_range_on_numbers_and_text():
+    assert predicates({'field': 'items.qty', 'op': 'range', 'min': 5}).matches(ORDER)
+    assert not predicates({'field': 'items.qty', 'op': 'range', 'min': 11}).matches(ORDER)
+    assert predicates({'field': 'total', 'op': 'range', 'min': '40', 'max': 42.5}).matches(ORDER)
+    assert not predicates({'field': 'total', 'op': 'range', 'max': 42}).matches(ORDER)
+    assert predicates({'field': 'created', 'op': 'range', 'min': '2020-09-13T00:00:00Z',
+                       'max': '2020-09-14T00:00:00Z'}).matches(ORDER)
+    assert not predicates({'field': 'created', 'op': 'range', 'min': '2020-09-14'}).matches(ORDER)
+    # Text values are not in a numeric range
+    assert not predicates({'field': 'id', 'op': 'range', 'min': 0}).matches(ORDER)
+
+
+def test_exists():
+    assert predicates({'field': 'customer.address.zip', 'op': 'exists'}).matches(ORDER)
+    assert predicates({'field': 'customer.phone', 'op': 'exists', 'value': False}).matches(ORDER)
+    assert not predicates({'field': 'customer.phone', 'op': 'exists'}).matches(ORDER)
+    # null is not present
+    assert not predicates({'field': 'note', 'op': 'exists'}).matches(ORDER)
+    assert predicates({'field': 'note', 'op': 'exists', 'value': 'false'}).matches(ORDER)
+
+
+def test_missing_paths_never_match_a_value():
+    for field in ('missing', 'customer.missing', 'customer.name.first', 'items.5.sku', 'items.sku.x', 'tags.0.x'):
+        assert not predicates({'field': field, 'value': 'x'}).matches(ORDER)
+        assert not predicates({'field': field, 'op': 'contains', 'value': ''}).matches(ORDER)
+        assert not predicates({'field': field, 'op': 'range', 'min': 0}).matches(ORDER)
+    assert not predicates({'field': 'id', 'value': 'ord-1'}).matches(['ord-1'])
+    assert not predicates({'field': 'id', 'value': 'ord-1'}).matches(None)
+
+
+def test_every_filter_must_hold():
+    assert predicates({'field': 'count', 'value': 3}, {'field': 'paid', 'value': True}).matches(ORDER)
+    assert not predicates({'field': 'count', 'value': 3}, {'field': 'paid', 'value': False}).matches(ORDER)
+    assert predicates().matches(ORDER)
+
+
+def test_normalize_filters():
+    assert FieldPredicates.normalize_filters('{"field": " status ", "value": "NEW"}') == (
+        ('status', 'equals', 'NEW', None, None),)
+    assert FieldPredicates.normalize_filters([{'field': 'a', 'op': 'Exists', 'value': 'false'}]) == (
+        ('a', 'exists', False, None, None),)
+    assert FieldPredicates.normalize_filters(None) == ()
+    for invalid in ('{not json', 'true', [{'value': 1}], [{'field': 'a', 'op': 'like', 'value': 1}],
+                    [{'field': 'a', 'op': 'contains'}], [{'field': 'a', 'op': 'range'}],
+                    [{'field': 'a', 'value': {'nested': 1}}]):
+        with pytest.raises(ErrorHandler):
+            FieldPredicates.normalize_filters(invalid)
+
+
+def test_raw_texts_of_string_and_whole_number_filters():
+    assert predicates({'field': 'a', 'value': 'NEW'}, {'field': 'b', 'op': 'contains', 'value': 'Rush'},
+                      {'field': 'c', 'value': 7}, {'field': 'd', 'value': 2.5}, {'field': 'e', 'value': True},
+                      {'field': 'f', 'op': 'range', 'min': 1}).raw_texts() == ['new', 'rush', '7']
+
+
+def test_multi_term_search_returns_messages_matching_any_term_tagged_with_their_terms(search_app):
+    search_app.generate(partitions=2, messages=300)
+    token = search_app.search_token
+    # Terms are searched in the text of the decoded message, str(message).lower()
+    regex = "re:'id': 'msg-1-1[0-9]'"
+
+    matches = search_app.matches(search_app.search(searchParam=[token, regex]))
+
+    ids = {match['id']: match['matched_terms'] for match in matches}
+    for partition_id, offset, key, value, timestamp in search_app.all_messages():
+        expected = ([token] if token.encode() in value else []) + (
+            [regex] if partition_id == 1 and 10 <= offset < 20 else [])
+        assert ids.get(key.decode(), []) == expected
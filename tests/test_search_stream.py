@@ -0,0 +1,96 @@
+"""
+Streaming searches (/search/stream): NDJSON records written as they are found, closing the stream ends the scans.
+"""
+import json
+import threading
+import time
+
+import pytest
+
+from kafka_manager import ConsumerPool
+
+
+@pytest.fixture
+def borrowed(monkeypatch):
+    """Consumers borrowed from the consumer pools and not returned yet"""
+    borrowed = []
+    lock = threading.Lock()
+    acquire, release = ConsumerPool.acquire, ConsumerPool.release
+
+    def counted_acquire(pool):
+        consumer = acquire(pool)
+        with lock:
+            borrowed.append(consumer)
+        return consumer
+
+    def counted_release(pool, consumer, discard=False):
+        with lock:
+            borrowed.remove(consumer)
+        release(pool, consumer, discard)
+
+    monkeypatch.setattr(ConsumerPool, 'acquire', counted_acquire)
+    monkeypatch.setattr(ConsumerPool, 'release', counted_release)
+    return borrowed
+
+
+def stream(search_app, **params):
+    body = {'environment': search_app.environment, 'json_topics': [search_app.topic],
+            'searchParam': search_app.search_token}
+    body.update(params)
+    return search_app.client.post('/search/stream', json=body)
+
+
+def test_stream_records(search_app):
+    search_app.generate(partitions=3, messages=200)
+
+    response = stream(search_app)
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    response_key = 'JSON_TOPIC_' + search_app.topic
+    assert records[0] == {'type': 'topic_start', 'topic': response_key}
+    matches = [record for record in records if record['type'] == 'match']
+    expected = search_app.matches(search_app.search())
+    assert sorted(json.dumps(match['message'], sort_keys=True) for match in matches) == sorted(
+        json.dumps(match, sort_keys=True) for match in expected)
+    assert all(match['topic'] == response_key and search_app.search_token in json.dumps(match['message'])
+               for match in matches)
+
+    partition_summaries = [record for record in records if record['type'] == 'partition_summary']
+    assert sorted(summary['partition'] for summary in partition_summaries) == [0, 1, 2]
+    assert sum(summary['matches'] for summary in partition_summaries) == len(matches)
+    assert sum(summary['scanned'] for summary in partition_summaries) == 600
+
+    topic_summary, end = records[-2:]
+    assert topic_summary['type'] == 'topic_summary'
+    assert (topic_summary['partitions'], topic_summary['scanned'], topic_summary['matches']) == (3, 600, len(matches))
+    assert topic_summary['complete']
+    assert end == {'type': 'end', 'matches': len(matches)}
+
+
+def test_invalid_stream_request_is_rejected_before_streaming(search_app):
+    search_app.generate(partitions=1, messages=10)
+
+    response = stream(search_app, json_topics=[])
+
+    assert response.mimetype == 'application/json'
+    assert response.get_json()['ERROR']
+
+
+def test_closing_the_stream_releases_consumers(search_app, borrowed):
+    # More matches than the stream's record queue holds, so the scans wait on the client
+    search_app.generate(partitions=4, messages=1000, selectivity=.5)
+
+    response = stream(search_app)
+    records = iter(response.response)
+    first = [json.loads(next(records)) for _ in range(10)]
+    assert any(record['type'] == 'match' for record in first)
+    assert borrowed
+    response.close()
+
+    started = time.monotonic()
+    while borrowed and time.monotonic() - started < 5:
+        time.sleep(.01)
+    assert not borrowed
+    # Every consumer is back in the pool, a new search gets them
+    assert search_app.matches(search_app.search())
@@ -0,0 +1,141 @@
+"""
+Segment cache: records written to disk and read back, offset gaps, damaged files and eviction, and searches with the
+cache returning the matches of searches without it.
+"""
+import glob
+import os
+
+import pytest
+
+from error_handler import CorruptSegment
+from segment_cache import CachedMessage, SegmentCache
+
+
+def enable_cache(search_app, **cache_config):
+    search_app.configure(**{'segment.cache': dict({'enabled': 'true'}, **cache_config)})
+
+
+def write_segment(base_offset, end_offset, offsets, partition=0, value_bytes=10):
+    writer = SegmentCache.open_writer('test', 'topic', partition, base_offset)
+    for offset in offsets:
+        writer.append(CachedMessage('topic', partition, offset, (1, 1000 + offset), b'key-' + str(offset).encode(),
+                                    b'v' * value_bytes if offset % 3 else None))
+    SegmentCache.seal(writer, end_offset)
+
+
+def cached_pieces(start_offset, stop_offset, partition=0):
+    return [(piece_start, piece_stop, segment is not None) for piece_start, piece_stop, segment
+            in SegmentCache.plan('test', 'topic', partition, start_offset, stop_offset)]
+
+
+def read(start_offset, stop_offset, partition=0):
+    segment = [segment for piece_start, piece_stop, segment
+               in SegmentCache.plan('test', 'topic', partition, start_offset, stop_offset) if segment][0]
+    return list(segment.read('topic', partition, start_offset, stop_offset))
+
+
+def test_records_are_read_back(search_app):
+    enable_cache(search_app)
+    write_segment(10, 25, [10, 11, 15, 20])
+
+    msgs = read(10, 25)
+
+    assert [(msg.offset(), msg.timestamp(), msg.key(), msg.value()) for msg in msgs] == [
+        (10, (1, 1010), b'key-10', b'v' * 10), (11, (1, 1011), b'key-11', b'v' * 10),
+        (15, (1, 1015), b'key-15', None), (20, (1, 1020), b'key-20', b'v' * 10)]
+
+
+def test_offset_gaps_are_covered_by_the_segment(search_app):
+    enable_cache(search_app)
+    # Offsets 12-14 and 16-19 are transaction markers or compacted away, 21-24 were read without a message
+    write_segment(10, 25, [10, 11, 15, 20])
+
+    assert cached_pieces(0, 30) == [(0, 10, False), (10, 25, True), (25, 30, False)]
+    assert cached_pieces(12, 22) == [(12, 22, True)]
+    assert [msg.offset() for msg in read(12, 21)] == [15, 20]
+
+
+def test_segments_are_loaded_from_disk(search_app):
+    enable_cache(search_app)
+    write_segment(0, 5, range(5))
+    write_segment(5, 9, range(5, 9))
+    SegmentCache._SegmentCache__segments.clear()
+
+    assert cached_pieces(0, 10) == [(0, 5, True), (5, 9, True), (9, 10, False)]
+    assert [msg.offset() for msg in read(5, 9)] == [5, 6, 7, 8]
+
+
+@pytest.mark.parametrize('damage', ['truncate', 'truncate_record', 'key_length', 'trailer'])
+def test_damaged_segments_are_detected(search_app, damage):
+    enable_cache(search_app)
+    write_segment(0, 10, range(10))
+    path = glob.glob(os.path.join('segment_cache', 'test', 'topic', '0', '*.seg'))[0]
+    with open(path, 'r+b') as segment_file:
+        data = segment_file.read()
+        if damage == 'truncate':
+            # Cut at a record boundary, only the trailer tells
+            segment_file.truncate(len(data) - 12)
+        elif damage == 'truncate_record':
+            segment_file.truncate(len(data) // 2)
+        elif damage == 'key_length':
+            segment_file.seek(17)
+            segment_file.write(b'\x7f\xff\xff\xff')
+        else:
+            segment_file.seek(len(data) - 12)
+            segment_file.write(b'\x00' * 12)
+    SegmentCache._SegmentCache__segments.clear()
+
+    with pytest.raises(CorruptSegment):
+        read(0, 10)
+
+
+def test_least_recently_used_segments_are_evicted(search_app):
+    enable_cache(search_app)
+    for partition in range(3):
+        write_segment(0, 10, range(10), partition=partition, value_bytes=100)
+    segment_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join('segment_cache', 'test', 'topic',
+                                                                                 '0', '*.seg')))
+    enable_cache(search_app, **{'max.bytes': 3 * segment_bytes})
+    # Partition 0 is read, partition 1 is now the least recently used
+    read(0, 10, partition=0)
+
+    write_segment(0, 10, range(10), partition=3, value_bytes=100)
+
+    cached = [cached_pieces(0, 10, partition) == [(0, 10, True)] for partition in range(4)]
+    assert cached == [True, False, True, True]
+    assert not glob.glob(os.path.join('segment_cache', 'test', 'topic', '1', '*'))
+
+
+def test_search_with_segment_cache_matches_search_without(search_app):
+    search_app.generate(partitions=3, messages=300)
+    uncached = [match['id'] for match in search_app.matches(search_app.search())]
+    enable_cache(search_app)
+
+    first = [match['id'] for match in search_app.matches(search_app.search())]
+    cached = [match['id'] for match in search_app.matches(search_app.search())]
+
+    assert first == cached == uncached
+    # The second search reads every partition from disk
+    assert search_app.delivered_messages() == 0
+
+    search_app.produce(50)
+    updated = [match['id'] for match in search_app.matches(search_app.search())]
+    assert search_app.delivered_messages() <= 3 * (50 + 1)
+    search_app.configure(**{'segment.cache': {'enabled': 'false'}})
+    assert updated == [match['id'] for match in search_app.matches(search_app.search())]
+
+
+def test_damaged_segment_is_fetched_from_kafka_again(search_app):
+    search_app.generate(partitions=1, messages=400)
+    enable_cache(search_app)
+    expected = [match['id'] for match in search_app.matches(search_app.search())]
+    path = glob.glob(os.path.join('segment_cache', search_app.environment, search_app.topic, '0', '*.seg'))[0]
+    with open(path, 'r+b') as segment_file:
+        segment_file.truncate(os.path.getsize(path) // 2)
+    SegmentCache._SegmentCache__segments.clear()
+
+    assert [match['id'] for match in search_app.matches(search_app.search())] == expected
+    assert 0 < search_app.delivered_messages() <= 400 + 1
+    # Cached again
+    search_app.search()
+    assert search_app.delivered_messages() == 0
@@ -0,0 +1,132 @@
+"""
+Shared partition scans: range bookkeeping of SharedRequest and SharedPartition, and concurrent searches served by
+shared scans returning the matches of separate scans.
+"""
+import random
+import threading
+
+from shared_scans import SharedPartition, SharedRequest
+
+
+def test_cover_removes_the_offsets_read():
+    request = SharedRequest(None, 100, 200)
+
+    request.cover(120, 150)
+    assert request.remaining == [(100, 120), (150, 200)]
+    request.cover(90, 110)
+    assert request.remaining == [(110, 120), (150, 200)]
+    request.cover(150, 200)
+    assert request.remaining == [(110, 120)]
+    request.cover(115, 115)
+    assert request.remaining == [(110, 120)]
+    request.cover(0, 1000)
+    assert request.remaining == []
+
+
+def test_empty_range_has_nothing_remaining():
+    assert SharedRequest(None, 10, 10).remaining == []
+
+
+def test_attach_limits_wanted_offsets_to_the_remaining_part_of_the_chunk():
+    request = SharedRequest(None, 100, 200)
+    request.cover(120, 150)
+
+    assert request.attach(110, 160)
+    assert [offset for offset in range(90, 210) if request.wants(offset)] == \
+        list(range(110, 120)) + list(range(150, 160))
+    assert not request.attach(120, 150)
+    assert not request.wants(130)
+    assert not request.attach(200, 300)
+
+
+def test_cover_clears_the_chunk():
+    request = SharedRequest(None, 0, 100)
+    request.attach(0, 50)
+
+    request.cover(0, 50)
+
+    assert not request.wants(10)
+    assert request.remaining == [(50, 100)]
+
+
+def test_next_chunk_continues_from_the_position_and_wraps_around():
+    partition = SharedPartition()
+    request = SharedRequest(None, 100, 300)
+
+    assert partition.next_chunk(request, 50) == (100, 150)
+    partition.position = 250
+    assert partition.next_chunk(request, 100) == (250, 300)
+    # The search joined after offsets it needs were read, wraps around to them
+    partition.position = 400
+    assert partition.next_chunk(request, 50) == (100, 150)
+    request.cover(100, 150)
+    request.cover(250, 300)
+    partition.position = 200
+    assert partition.next_chunk(request, 100) == (200, 250)
+
+
+def test_shared_pass_reads_every_offset_of_every_request_once():
+    """Requests joining a pass at random points, chunks sometimes read partially (scan deadline, end of data)"""
+    rng = random.Random(1)
+    for _ in range(200):
+        partition = SharedPartition()
+        requests = []
+        reads = {}
+        for step in range(400):
+            if len(requests) < 4 and rng.random() < .2:
+                start_offset = rng.randrange(0, 500)
+                stop_offset = start_offset + rng.randrange(0, 500)
+                requests.append(SharedRequest(None, start_offset, stop_offset))
+                reads[requests[-1]] = (range(start_offset, stop_offset), [])
+            active = [request for request in requests if request.remaining]
+            if not active:
+                continue
+            driver = rng.choice(active)
+            chunk_start, chunk_stop = partition.next_chunk(driver, rng.randint(1, 120))
+            attached = [request for request in active if request.attach(chunk_start, chunk_stop)]
+            assert driver in attached
+            read_to = chunk_stop if rng.random() < .8 else rng.randint(chunk_start, chunk_stop)
+            for offset in range(chunk_start, read_to):
+                for request in attached:
+                    if request.wants(offset):
+                        reads[request][1].append(offset)
+            for request in attached:
+                request.cover(chunk_start, read_to)
+            partition.position = read_to
+        for request, (offsets, read_offsets) in reads.items():
+            remaining = [offset for start_offset, stop_offset in request.remaining
+                         for offset in range(start_offset, stop_offset)]
+            # Offsets are read at most once, and either read or still remaining
+            assert len(read_offsets) == len(set(read_offsets))
+            assert sorted(read_offsets + remaining) == list(offsets)
+
+def test_concurrent_searches_share_scans_and_return_every_match(search_app, monkeypatch):
+    import fake_kafka
+    from search_metrics import SearchMetrics
+
+    search_app.generate(partitions=2, messages=2000, selectivity=.02)
+    expected = sorted(match['id'] for match in search_app.matches(search_app.search()))
+    # Small, slow fetches so that searches overlap and join running scans
+    search_app.configure(**{'shared.scans': {'enabled': 'true', 'chunk.size': 100},
+                            'consumer.tuning': {'max.partition.fetch.bytes': 20000}})
+    monkeypatch.setattr(fake_kafka.FakeConsumer, 'fetch_latency_seconds', .005)
+    joins = []
+    record_shared_scan_join = SearchMetrics.record_shared_scan_join
+    monkeypatch.setattr(SearchMetrics, 'record_shared_scan_join',
+                        lambda environment, topic: joins.append(topic) or record_shared_scan_join(environment, topic))
+    results = {}
+
+    def search(index):
+        response = search_app.client.post('/search', json={'environment': search_app.environment,
+                                                           'json_topics': [search_app.topic],
+                                                           'searchParam': search_app.search_token})
+        results[index] = sorted(match['id'] for match in search_app.matches(response.get_json()))
+
+    threads = [threading.Thread(target=search, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {index: expected for index in range(4)}
+    assert joins
@@ -0,0 +1,77 @@
+"""
+Token index: TopicIndex candidates hold every message containing a search term, and searches of an indexed topic
+return the matches of a full scan.
+"""
+import json
+import random
+import time
+
+from token_index import TokenIndex, TopicIndex
+
+WORDS = ('order', 'orders', 'reorder', 'new', 'paid', 'msg', 'id', 'needle7f3a', '42', '420', 'x_y', 'café')
+
+
+def test_lookup_returns_every_message_containing_a_search_term():
+    rng = random.Random(5)
+    texts = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 5))) + rng.choice(('', '-1', ':2', '.x'))
+             for _ in range(400)]
+    index = TopicIndex({0: 100})
+    index.add(0, [(100 + offset, TopicIndex.tokenize(text)) for offset, text in enumerate(texts)], 100 + len(texts))
+
+    for _ in range(300):
+        text = rng.choice(texts)
+        start = rng.randrange(len(text) + 1)
+        search_string = text[start:start + rng.randint(1, 12)]
+        lookup = index.lookup(0, [search_string], 0, 1000)
+        if lookup is None:
+            # Search strings without words are not looked up, nor ranges that are not indexed
+            assert not TopicIndex.tokenize(search_string)
+            continue
+        indexed_start, indexed_stop, candidates = lookup
+        assert (indexed_start, indexed_stop) == (100, 100 + len(texts))
+        for offset, text in enumerate(texts):
+            if search_string in text:
+                assert 100 + offset in candidates, (search_string, text)
+
+
+def test_lookup_is_limited_to_the_indexed_range():
+    index = TopicIndex({0: 10})
+    index.add(0, [(offset, {'needle'}) for offset in range(10, 20)], 20)
+
+    assert index.lookup(0, ['needle'], 12, 15) == (12, 15, [12, 13, 14])
+    assert index.lookup(0, ['needle'], 0, 30) == (10, 20, list(range(10, 20)))
+    assert index.lookup(0, ['needle'], 20, 30) is None
+    assert index.lookup(1, ['needle'], 0, 30) is None
+
+
+def wait_for_index(search_app, timeout_seconds=10):
+    deadline = time.monotonic() + timeout_seconds
+    while TokenIndex.get(search_app.environment, search_app.topic, search_app.message_type) is None:
+        assert time.monotonic() < deadline, TokenIndex.stats()
+        time.sleep(.05)
+
+
+def scanned_messages(search_app):
+    """Messages scanned by a streamed search of the test topic, from its partition summaries"""
+    response = search_app.client.post('/search/stream', json={
+        'environment': search_app.environment, 'json_topics': [search_app.topic],
+        'searchParam': search_app.search_token})
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    return sum(record['scanned'] for record in records if record['type'] == 'partition_summary')
+
+
+def test_indexed_search_returns_the_matches_of_a_full_scan(search_app):
+    search_app.generate(partitions=3, messages=1000, selectivity=.01)
+    full_scan = search_app.matches(search_app.search())
+    full_scan_messages = scanned_messages(search_app)
+
+    search_app.configure(**{'token.index': {'topics': {search_app.environment: [search_app.topic]}}})
+    TokenIndex.start_indexers()
+    wait_for_index(search_app)
+    indexed = search_app.matches(search_app.search())
+    indexed_messages = scanned_messages(search_app)
+
+    assert [match['id'] for match in indexed] == [match['id'] for match in full_scan]
+    # Only the candidate offsets (and offsets close to them) are scanned
+    assert full_scan_messages == 3000
+    assert indexed_messages < full_scan_messages / 2
@@ -0,0 +1,349 @@
+import json
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from confluent_kafka import TopicPartition
+
+import constants
+import default_constants
+from avro_client import AvroClient
+from config_handler import ConnectionConfig
+from error_handler import ErrorHandler
+from kafka_manager import ConsumerConnectionManager
+
+
+class TokenIndex:
+    """
+    Background token indexes of the hot topics listed in the 'token.index' section of main config.
+    Every listed topic gets an indexer thread, tailing all partitions on its own consumer and maintaining an inverted
+    index of the words in each decoded message (str(message).lower(), the text searched by kafka_client.py).
+    Searches of an indexed topic only read the candidate offsets returned by the index, offsets outside of the
+    indexed range (index lag, messages older than the index) are scanned as usual. Other topics are always scanned.
+    """
+    # Main config keys ('token.index' section)
+    config_token_index_key = constants.CONFIG_TOKEN_INDEX_KEY
+    config_topics_key = constants.CONFIG_TOKEN_INDEX_TOPICS_KEY
+
+    # (environment, topic) -> TopicIndexer()
+    __indexers = {}
+    __lock = threading.Lock()
+
+    @classmethod
+    def start_indexers(cls):
+        """Start an indexer for every topic listed in main config, used at application start"""
+        config = (ConnectionConfig.connection_details or {}).get(cls.config_token_index_key) or {}
+        with cls.__lock:
+            for environment, topics in (config.get(cls.config_topics_key) or {}).items():
+                for topic in topics or []:
+                    if (environment, topic) not in cls.__indexers:
+                        message_type = 'avro' if topic in (ConnectionConfig.avro_topics or {}) else 'json'
+                        indexer = TopicIndexer(environment, topic, message_type, config)
+                        cls.__indexers[(environment, topic)] = indexer
+                        indexer.start()
+
+    @classmethod
+    def stop_indexers(cls):
+        """Stop all indexers, used at application shutdown"""
+        with cls.__lock:
+            indexers = list(cls.__indexers.values())
+            cls.__indexers.clear()
+        for indexer in indexers:
+            indexer.stop()
+
+    @classmethod
+    def get(cls, environment, topic, message_type):
+        """
+        :return: TopicIndex() of topic, None if topic is not indexed or its index is still being built
+        """
+        indexer = cls.__indexers.get((environment, topic))
+        if indexer is None or indexer.message_type != message_type:
+            return None
+        return indexer.index
+
+    @classmethod
+    def stats(cls):
+        """:return: dict() environment -> topic -> index status (state, lag, size, build time)"""
+        stats = {}
+        for (environment, topic), indexer in list(cls.__indexers.items()):
+            stats.setdefault(environment, {})[topic] = indexer.stats()
+        return stats
+
+
+class TopicIndex:
+    """
+    Inverted index of a single topic: partition -> word -> ascending offsets of the messages containing it.
+    Each partition is indexed contiguously from its start offset up to (exclusive) its next offset.
+    """
+    word_pattern = re.compile(r'\w+')
+    # Estimated bytes per word entry (dict slot, str and array objects) and per indexed offset
+    word_overhead_bytes = 200
+    offset_bytes = array('q').itemsize
+
+    def __init__(self, start_offsets):
+        """:param start_offsets: dict() partition id -> first offset to index"""
+        self.start_offsets = dict(start_offsets)
+        self.next_offsets = dict(start_offsets)
+        self.postings = {partition_id: {} for partition_id in start_offsets}
+        self.message_count = 0
+        self.posting_count = 0
+        self.size_bytes = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def tokenize(cls, text):
+        """:return: set() of words in lower case text"""
+        return set(cls.word_pattern.findall(text))
+
+    def add(self, partition_id, indexed_msgs, next_offset):
+        """
+        :param indexed_msgs: list() of tuple() (offset, set() of words), ascending offsets
+        :param next_offset: int, every offset below has been indexed
+        """
+        with self.lock:
+            postings = self.postings[partition_id]
+            for offset, words in indexed_msgs:
+                for word in words:
+                    offsets = postings.get(word)
+                    if offsets is None:
+                        offsets = postings[word] = array('q')
+                        self.size_bytes += self.word_overhead_bytes + len(word)
+                    offsets.append(offset)
+                self.posting_count += len(words)
+                self.size_bytes += self.offset_bytes * len(words)
+            self.message_count += len(indexed_msgs)
+            self.next_offsets[partition_id] = max(self.next_offsets[partition_id], next_offset)
+
+    def lookup(self, partition_id, search_terms, start_offset, stop_offset):
+        """
+        Candidate offsets of messages that may contain any of the search terms. Every message containing a search
+        term within the indexed range is a candidate, candidates still have to be read and verified.
+        :param search_terms: list() of literal search terms
+        :param start_offset: int, first offset searched
+        :param stop_offset: int, exclusive stop offset
+        :return: tuple() (indexed start offset, exclusive indexed stop offset, list() of ascending candidate
+                 offsets), None if no part of the range is indexed or a search term has no words
+        """
+        if partition_id not in self.postings or not search_terms:
+            return None
+        terms_pieces = [(term, list(self.word_pattern.finditer(term))) for term in search_terms]
+        if not all(pieces for term, pieces in terms_pieces):
+            return None
+        with self.lock:
+            indexed_start = max(start_offset, self.start_offsets[partition_id])
+            indexed_stop = min(stop_offset, self.next_offsets[partition_id])
+            if indexed_start >= indexed_stop:
+                return None
+            postings = self.postings[partition_id]
+            candidates = set()
+            for search_string, pieces in terms_pieces:
+                term_candidates = None
+                for offsets_lists in self.__matching_postings(postings, search_string, pieces):
+                    piece_candidates = set()
+                    for offsets in offsets_lists:
+                        piece_candidates.update(offsets[bisect_left(offsets, indexed_start):
+                                                        bisect_left(offsets, indexed_stop)])
+                    term_candidates = piece_candidates if term_candidates is None else \
+                        term_candidates & piece_candidates
+                candidates |= term_candidates
+        return indexed_start, indexed_stop, sorted(candidates)
+
+    @staticmethod
+    def __matching_postings(postings, search_string, pieces):
+        """
+        Offsets lists of the words that may hold the words of the search string. A word of the search string that
+        is followed (preceded) by another character of the search string must end (start) a word of the message.
+        Words bounded on both sides are looked up directly and candidates must hold all of them, otherwise the
+        longest word is matched against every indexed word.
+        :return: list() with, for each word of the search string used, a list() of offsets lists
+        """
+        exact = {piece.group() for piece in pieces if piece.start() > 0 and piece.end() < len(search_string)}
+        if exact:
+            return [[postings[word]] if word in postings else [] for word in exact]
+
+        piece = max(pieces, key=lambda match: len(match.group()))
+        word = piece.group()
+        if piece.start() > 0:
+            matches = lambda indexed: indexed.startswith(word)
+        elif piece.end() < len(search_string):
+            matches = lambda indexed: indexed.endswith(word)
+        else:
+            matches = lambda indexed: word in indexed
+        return [[offsets for indexed, offsets in postings.items() if matches(indexed)]]
+
+
+class TopicIndexer(threading.Thread):
+    """
+    Builds and tails the index of a single topic. A new index is built in the background, while the previous one
+    keeps serving searches, every 'rebuild.interval.seconds', when the topic is recreated or a partition holds more
+    than twice 'max.messages.per.partition' indexed messages.
+    """
+    config_max_messages_key = constants.CONFIG_TOKEN_INDEX_MAX_MESSAGES_KEY
+    config_rebuild_interval_key = constants.CONFIG_TOKEN_INDEX_REBUILD_INTERVAL_KEY
+    config_consume_batch_size_key = constants.CONFIG_CONSUME_BATCH_SIZE_KEY
+    config_consume_timeout_key = constants.CONFIG_CONSUME_TIMEOUT_KEY
+    default_max_messages = default_constants.DEFAULT_TOKEN_INDEX_MAX_MESSAGES
+    default_rebuild_interval = default_constants.DEFAULT_TOKEN_INDEX_REBUILD_INTERVAL_SECONDS
+    default_refresh_seconds = default_constants.DEFAULT_TOKEN_INDEX_REFRESH_SECONDS
+    default_retry_seconds = default_constants.DEFAULT_TOKEN_INDEX_RETRY_SECONDS
+    default_offsets_lookup_timeout = default_constants.DEFAULT_OFFSETS_LOOKUP_TIMEOUT_SECONDS
+    default_consume_batch_size = default_constants.DEFAULT_CONSUME_BATCH_SIZE
+    default_consume_timeout = default_constants.DEFAULT_CONSUME_TIMEOUT_SECONDS
+
+    # Status keys
+    status_state_key = constants.INDEX_STATUS_STATE_KEY
+    status_partitions_key = constants.INDEX_STATUS_PARTITIONS_KEY
+    status_indexed_from_key = constants.INDEX_STATUS_INDEXED_FROM_KEY
+    status_indexed_to_key = constants.INDEX_STATUS_INDEXED_TO_KEY
+    status_high_watermark_key = constants.INDEX_STATUS_HIGH_WATERMARK_KEY
+    status_lag_key = constants.INDEX_STATUS_LAG_KEY
+    status_messages_key = constants.INDEX_STATUS_MESSAGES_KEY
+    status_postings_key = constants.INDEX_STATUS_POSTINGS_KEY
+    status_size_bytes_key = constants.INDEX_STATUS_SIZE_BYTES_KEY
+    status_builds_key = constants.INDEX_STATUS_BUILDS_KEY
+    status_last_build_seconds_key = constants.INDEX_STATUS_LAST_BUILD_SECONDS_KEY
+    status_error_key = constants.INDEX_STATUS_ERROR_KEY
+
+    def __init__(self, environment, topic, message_type, index_config):
+        super().__init__(name='token-index-' + environment + '-' + topic, daemon=True)
+        self.environment = environment
+        self.topic = topic
+        self.message_type = message_type
+        self.max_messages = int(index_config.get(self.config_max_messages_key, self.default_max_messages))
+        self.rebuild_interval = float(index_config.get(self.config_rebuild_interval_key,
+                                                       self.default_rebuild_interval))
+        # Index serving searches, None until the first build completes
+        self.index = None
+        self.high_watermarks = {}
+        self.state = 'starting'
+        self.builds = 0
+        self.last_build_seconds = None
+        self.error = None
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.__build_and_tail()
+            except Exception as e:
+                self.state = 'error'
+                self.error = str(e)
+                self.stopped.wait(self.default_retry_seconds)
+
+    def stats(self):
+        index = self.index
+        stats = {self.status_state_key: self.state,
+                 self.status_builds_key: self.builds,
+                 self.status_last_build_seconds_key: self.last_build_seconds,
+                 self.status_error_key: self.error}
+        if index is not None:
+            partitions = {}
+            for partition_id, next_offset in index.next_offsets.items():
+                high_watermark = self.high_watermarks.get(partition_id, next_offset)
+                partitions[partition_id] = {self.status_indexed_from_key: index.start_offsets[partition_id],
+                                            self.status_indexed_to_key: next_offset,
+                                            self.status_high_watermark_key: high_watermark,
+                                            self.status_lag_key: max(0, high_watermark - next_offset)}
+            stats.update({self.status_lag_key: sum(partition[self.status_lag_key]
+                                                   for partition in partitions.values()),
+                          self.status_messages_key: index.message_count,
+                          self.status_postings_key: index.posting_count,
+                          self.status_size_bytes_key: index.size_bytes,
+                          self.status_partitions_key: partitions})
+        return stats
+
+    def __build_and_tail(self):
+        """
+        Build a new index from the last 'max.messages.per.partition' messages of each partition, replace the
+        serving index once caught up with the high watermarks captured at build start, then keep tailing until
+        a rebuild is due.
+        """
+        consumer = ConsumerConnectionManager.initialize_kafka_consumer(self.environment)
+        try:
+            decode = self.__build_decoder()
+            topic_metadata = ConsumerConnectionManager.get_topic_metadata(self.environment).get(self.topic)
+            if topic_metadata is None:
+                raise ErrorHandler("Application does not have access to indexed topic: " + self.topic)
+            partition_ids = [partition.id for partition in topic_metadata.partitions.values()]
+            build_watermarks = {partition_id: consumer.get_watermark_offsets(
+                TopicPartition(self.topic, partition_id), timeout=float(self.default_offsets_lookup_timeout))
+                for partition_id in partition_ids}
+            self.high_watermarks.update({partition_id: high_offset
+                                         for partition_id, (low_offset, high_offset) in build_watermarks.items()})
+            index = TopicIndex({partition_id: max(low_offset, high_offset - self.max_messages)
+                                for partition_id, (low_offset, high_offset) in build_watermarks.items()})
+            self.state = 'building' if self.index is None else 'rebuilding'
+            self.error = None
+            build_started = time.monotonic()
+            built = False
+            next_refresh = build_started + self.default_refresh_seconds
+            batch_size, batch_timeout = self.__resolve_batch_settings()
+            topic_partitions = [TopicPartition(self.topic, partition_id, index.start_offsets[partition_id])
+                                for partition_id in partition_ids]
+            consumer.assign(topic_partitions)
+            while not self.stopped.is_set():
+                msgs = consumer.consume(batch_size, batch_timeout)
+                indexed_msgs = {}
+                for msg in msgs:
+                    if msg.error():
+                        continue
+                    words = set()
+                    try:
+                        words = TopicIndex.tokenize(str(decode(msg)).lower())
+                    except Exception:
+                        # Messages that cannot be decoded never match a search
+                        pass
+                    indexed_msgs.setdefault(msg.partition(), []).append((msg.offset(), words))
+                for partition_id, partition_msgs in indexed_msgs.items():
+                    index.add(partition_id, partition_msgs, partition_msgs[-1][0] + 1)
+                if not msgs:
+                    # Remaining offsets may be transaction markers, move up to the consumer's position
+                    for topic_partition in consumer.position(topic_partitions):
+                        if topic_partition.offset >= 0:
+                            index.add(topic_partition.partition, [], topic_partition.offset)
+
+                if not built and all(index.next_offsets[partition_id] >= high_offset
+                                     for partition_id, (low_offset, high_offset) in build_watermarks.items()):
+                    built = True
+                    self.index = index
+                    self.builds += 1
+                    self.last_build_seconds = round(time.monotonic() - build_started, 3)
+                    self.state = 'ready'
+                if time.monotonic() >= next_refresh:
+                    next_refresh = time.monotonic() + self.default_refresh_seconds
+                    if self.__rebuild_due(consumer, index, partition_ids, build_started):
+                        return
+        finally:
+            consumer.close()
+
+    def __rebuild_due(self, consumer, index, partition_ids, build_started):
+        for partition_id in partition_ids:
+            low_offset, high_offset = consumer.get_watermark_offsets(TopicPartition(self.topic, partition_id),
+                                                                     cached=True)
+            if high_offset >= 0:
+                if high_offset < index.next_offsets[partition_id]:
+                    # Topic recreated
+                    return True
+                self.high_watermarks[partition_id] = high_offset
+        if time.monotonic() - build_started > self.rebuild_interval:
+            return True
+        return any(index.next_offsets[partition_id] - index.start_offsets[partition_id] > 2 * self.max_messages
+                   for partition_id in partition_ids)
+
+    def __build_decoder(self):
+        """:return: callable(confluent_kafka.Message()) returning the message as decoded by the search parsers"""
+        if self.message_type == 'avro':
+            avro_client = AvroClient(self.environment)
+            avro_client.load_deserializer(self.topic)
+            return avro_client.convert_avro_msg
+        return lambda msg: json.loads(msg.value())
+
+    def __resolve_batch_settings(self):
+        config = ConnectionConfig.connection_details or {}
+        return (int(config.get(self.config_consume_batch_size_key, self.default_consume_batch_size)),
+                float(config.get(self.config_consume_timeout_key, self.default_consume_timeout)))
@@ -1,7 +1,15 @@
-from flask import jsonify, request, render_template, Blueprint
+import json
+import time
+
+from flask import jsonify, request, render_template, Blueprint, Response
 
 import constants
+from avro_client import AvroClient
 from request_handler import RequestHandler
+from result_cache import ResultCache
+from search_admission import SearchAdmission
+from search_metrics import SearchMetrics
+from token_index import TokenIndex
 
 view = Blueprint('view', __name__, url_prefix='')
 
@@ -16,8 +24,116 @@ def welcome():
 @view.route('/search', methods=['POST'])
 def search():
     response_error_key = constants.RESPONSE_ERROR_KEY
+    started = time.perf_counter()
     try:
         # Process request and return final list of json objects
-        return jsonify(RequestHandler.process_request(request))
+        result = RequestHandler.process_request(request)
+    except Exception as e:
+        SearchMetrics.record_request(request.path, time.perf_counter() - started, error=True)
+        return jsonify({response_error_key: str(e)})
+    search_seconds = time.perf_counter() - started
+    response = jsonify(result)
+    SearchMetrics.record_request(request.path, search_seconds, time.perf_counter() - started - search_seconds)
+    return response
+
+
+@view.route('/search/stream', methods=['POST'])
+def search_stream():
+    """Streaming variant of /search, one json record per line (NDJSON) written as soon as it is found"""
+    response_error_key = constants.RESPONSE_ERROR_KEY
+    try:
+        records = RequestHandler.stream_request(request)
+    except Exception as e:
+        return jsonify({response_error_key: str(e)})
+    # default=str, avro records may include datetime/decimal values
+    return Response((json.dumps(record, default=str) + "\n" for record in records), mimetype=constants.STREAM_MIMETYPE)
+
+
+@view.route('/search/estimate', methods=['POST'])
+def search_estimate():
+    """
+    Partition count, messages, estimated bytes and time window coverage of every requested topic, and the estimated
+    cost of the search, from topic offsets only. Same params as /search, search terms are optional
+    """
+    response_error_key = constants.RESPONSE_ERROR_KEY
+    try:
+        return jsonify(RequestHandler.estimate_request(request))
+    except Exception as e:
+        return jsonify({response_error_key: str(e)})
+
+
+@view.route('/search/jobs', methods=['POST'])
+def search_job_submit():
+    """Start a background search, same params as /search. Returns the job status including its job id"""
+    response_error_key = constants.RESPONSE_ERROR_KEY
+    try:
+        return jsonify(RequestHandler.submit_job(request))
     except Exception as e:
         return jsonify({response_error_key: str(e)})
+
+
+@view.route('/search/jobs/<job_id>', methods=['GET'])
+def search_job_status(job_id):
+    """State of a background search and its progress per topic"""
+    response_error_key = constants.RESPONSE_ERROR_KEY
+    try:
+        return jsonify(RequestHandler.job_status(job_id))
+    except Exception as e:
+        return jsonify({response_error_key: str(e)})
+
+
+@view.route('/search/jobs/<job_id>/results', methods=['GET'])
+def search_job_results(job_id):
+    """Matches found so far (partial while the job runs) or final results of a background search"""
+    response_error_key = constants.RESPONSE_ERROR_KEY
+    try:
+        return jsonify(RequestHandler.job_results(job_id))
+    except Exception as e:
+        return jsonify({response_error_key: str(e)})
+
+
+@view.route('/search/jobs/<job_id>/cancel', methods=['POST'])
+def search_job_cancel(job_id):
+    """Stop a background search, matches found so far are kept"""
+    response_error_key = constants.RESPONSE_ERROR_KEY
+    try:
+        return jsonify(RequestHandler.cancel_job(job_id))
+    except Exception as e:
+        return jsonify({response_error_key: str(e)})
+
+
+@view.route('/index/status', methods=['GET'])
+def index_status():
+    """State, lag, size and build time of the background token index of each indexed topic"""
+    return jsonify(TokenIndex.stats())
+
+
+@view.route('/cache/status', methods=['GET'])
+def cache_status():
+    """Search result cache hit/miss counts (per partition), entries and estimated memory use"""
+    return jsonify(ResultCache.stats())
+
+
+@view.route('/admission/status', methods=['GET'])
+def admission_status():
+    """Running and queued searches per environment and client, with the environment's admission limits"""
+    return jsonify(SearchAdmission.status())
+
+
+@view.route('/metrics', methods=['GET'])
+def metrics():
+    """Search request and topic scan metrics, in the Prometheus text exposition format"""
+    return Response(SearchMetrics.render(), content_type=constants.METRICS_CONTENT_TYPE)
+
+
+@view.route('/avro/invalidate', methods=['POST'])
+def avro_invalidate():
+    """
+    Drop cached avro deserializers, schema strings and registry clients (all, or those of the given environment
+    and/or topic), e.g. after a schema file or registry certificate changed
+    """
+    params = {**request.form.to_dict(), **request.args.to_dict(), **(request.get_json(silent=True) or {})}
+    environment = params.get(constants.REQUEST_ENVIRONMENT_KEY)
+    topic = params.get(constants.REQUEST_TOPIC_KEY)
+    AvroClient.invalidate_cache(environment.strip().lower() if environment else None, topic or None)
+    return jsonify({constants.REQUEST_ENVIRONMENT_KEY: environment, constants.REQUEST_TOPIC_KEY: topic})